@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import defaultdict
+
+from uclapi.settings import (
+    ADMISSION_LIMITS,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE_TIME,
+    ADMISSION_RETRY_AFTER
+)
+
+from .helpers import PrettyJsonResponse as JsonResponse
+from .metrics import increment_counter
+
+
+def get_queue_time(request):
+    """
+    Returns how many seconds a request waited for a worker, from the
+    X-Request-Start header that nginx sets to the time it received the
+    request, as "t=<seconds since the epoch>". Returns None if the header
+    is missing or malformed.
+    """
+    header = request.META.get("HTTP_X_REQUEST_START")
+    if not header:
+        return None
+    if header.startswith("t="):
+        header = header[2:]
+    try:
+        started = float(header)
+    except ValueError:
+        return None
+    # The proxy's clock may be slightly ahead of ours
+    return max(time.time() - started, 0)
+
+
+class AdmissionController:
+    """
+    Limits how many protected requests to each service this process handles
+    at once, so that requests to a service whose upstream has slowed down
+    are turned away before they can tie up every worker, and requests that
+    have waited so long for a worker that the client has probably given up
+    are not started at all.
+    """
+    def __init__(self, limits, default_limit, max_queue_time):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.max_queue_time = max_queue_time
+
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def limit(self, service):
+        return self.limits.get(service, self.default_limit)
+
+    def in_flight(self, service):
+        return self._in_flight[service]
+
+    def acquire(self, service, queue_time=None):
+        """
+        Admits a request to a service, returning None if it was admitted,
+        in which case release must be called once it has been handled, or
+        the reason it was shed.
+        """
+        if (
+            self.max_queue_time and
+            queue_time is not None and
+            queue_time > self.max_queue_time
+        ):
+            return "queue_time"
+
+        limit = self.limit(service)
+        with self._lock:
+            if limit and self._in_flight[service] >= limit:
+                return "in_flight"
+            self._in_flight[service] += 1
+        return None
+
+    def release(self, service):
+        with self._lock:
+            self._in_flight[service] -= 1
+
+
+admission_controller = AdmissionController(
+    ADMISSION_LIMITS,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE_TIME
+)
+
+
+def shed_response(service, reason):
+    """
+    Returns the response to a request that was not admitted, and counts it
+    in the metrics.
+    """
+    increment_counter("uclapi_requests_shed_total", (service, reason))
+
+    response = JsonResponse({
+        "ok": False,
+        "error": "This service is currently overloaded. "
+                 "Please try again in {} seconds."
+                 .format(ADMISSION_RETRY_AFTER)
+    })
+    response.status_code = 503
+    response['Retry-After'] = ADMISSION_RETRY_AFTER
+    return response
@@ -0,0 +1,197 @@
+import gzip
+import logging
+import zlib
+
+import redis
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from uclapi.settings import COMPRESSION_MIN_SIZE, PRECOMPRESSED_CACHE_TTL
+
+from .helpers import pretty_response
+from .redis_client import get_redis
+from .timing import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Content codings we can produce, most preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Responses compressed on the fly use fast settings. Precompressed ones are
+# only compressed once per data generation, so use the best compression.
+_FAST = {"br": 4, "gzip": 6}
+_BEST = {"br": 9, "gzip": 9}
+
+# Other types, such as PNG images, are compressed already
+_COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/x-msgpack",
+    "application/x-ndjson",
+    "application/xml",
+    "image/svg+xml"
+)
+
+
+def negotiate_encoding(request):
+    """
+    Returns the content coding to compress the response to a request with,
+    as chosen from its Accept-Encoding header, or None to not compress it.
+    """
+    qvalues = {}
+    for coding in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = coding.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name.strip().lower()] = q
+
+    best = None
+    for encoding in ENCODINGS:
+        q = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def _is_compressible(content_type):
+    content_type = content_type.split(";")[0].strip().lower()
+    return (
+        content_type.startswith("text/") or
+        content_type.endswith(("+json", "+xml")) or
+        content_type in _COMPRESSIBLE_TYPES
+    )
+
+
+def compress(content, encoding, best=False):
+    quality = (_BEST if best else _FAST)[encoding]
+    if encoding == "br":
+        return brotli.compress(content, quality=quality)
+    return gzip.compress(content, compresslevel=quality, mtime=0)
+
+
+def _compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=_FAST["br"])
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+
+    # A wbits of 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(_FAST["gzip"], zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _set_encoding_headers(response, encoding):
+    response["Content-Encoding"] = encoding
+    if response.streaming:
+        # The length is not known until the response has been sent
+        if response.has_header("Content-Length"):
+            del response["Content-Length"]
+    else:
+        response["Content-Length"] = str(len(response.content))
+    patch_vary_headers(response, ("Accept-Encoding",))
+
+    # As in Django's GZipMiddleware, the compressed bytes differ from those
+    # the strong ETag was generated for, so it can only be a weak one
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response["ETag"] = "W/" + etag
+
+
+def compress_response(response, encoding, best=False):
+    """
+    Compresses a response in place if it is large enough to be worth it and
+    is not already compressed. Returns whether it was compressed.
+    Streaming responses are compressed as they are sent, whatever their size.
+    """
+    if (
+        response.has_header("Content-Encoding") or
+        not _is_compressible(response.get("Content-Type", "")) or
+        (
+            not response.streaming and
+            len(response.content) < COMPRESSION_MIN_SIZE
+        )
+    ):
+        return False
+
+    if response.streaming:
+        response.streaming_content = _compress_stream(
+            response.streaming_content,
+            encoding
+        )
+    else:
+        with timed("compress"):
+            response.content = compress(response.content, encoding, best)
+    _set_encoding_headers(response, encoding)
+    return True
+
+
+def _precompressed_key(etag, encoding):
+    return "precompressed:{}:{}".format(encoding, etag.strip('"'))
+
+
+def get_precompressed(etag, encoding, custom_header_data=None):
+    """
+    Returns a response holding the body cached for an ETag, already
+    compressed with encoding, or None if it is not cached.
+    """
+    try:
+        cached = get_redis().hgetall(_precompressed_key(etag, encoding))
+    except redis.exceptions.RedisError:
+        logger.warning("Could not read a precompressed response.", exc_info=True)
+        return None
+    if not cached:
+        return None
+
+    response = HttpResponse(
+        cached[b"body"],
+        content_type=cached[b"content_type"].decode("utf-8")
+    )
+    pretty_response(response, custom_header_data=custom_header_data)
+    _set_encoding_headers(response, encoding)
+    return response
+
+
+def set_precompressed(etag, encoding, response):
+    """
+    Caches the compressed body of a successful response under its ETag.
+    The ETag changes with every data generation, so stale bodies are never
+    served and are left to expire.
+    """
+    if (
+        response.streaming or
+        response.status_code != 200 or
+        response.get("Content-Encoding") != encoding
+    ):
+        return
+
+    try:
+        key = _precompressed_key(etag, encoding)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "content_type": response["Content-Type"],
+            "body": response.content
+        })
+        pipe.expire(key, PRECOMPRESSED_CACHE_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        logger.warning("Could not cache a precompressed response.", exc_info=True)
@@ -1,21 +1,61 @@
+import asyncio
 import ciso8601
 import datetime
+import hashlib
+import math
 import pytz
 import re
-import redis
 
 from datetime import timezone
 from email.utils import format_datetime
 from functools import wraps
 
-from dashboard.models import App, APICall
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import parse_etags, parse_http_date_safe, urlencode
+
+from dashboard.api_call_log import enqueue_api_call
+from dashboard.models import App, User
 
 from oauth.models import OAuthToken
 from oauth.scoping import Scopes
 
-from .helpers import PrettyJsonResponse as JsonResponse
-
-from uclapi.settings import REDIS_UCLAPI_HOST
+from uclapi.settings import NOT_MODIFIED_COUNTS_TOWARDS_QUOTA
+
+from .admission import admission_controller, get_queue_time, shed_response
+from .compression import (
+    compress_response,
+    get_precompressed,
+    negotiate_encoding,
+    set_precompressed
+)
+from .helpers import PrettyJsonResponse as JsonResponse, pretty_response
+from .metrics import count_db_queries, measure_request, record_request
+from .timing import current_timer, lap
+from .redis_client import (
+    AUTH_TAG,
+    auth_key,
+    get_redis,
+    hash_tag,
+    last_modified_key
+)
+from .rendering import pretty_json
+from .signed_tokens import (
+    REVOKED_TOKENS_KEY,
+    SignedApp,
+    SignedOAuthToken,
+    is_signed_token,
+    parse_app_token,
+    parse_oauth_token
+)
+from .token_cache import (
+    CachedApp,
+    CachedOAuthToken,
+    CachedUser,
+    token_cache
+)
 
 
 # Gets a variable from GET or POST not caring which is which
@@ -46,10 +86,15 @@ def how_many_seconds_until_midnight():
     return (midnight - datetime.datetime.now()).seconds
 
 
-def log_api_call(request, token, token_type):
-    """This functions handles logging of api calls."""
+def _get_service_and_method(request):
     service = request.path.split("/")[1]
     method = "/".join(request.path.split("/")[2:])
+    return (service, method)
+
+
+def log_api_call(request, token, token_type):
+    """This functions handles logging of api calls."""
+    service, method = _get_service_and_method(request)
 
     headers = request.META
     version_headers = {}
@@ -75,16 +120,18 @@ def log_api_call(request, token, token_type):
         #     "temp_token": False,
         #     "token_type": token_type
         # }
+        # Only ids are used so that cached tokens can be logged without
+        # loading their rows. The call is queued and saved in a batch later.
         if token_type == "general":
-            call_log = APICall(app=token, user=token.user, token=None,
-                               token_type=token_type, service=service,
-                               method=method, queryparams=queryparams)
-            call_log.save()
+            enqueue_api_call(app_id=token.id, user_id=token.user_id,
+                             token_id=None, token_type=token_type,
+                             service=service, method=method,
+                             queryparams=str(queryparams))
         else:
-            call_log = APICall(app=token.app, user=token.user, token=token,
-                               token_type=token_type, service=service,
-                               method=method, queryparams=queryparams)
-            call_log.save()
+            enqueue_api_call(app_id=token.app_id, user_id=token.user_id,
+                             token_id=token.id, token_type=token_type,
+                             service=service, method=method,
+                             queryparams=str(queryparams))
 
     # elif token_type == "general-temp":
     #     parameters = {
@@ -97,43 +144,277 @@ def log_api_call(request, token, token_type):
     #     }
 
 
-def throttle_api_call(token, token_type):
+# Performs every Redis operation needed to authorise a request atomically
+# and in a single round trip.
+# KEYS[1] is the throttle counter, KEYS[2] a temporary token that must exist,
+# KEYS[3] a Last-Modified key, KEYS[4] the token's burst limit hash and
+# KEYS[5] the set of revoked signed tokens. Any of KEYS[2] to KEYS[5] that
+# are not needed are given as KEYS[6], which is just the hash tag of the
+# keys (an empty string outside cluster mode) so that all of the keys are
+# in the same slot.
+# ARGV[1] is the quota, ARGV[2] the TTL to give a brand new counter and
+# ARGV[3] is '0' if the call should only be checked and not counted.
+# ARGV[4] is the number n of members of the revoked set that would each
+# revoke the token, ARGV[5] to ARGV[4 + n] are those members and the rest
+# are pairs of burst limit and period in seconds, where a limit of 0 means
+# that there is no limit.
+# Returns {count, last_modified} where count is the number of calls made
+# before this one, -1 if the temporary token does not exist or -2 if the
+# token has been revoked.
+# If the call was counted then it is followed by 1 if the call exceeded a
+# burst limit or 0 if not, and then by the limit, calls remaining and
+# milliseconds until the bucket is full (or the call may be retried) for
+# the exceeded burst limit, or for every burst limit if none were.
+#
+# Each burst limit is a token bucket implemented with the generic cell rate
+# algorithm, which only has to store the time (in microseconds) at which
+# the bucket will next be full.
+AUTH_SCRIPT = """
+local none = KEYS[6]
+local last_modified = false
+if KEYS[3] ~= none then
+    last_modified = redis.call('GET', KEYS[3])
+end
+
+if KEYS[2] ~= none and redis.call('EXISTS', KEYS[2]) == 0 then
+    return {-1, last_modified}
+end
+
+local bursts = 5 + tonumber(ARGV[4])
+if KEYS[5] ~= none then
+    for i = 5, bursts - 1 do
+        if redis.call('SISMEMBER', KEYS[5], ARGV[i]) == 1 then
+            return {-2, last_modified}
+        end
+    end
+end
+
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if ARGV[3] == '0' or count >= tonumber(ARGV[1]) then
+    return {count, last_modified}
+end
+
+local windows = {}
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+local expiry = 0
+for i = bursts, #ARGV, 2 do
+    local limit = tonumber(ARGV[i])
+    if limit > 0 and KEYS[4] ~= none then
+        local period = tonumber(ARGV[i + 1]) * 1000000
+        local interval = period / limit
+        local full_at = tonumber(redis.call('HGET', KEYS[4], ARGV[i + 1]) or 0)
+        local next_full_at = math.max(full_at, now) + interval
+        local allowed_at = next_full_at - period
+        if now < allowed_at then
+            return {
+                count, last_modified, 1,
+                limit, 0, math.ceil((allowed_at - now) / 1000)
+            }
+        end
+        table.insert(windows, {
+            ARGV[i + 1], next_full_at, limit,
+            math.floor((now - allowed_at) / interval)
+        })
+        expiry = math.max(expiry, next_full_at - now)
+    end
+end
+
+if count == 0 then
+    redis.call('SET', KEYS[1], 1, 'EX', ARGV[2])
+else
+    redis.call('INCR', KEYS[1])
+end
+
+local result = {count, last_modified, 0}
+for _, window in ipairs(windows) do
+    redis.call('HSET', KEYS[4], window[1], string.format('%d', window[2]))
+    table.insert(result, window[3])
+    table.insert(result, window[4])
+    table.insert(result, math.ceil((window[2] - now) / 1000))
+end
+if expiry > 0 then
+    redis.call('PEXPIRE', KEYS[4], math.ceil(expiry / 1000))
+end
+
+return result
+"""
+
+_auth_script = get_redis().register_script(AUTH_SCRIPT)
+
+
+def _get_burst_key_and_limits(token, token_type):
+    """
+    Returns the key of the token's burst limit hash and a list of
+    (limit, period in seconds) pairs, or (None, []) if the token has no
+    burst limits.
+    """
+    if token_type == 'general':
+        key = auth_key("burst:app:{}".format(token.id))
+    elif token_type == 'oauth':
+        key = auth_key("burst:oauth:{}".format(token.id))
+    else:
+        # Temporary and test tokens are only allowed a handful of calls
+        return (None, [])
+
+    return (key, [
+        (token.user.burst_limit_per_second, 1),
+        (token.user.burst_limit_per_minute, 60)
+    ])
+
+
+def _get_throttle_key_and_limit(token, token_type):
     if token_type == 'general':
-        cache_key = token.user.email
-        limit = token.user.dev_quota
+        return (auth_key(token.user.email), token.user.dev_quota)
     elif token_type == 'general-temp':
-        cache_key = token
-        limit = 10
+        return (auth_key(token), 10)
     elif token_type == 'oauth':
-        cache_key = "oauth:" + token.user.email
-        limit = token.user.oauth_quota
+        return (auth_key("oauth:" + token.user.email), token.user.oauth_quota)
     elif token_type == 'test-token':
-        cache_key = token
-        limit = 1
+        return (auth_key(token), 1)
     else:
         raise UclApiIncorrectTokenTypeException
 
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
-    count_data = r.get(cache_key)
+
+def _authorise_api_call(
+    token,
+    token_type,
+    temp_token=None,
+    last_modified_redis_key=None,
+    count_call=True,
+    revocations=()
+):
+    """
+    Checks that a temporary token (if given) exists, that a signed token has
+    not been revoked, counts the call against the daily quota (unless
+    count_call is False) and fetches the raw Last-Modified value, all in one
+    round trip to Redis.
+    Returns (token_valid, throttle_data, last_modified_value)
+    where throttle_data is as returned by throttle_api_call.
+    """
+    cache_key, limit = _get_throttle_key_and_limit(token, token_type)
+    burst_key, burst_limits = _get_burst_key_and_limits(token, token_type)
 
     secs = how_many_seconds_until_midnight()
-    if count_data is None:
-        # Conditional fixes bug where a call is made exactly at midnight.
-        # Redis cannot have key with TTL of 0
-        r.set(cache_key, 1, secs if secs > 0 else 86400)
-        return (False, limit, limit - 1, secs)
+    # Conditional fixes bug where a call is made exactly at midnight.
+    # Redis cannot have key with TTL of 0
+    args = [limit, secs if secs > 0 else 86400, '1' if count_call else '0']
+    args.append(len(revocations))
+    args.extend(revocations)
+    for burst_limit in burst_limits:
+        args.extend(burst_limit)
+
+    no_key = hash_tag(AUTH_TAG)
+    result = _auth_script(
+        keys=[
+            cache_key,
+            auth_key(temp_token) if temp_token else no_key,
+            (
+                last_modified_key(last_modified_redis_key)
+                if last_modified_redis_key else no_key
+            ),
+            burst_key or no_key,
+            REVOKED_TOKENS_KEY if revocations else no_key,
+            no_key
+        ],
+        args=args
+    )
+    count, last_modified = result[:2]
+
+    if count < 0:
+        return (False, None, last_modified)
+
+    if not count_call:
+        throttle_data = (count >= limit, limit, max(limit - count, 0), secs)
+    elif count == 0:
+        throttle_data = (False, limit, limit - 1, secs)
+    elif count >= limit:
+        throttle_data = (True, limit, limit - count, secs)
     else:
-        count = int(count_data)
-        if count >= limit:
-            return (True, limit, limit - count, secs)
-        else:
-            r.incr(cache_key)
-            return (False, limit, limit - count, secs)
+        throttle_data = (False, limit, limit - count, secs)
+
+    if len(result) > 2:
+        burst_throttled = result[2] == 1
+        # Report whichever limit is closest to being reached
+        for i in range(3, len(result), 3):
+            burst_limit, remaining, reset_ms = result[i:i + 3]
+            if burst_throttled or remaining < throttle_data[2]:
+                throttle_data = (
+                    burst_throttled,
+                    burst_limit,
+                    remaining,
+                    math.ceil(reset_ms / 1000)
+                )
+
+    return (True, throttle_data, last_modified)
+
+
+def throttle_api_call(token, token_type):
+    _, throttle_data, _ = _authorise_api_call(token, token_type)
+    return throttle_data
+
+
+def _get_signed_token_user(claims):
+    """
+    Resolves the owner of a signed token from its claims, preferring the
+    process-local cache. Returns None if the token was not validly signed
+    or the user does not exist.
+    """
+    if claims is None:
+        return None
+
+    try:
+        return token_cache.get(
+            "user:{}".format(claims["user_id"]),
+            lambda: CachedUser(User.objects.get(id=claims["user_id"]))
+        )
+    except User.DoesNotExist:
+        return None
+
+
+def _get_oauth_token(token_code):
+    """Resolves an OAuth token, preferring the process-local cache."""
+    if is_signed_token(token_code):
+        claims = parse_oauth_token(token_code)
+        user = _get_signed_token_user(claims)
+        if user is None:
+            raise OAuthToken.DoesNotExist
+        return SignedOAuthToken(token_code, claims, user)
+
+    # A single query fetches everything the checks below need.
+    return token_cache.get(
+        token_code,
+        lambda: CachedOAuthToken(
+            OAuthToken.objects.select_related(
+                'app', 'user', 'scope'
+            ).get(token=token_code)
+        )
+    )
+
+
+def _get_general_token(token_code):
+    """Resolves a general (App) token, preferring the process-local cache."""
+    if is_signed_token(token_code):
+        claims = parse_app_token(token_code)
+        user = _get_signed_token_user(claims)
+        if user is None:
+            raise App.DoesNotExist
+        return SignedApp(token_code, claims, user)
+
+    return token_cache.get(
+        token_code,
+        lambda: CachedApp(
+            App.objects.select_related('user').get(
+                api_token=token_code,
+                deleted=False
+            )
+        )
+    )
 
 
 def _check_oauth_token_issues(token_code, client_secret, required_scopes):
     try:
-        token = OAuthToken.objects.get(token=token_code)
+        token = _get_oauth_token(token_code)
     except OAuthToken.DoesNotExist:
         response = JsonResponse({
             "ok": False,
@@ -142,7 +423,7 @@ def _check_oauth_token_issues(token_code, client_secret, required_scopes):
         response.status_code = 400
         return response
 
-    if token.app.client_secret != client_secret:
+    if not token.client_secret_matches(client_secret):
         response = JsonResponse({
             "ok": False,
             "error": "Client secret incorrect."
@@ -160,7 +441,7 @@ def _check_oauth_token_issues(token_code, client_secret, required_scopes):
         response.status_code = 400
         return response
 
-    if token.app.deleted:
+    if token.app_deleted:
         response = JsonResponse({
             "ok": False,
             "error":
@@ -172,7 +453,7 @@ def _check_oauth_token_issues(token_code, client_secret, required_scopes):
 
     scopes = Scopes()
     for s in required_scopes:
-        if not scopes.check_scope(token.scope.scope_number, s):
+        if not scopes.check_scope(token.scope_number, s):
             response = JsonResponse({
                 "ok": False,
                 "error":
@@ -186,12 +467,7 @@ def _check_oauth_token_issues(token_code, client_secret, required_scopes):
     return token
 
 
-def _check_temp_token_issues(
-    token_code,
-    personal_data,
-    request_path,
-    page_token=None
-):
+def _check_temp_token_request(personal_data, request_path, page_token=None):
     # The token is a generic one, so sanity check
     if personal_data:
         response = JsonResponse({
@@ -201,16 +477,6 @@ def _check_temp_token_issues(
         response.status_code = 400
         return response
 
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
-
-    if not r.get(token_code):
-        response = JsonResponse({
-            "ok": False,
-            "error": "Temporary token is either invalid or expired."
-        })
-        response.status_code = 400
-        return response
-
     if request_path != "/roombookings/bookings":
         response = JsonResponse({
             "ok": False,
@@ -229,8 +495,26 @@ def _check_temp_token_issues(
         })
         response.status_code = 400
         return response
-    # No issues, so return the temporary token
-    return token_code
+
+    return None
+
+
+def _temp_token_invalid_response():
+    response = JsonResponse({
+        "ok": False,
+        "error": "Temporary token is either invalid or expired."
+    })
+    response.status_code = 400
+    return response
+
+
+def _revoked_token_response():
+    response = JsonResponse({
+        "ok": False,
+        "error": "The token has been revoked."
+    })
+    response.status_code = 400
+    return response
 
 
 def _check_general_token_issues(token_code, personal_data):
@@ -244,10 +528,7 @@ def _check_general_token_issues(token_code, personal_data):
         return response
 
     try:
-        token = App.objects.get(
-            api_token=token_code,
-            deleted=False
-        )
+        token = _get_general_token(token_code)
     except App.DoesNotExist:
         response = JsonResponse({
             "ok": False,
@@ -260,53 +541,220 @@ def _check_general_token_issues(token_code, personal_data):
     return token
 
 
-def _get_last_modified_header(redis_key=None):
-    # Default last modified is the UTC time now
-    last_modified = format_datetime(
-        datetime.datetime.utcnow().replace(tzinfo=timezone.utc),
+def _format_last_modified_header(value=None):
+    """
+    Formats a raw ISO 8601 Last-Modified value from Redis as per the HTTP
+    Header RFC, defaulting to the UTC time now if there is no value.
+    """
+    if not value:
+        return format_datetime(
+            datetime.datetime.utcnow().replace(tzinfo=timezone.utc),
+            usegmt=True
+        )
+
+    # Convert the Redis bytes response to a string.
+    value = value.decode('utf-8')
+
+    # We need the UTC timezone so that we can convert to it.
+    utc_tz = pytz.timezone("UTC")
+
+    # Parse the ISO 8601 timestamp from Redis and represent it as UTC
+    utc_timestamp = ciso8601.parse_datetime(value).astimezone(utc_tz)
+
+    # Format the datetime object as per the HTTP Header RFC.
+    # We replace the inner tzinfo in the timestamp to force it to be a UTC
+    # timestamp as opposed to a naive one; this is a requirement for the
+    # format_datetime function.
+    return format_datetime(
+        utc_timestamp.replace(tzinfo=timezone.utc),
         usegmt=True
     )
 
+
+def _not_modified_since(last_modified, if_modified_since):
+    """
+    Returns whether data last modified at the raw ISO 8601 value from Redis
+    has not changed since if_modified_since, a Unix timestamp.
+    """
+    if not last_modified or if_modified_since is None:
+        return False
+
+    timestamp = ciso8601.parse_datetime(last_modified.decode('utf-8'))
+    # HTTP dates only have whole second precision
+    return int(timestamp.timestamp()) <= if_modified_since
+
+
+def _generate_etag(last_modified, request, token, token_type):
+    """
+    Returns a strong ETag for the response to a request, or None if the
+    data it is served from does not record when it was last modified.
+    The ETag changes whenever the data is regenerated, and differs between
+    requests for different data.
+    """
+    if not last_modified:
+        return None
+
+    # The token and client secret only grant access to the data, so are
+    # not part of what identifies it
+    query = urlencode(sorted(
+        (key, value)
+        for key in request.GET
+        if key not in ('token', 'client_secret')
+        for value in request.GET.getlist(key)
+    ))
+    # Personal data differs from user to user
+    user = token.user_id if token_type == 'oauth' else ''
+    # Indented and compact JSON, and the other formats the data can be
+    # negotiated in, are different representations
+    representation = ' '.join([
+        'pretty' if pretty_json.get() else '',
+        getattr(getattr(request, 'accepted_renderer', None), 'format', '')
+    ])
+
+    digest = hashlib.sha1("\n".join([
+        last_modified.decode('utf-8'),
+        request.path,
+        query,
+        str(user),
+        representation
+    ]).encode('utf-8')).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def _etag_matches(etag, if_none_match):
+    """
+    Compares an ETag with those parsed from an If-None-Match header using
+    the weak comparison required for GET requests.
+    """
+    if '*' in if_none_match:
+        return True
+    return any(
+        candidate[2:] == etag if candidate.startswith('W/')
+        else candidate == etag
+        for candidate in if_none_match
+    )
+
+
+def _get_last_modified_header(redis_key=None):
     # If we haven't been passed a Redis key, we just return the
     # current timeztamp as a last modified header.
     if redis_key is None:
-        return last_modified
+        return _format_last_modified_header()
 
     # We have been given a Redis key, so attempt to pull it from Redis
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
-    redis_key = "http:headers:Last-Modified:" + redis_key
-    value = r.get(redis_key)
-
-    if value:
-        # Convert the Redis bytes response to a string.
-        value = value.decode('utf-8')
-
-        # We need the UTC timezone so that we can convert to it.
-        utc_tz = pytz.timezone("UTC")
-
-        # Parse the ISO 8601 timestamp from Redis and represent it as UTC
-        utc_timestamp = ciso8601.parse_datetime(value).astimezone(utc_tz)
-
-        # Format the datetime object as per the HTTP Header RFC.
-        # We replace the inner tzinfo in the timestamp to force it to be a UTC
-        # timestamp as opposed to a naive one; this is a requirement for the
-        # format_datetime function.
-        last_modified = format_datetime(
-            utc_timestamp.replace(tzinfo=timezone.utc),
-            usegmt=True
-        )
+    r = get_redis()
+    return _format_last_modified_header(r.get(last_modified_key(redis_key)))
+
+
+def _compress(response, encoding, precompressed_etag=None):
+    """
+    Compresses a view's response, caching the compressed bytes under
+    precompressed_etag if one is given. REST framework responses are only
+    rendered after the view returns, so are compressed once they have been.
+    """
+    def compress_rendered(response):
+        precompress = precompressed_etag is not None
+        if compress_response(response, encoding, best=precompress) and precompress:
+            set_precompressed(precompressed_etag, encoding, response)
+
+    if getattr(response, 'is_rendered', True):
+        compress_rendered(response)
+    else:
+        response.add_post_render_callback(compress_rendered)
+
+
+def _shed(request, service):
+    """
+    Returns the response to shed a request with, or None if it has been
+    admitted, in which case it must be released once it has been handled.
+    Requests are shed before they are authorised, so that turning them away
+    is as cheap as possible and uses none of the quota.
+    """
+    reason = admission_controller.acquire(service, get_queue_time(request))
+    if reason is None:
+        return None
+    return shed_response(service, reason)
+
+
+def simple_api_view(http_method_names=('GET',)):
+    """
+    A lighter alternative to REST framework's api_view for endpoints that
+    only read request.GET and return their own responses, so need none of
+    its request wrapping, authentication or content negotiation. Unlike
+    api_view, it can be applied to async views.
+    Requests with any other method are refused as api_view would.
+    """
+    allowed = [method.upper() for method in http_method_names]
+
+    def method_not_allowed(request):
+        response = JsonResponse({
+            "okay": False,
+            "error": 'Method "{}" not allowed.'.format(request.method)
+        })
+        response.status_code = 405
+        response['Allow'] = ", ".join(allowed)
+        return response
+
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapped(request, *args, **kwargs):
+                if request.method not in allowed:
+                    return method_not_allowed(request)
+                return await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def wrapped(request, *args, **kwargs):
+                if request.method not in allowed:
+                    return method_not_allowed(request)
+                return view_func(request, *args, **kwargs)
+
+        # As with csrf_exempt, which would hide that the view is async
+        wrapped.csrf_exempt = True
+        return wrapped
+    return decorator
 
-    return last_modified
+
+def _add_server_timing(request, response, timer):
+    # How long each phase took says a lot about how requests are handled,
+    # so it is only sent to clients that ask for it with X-Server-Timing
+    patch_vary_headers(response, ('X-Server-Timing',))
+    if request.META.get('HTTP_X_SERVER_TIMING'):
+        response['Server-Timing'] = timer.server_timing()
 
 
 def uclapi_protected_endpoint(
     personal_data=False,
     required_scopes=[],
-    last_modified_redis_key='gencache'
+    last_modified_redis_key='gencache',
+    precompress=False
 ):
+    """
+    Authorises and throttles requests to an API endpoint.
+    Set precompress for endpoints whose responses are large and depend on
+    nothing but the request and the data generation, so that they are only
+    compressed once per generation and can then be served without running
+    the view.
+    """
     def check_request(view_func):
-        @wraps(view_func)
-        def wrapped(request, *args, **kwargs):
+        def compression(request, kwargs):
+            """
+            Returns the encoding to compress the response in, if any, and
+            the ETag to store it precompressed under, if it should be.
+            """
+            encoding = negotiate_encoding(request)
+            precompressed_etag = (
+                kwargs.get('ETag')
+                if precompress and encoding is not None else None
+            )
+            return encoding, precompressed_etag
+
+        def authorise(request, kwargs):
+            """
+            Checks the token and quota, and adds the headers and token that
+            the view is given to its kwargs. Returns the response to send
+            instead of running the view, if there is one.
+            """
             # A small sanity check
             # You cannot apply a personal data scope if you are not using
             # a personal data flag
@@ -324,6 +772,7 @@ def uclapi_protected_endpoint(
                 response.status_code = 400
                 return response
 
+            temp_token_check = None
             if token_code.startswith('uclapi-user-'):
                 # The token is an OAuth token, so apply OAuth logic
                 client_secret = get_var(request, 'client_secret')
@@ -351,15 +800,21 @@ def uclapi_protected_endpoint(
                 kwargs['token_type'] = 'oauth'
 
             elif token_code.startswith('uclapi-temp-'):
-                temp_token_check = _check_temp_token_issues(
-                    token_code,
+                if personal_data:
+                    return _check_temp_token_request(
+                        personal_data,
+                        request.path
+                    )
+
+                # Whether the token exists is checked along with the
+                # throttling below to save a round trip to Redis, so any
+                # other issue is only reported once that is known.
+                temp_token_check = _check_temp_token_request(
                     personal_data,
                     request.path,
                     request.GET.get('page_token')
                 )
-                if isinstance(temp_token_check, JsonResponse):
-                    return temp_token_check
-                token = temp_token_check
+                token = token_code
 
                 # This is a horrible hack to force the temporary
                 # token to always return only 1 booking
@@ -398,23 +853,99 @@ def uclapi_protected_endpoint(
             # that the code above all works fine.
             if 'token_type' not in kwargs:
                 raise UclApiIncorrectTokenTypeException
+            lap('auth')
+
+            # A conditional GET can only be answered for data that records
+            # when it was last modified. If-Modified-Since is ignored when
+            # If-None-Match is given, as per RFC 7232.
+            if_none_match = []
+            if_modified_since = None
+            if request.method in ('GET', 'HEAD') and last_modified_redis_key:
+                if_none_match = parse_etags(
+                    request.META.get('HTTP_IF_NONE_MATCH', '')
+                )
+                if not if_none_match:
+                    if_modified_since = parse_http_date_safe(
+                        request.META.get('HTTP_IF_MODIFIED_SINCE')
+                    )
+            conditional = bool(if_none_match) or if_modified_since is not None
+
+            count_call = temp_token_check is None
+            # If 304s are free then the call can only be counted once we
+            # know that the data has changed
+            defer_count = (
+                count_call and
+                conditional and
+                not NOT_MODIFIED_COUNTS_TOWARDS_QUOTA
+            )
+
+            # Check the temporary token, get throttle data and get the raw
+            # last modified header in one go
+            (
+                token_valid,
+                throttle_data,
+                last_modified
+            ) = _authorise_api_call(
+                token,
+                kwargs['token_type'],
+                temp_token=(
+                    token if kwargs['token_type'] == 'general-temp' else None
+                ),
+                last_modified_redis_key=last_modified_redis_key,
+                count_call=count_call and not defer_count,
+                revocations=(
+                    token.revocations()
+                    if kwargs['token_type'] in ('general', 'oauth') else ()
+                )
+            )
+            if not token_valid:
+                if kwargs['token_type'] == 'general-temp':
+                    return _temp_token_invalid_response()
+                return _revoked_token_response()
+            if temp_token_check is not None:
+                return temp_token_check
+
+            etag = _generate_etag(
+                last_modified,
+                request,
+                token,
+                kwargs['token_type']
+            )
+            if if_none_match:
+                not_modified = (
+                    etag is not None and
+                    _etag_matches(etag, if_none_match)
+                )
+            else:
+                not_modified = _not_modified_since(
+                    last_modified,
+                    if_modified_since
+                )
+            if defer_count and not not_modified:
+                _, throttle_data, _ = _authorise_api_call(
+                    token,
+                    kwargs['token_type']
+                )
+            lap('throttle')
 
-            kwargs['token'] = token
+            # A free 304 uses none of the quota, so it can still be served
+            # once the quota has run out
+            free_not_modified = not_modified and defer_count
 
-            # Get throttle data
             (
                 throttled,
                 limit,
                 remaining,
                 reset_secs
-            ) = throttle_api_call(token, kwargs['token_type'])
+            ) = throttle_data
 
-            # Get last modified header
-            kwargs['Last-Modified'] = _get_last_modified_header(
-                last_modified_redis_key
+            kwargs['Last-Modified'] = _format_last_modified_header(
+                last_modified
             )
+            if etag is not None:
+                kwargs['ETag'] = etag
 
-            if throttled:
+            if throttled and not free_not_modified:
                 response = JsonResponse({
                     "ok": False,
                     "error": "You have been throttled. "
@@ -426,14 +957,134 @@ def uclapi_protected_endpoint(
                 response['X-RateLimit-Remaining'] = remaining
                 response['X-RateLimit-Retry-After'] = reset_secs
                 return response
-            else:
-                kwargs['X-RateLimit-Limit'] = limit
-                kwargs['X-RateLimit-Remaining'] = remaining
-                kwargs['X-RateLimit-Retry-After'] = reset_secs
+
+            kwargs['X-RateLimit-Limit'] = limit
+            kwargs['X-RateLimit-Remaining'] = remaining
+            kwargs['X-RateLimit-Retry-After'] = reset_secs
+
+            # The client already has the current data, so there is no need
+            # to run the view at all
+            if not_modified:
+                if not free_not_modified:
+                    log_api_call(request, token, kwargs['token_type'])
+                return pretty_response(
+                    HttpResponseNotModified(),
+                    custom_header_data=kwargs
+                )
 
             # Log the API call before carrying it out
             log_api_call(request, token, kwargs['token_type'])
+            lap('log')
+
+            encoding, precompressed_etag = compression(request, kwargs)
+            if precompressed_etag is not None:
+                response = get_precompressed(
+                    precompressed_etag,
+                    encoding,
+                    custom_header_data=kwargs
+                )
+                if response is not None:
+                    lap('view')
+                    return response
+
+            # Views are given the full model, but it is only loaded from the
+            # database if the view actually uses it. That may be within
+            # read_from_replicas, so it is read from the primary, where a
+            # token that has just been created is sure to be found.
+            if kwargs['token_type'] == 'general':
+                kwargs['token'] = SimpleLazyObject(
+                    lambda: App.objects.using('default').select_related(
+                        'user'
+                    ).get(id=token.id)
+                )
+            elif kwargs['token_type'] == 'oauth':
+                kwargs['token'] = SimpleLazyObject(
+                    lambda: OAuthToken.objects.using('default').select_related(
+                        'app', 'user', 'scope'
+                    ).get(id=token.id)
+                )
+            else:
+                kwargs['token'] = token
+            return None
+
+        def protected_view(request, *args, **kwargs):
+            response = authorise(request, kwargs)
+            if response is not None:
+                return response
+
+            response = view_func(request, *args, **kwargs)
+            lap('view')
+
+            encoding, precompressed_etag = compression(request, kwargs)
+            if encoding is not None:
+                _compress(response, encoding, precompressed_etag)
+            return response
+
+        def authorise_in_thread(request, kwargs):
+            # Database queries are counted per thread
+            with count_db_queries(current_timer.get()):
+                return authorise(request, kwargs)
+
+        async def async_protected_view(request, *args, **kwargs):
+            # Redis and the database are only used synchronously, so the
+            # view is authorised in a thread while the event loop carries
+            # on with other requests
+            response = await sync_to_async(authorise_in_thread)(
+                request,
+                kwargs
+            )
+            if response is not None:
+                return response
+
+            response = await view_func(request, *args, **kwargs)
+            lap('view')
+
+            encoding, precompressed_etag = compression(request, kwargs)
+            if encoding is not None:
+                await sync_to_async(_compress)(
+                    response,
+                    encoding,
+                    precompressed_etag
+                )
+            return response
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            service, method = _get_service_and_method(request)
+            response = _shed(request, service)
+            if response is not None:
+                return response
+
+            try:
+                with measure_request() as timer:
+                    response = protected_view(request, *args, **kwargs)
+            finally:
+                admission_controller.release(service)
+            _add_server_timing(request, response, timer)
+            record_request(service, method, timer)
+            return response
+
+        @wraps(view_func)
+        async def async_wrapped(request, *args, **kwargs):
+            service, method = _get_service_and_method(request)
+            response = _shed(request, service)
+            if response is not None:
+                return response
+
+            try:
+                with measure_request() as timer:
+                    response = await async_protected_view(
+                        request,
+                        *args,
+                        **kwargs
+                    )
+            finally:
+                admission_controller.release(service)
+            _add_server_timing(request, response, timer)
+            await sync_to_async(record_request)(service, method, timer)
+            return response
 
-            return view_func(request, *args, **kwargs)
+        if asyncio.iscoroutinefunction(view_func):
+            return async_wrapped
         return wrapped
     return check_request
@@ -0,0 +1,58 @@
+def parse_fields(value):
+    """
+    Parses the fields parameter, a comma separated list of the fields to
+    include in each item of a response. Nested fields are named by their
+    path, e.g. "module.module_id", and naming a field includes all of it.
+    Returns a dictionary of the selected field names, in which each value is
+    the selection within that field or None if all of it was selected, or
+    None if every field should be included.
+    """
+    if not value:
+        return None
+
+    selection = {}
+    for path in value.split(","):
+        names = [name.strip() for name in path.split(".")]
+        if not all(names):
+            continue
+
+        node = selection
+        for name in names[:-1]:
+            node = node.setdefault(name, {})
+            if node is None:
+                # All of a parent field has already been selected
+                break
+        else:
+            node[names[-1]] = None
+
+    return selection or None
+
+
+def is_selected(selection, path):
+    """
+    Returns whether any of the field at a dotted path is included by a
+    selection from parse_fields, so that values that are expensive to look
+    up are only found when they will be sent.
+    """
+    for name in path.split("."):
+        if selection is None:
+            return True
+        if name not in selection:
+            return False
+        selection = selection[name]
+    return True
+
+
+def select_fields(data, selection):
+    """Returns data with only the fields included by a selection."""
+    if selection is None:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, selection) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: select_fields(value, selection[key])
+        for key, value in data.items()
+        if key in selection
+    }
@@ -0,0 +1,58 @@
+import logging
+
+from django.db.backends.signals import connection_created
+
+try:
+    import eventlet
+    from eventlet import tpool
+    from psycogreen.eventlet import patch_psycopg
+except ImportError:
+    eventlet = None
+
+logger = logging.getLogger(__name__)
+
+
+def _execute_in_thread(execute, sql, params, many, context):
+    return tpool.execute(execute, sql, params, many, context)
+
+
+def _execute_oracle_in_threads(sender, connection, **kwargs):
+    # cx_Oracle cannot hand control back while it waits for the database,
+    # so its queries are run in eventlet's pool of native threads instead.
+    # The wrapper goes first, as connection.execute_wrapper() removes the
+    # last one when the connection is made within it.
+    if (
+        connection.vendor == "oracle" and
+        _execute_in_thread not in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.insert(0, _execute_in_thread)
+
+
+def patch_drivers():
+    """
+    Makes the database and Redis drivers yield to other greenlets while
+    they wait on I/O, so that one slow query does not hold up every request
+    a worker is handling. It must be called once eventlet has monkey-patched
+    the standard library, and before any connections are made.
+
+    psycopg2 is given a wait callback that waits through eventlet's hub.
+    redis-py uses the socket module, so cooperates once that is patched.
+    """
+    if eventlet is None:
+        logger.warning(
+            "eventlet or psycogreen is not installed, so database queries "
+            "will block the worker."
+        )
+        return
+
+    if not eventlet.patcher.is_monkey_patched("socket"):
+        logger.warning(
+            "The socket module has not been monkey-patched, so Redis "
+            "requests will block the worker."
+        )
+
+    patch_psycopg()
+    connection_created.connect(
+        _execute_oracle_in_threads,
+        dispatch_uid="common.green.execute_oracle_in_threads"
+    )
@@ -2,10 +2,14 @@ import datetime
 import os
 import textwrap
 from binascii import hexlify
+from collections.abc import Iterator
 
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from dotenv import read_dotenv as rd
 
+from .rendering import pretty_json, render_json
+from .timing import timed
+
 
 def read_dotenv(path=None):
     if not os.environ.get("DOCKER") == "yes":
@@ -19,6 +23,7 @@ LOCAL_TIMEZONE = (
 )
 
 CUSTOM_HEADERS = [
+    "ETag",
     "Last-Modified",
     "X-RateLimit-Limit",
     "X-RateLimit-Remaining",
@@ -28,8 +33,13 @@ CUSTOM_HEADERS = [
 
 class PrettyJsonResponse(JsonResponse):
     def __init__(self, data, custom_header_data=None):
-        # Calls JsonResponse's constructor and requests 4 line indenting
-        super().__init__(data, json_dumps_params={"indent": 4})
+        # The JSON is compact unless the client asked for it to be indented
+        with timed("render"):
+            HttpResponse.__init__(
+                self,
+                content=render_json(data),
+                content_type="application/json"
+            )
 
         # Adds custom headers from a passed view kwargs
         if custom_header_data:
@@ -38,6 +48,59 @@ class PrettyJsonResponse(JsonResponse):
                     self[header] = custom_header_data[header]
 
 
+# Streamed JSON is sent in chunks of at least this many bytes
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+
+def _stream_json(data, pretty):
+    if pretty:
+        # Indented JSON is only for people reading it, so is never large
+        # enough to be worth streaming
+        yield render_json({
+            key: list(value) if isinstance(value, Iterator) else value
+            for key, value in data.items()
+        }, pretty=True)
+        return
+
+    chunk = bytearray(b"{")
+    for i, (key, value) in enumerate(data.items()):
+        if i:
+            chunk += b","
+        chunk += render_json(str(key), pretty=False) + b":"
+
+        if not isinstance(value, Iterator):
+            chunk += render_json(value, pretty=False)
+            continue
+
+        chunk += b"["
+        for j, item in enumerate(value):
+            if j:
+                chunk += b","
+            chunk += render_json(item, pretty=False)
+            if len(chunk) >= STREAMING_CHUNK_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+        chunk += b"]"
+    chunk += b"}"
+    yield bytes(chunk)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    A JSON object response in which any iterator values are rendered as
+    arrays one item at a time as the response is sent, so that long lists
+    never have to be held in memory in full.
+    """
+    def __init__(self, data, custom_header_data=None):
+        # The choice has to be made now, as the response is only rendered
+        # once the request has been handled
+        super().__init__(
+            _stream_json(data, pretty_json.get()),
+            content_type="application/json"
+        )
+        pretty_response(self, custom_header_data=custom_header_data)
+
+
 def pretty_response(response, custom_header_data=None):
     """
     Identical to PrettyJsonResponse, only instead of extending the class, edits the response directly,
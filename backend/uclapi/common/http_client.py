@@ -0,0 +1,384 @@
+import asyncio
+import http.cookiejar
+import logging
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from uclapi.settings import (
+    HTTP_ASYNC_MAX_CONNECTIONS,
+    HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    HTTP_CIRCUIT_BREAKER_THRESHOLD,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRY_BACKOFF
+)
+
+from .metrics import increment_counter, observe_histogram
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Settings that differ from the defaults for particular upstreams. Those
+# called while a client waits for a response get shorter deadlines.
+UPSTREAMS = {
+    "search": {"read_timeout": 10},
+    "pc_availability": {"read_timeout": 10},
+    "libcal": {"read_timeout": 15},
+    # Webhooks are sent to the URLs developers give us, so one failing
+    # says nothing about the others
+    "webhooks": {"read_timeout": 3, "retries": 0, "circuit_breaker": False},
+    "healthchecks": {"read_timeout": 5, "retries": 0}
+}
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+RETRY_STATUSES = (502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of making a request to an upstream that has been
+    failing, so it is handled along with any other connection error.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failed requests to an upstream in this process. Once
+    there have been threshold of them, requests are refused for
+    reset_timeout seconds, after which one request at a time is let through
+    until one succeeds.
+    """
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """Returns whether a request may be made."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # Let a single request through to see whether the upstream has
+            # recovered, or another should that one never report back
+            if (
+                self._trial_started is not None and
+                now - self._trial_started < self.reset_timeout
+            ):
+                return False
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started = None
+            if self.threshold and self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class _BaseHttpClient:
+    """
+    What the clients for synchronous and asynchronous code have in common:
+    when to retry, when the circuit breaker trips and what is measured.
+    """
+    def __init__(
+        self,
+        name,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        retries=HTTP_MAX_RETRIES,
+        backoff=HTTP_RETRY_BACKOFF,
+        circuit_breaker=True,
+        breaker=None
+    ):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(
+            HTTP_CIRCUIT_BREAKER_THRESHOLD if circuit_breaker else 0,
+            HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT
+        )
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            increment_counter(
+                "uclapi_upstream_requests_total",
+                (self.name, "circuit_open")
+            )
+            raise CircuitOpenError(
+                "Requests to {} are failing, so are not being made.".format(
+                    self.name
+                )
+            )
+
+    def _record_attempt(self, start, outcome, flush=True):
+        observe_histogram(
+            "uclapi_upstream_request_seconds",
+            (self.name,),
+            time.perf_counter() - start,
+            flush=flush
+        )
+        increment_counter(
+            "uclapi_upstream_requests_total",
+            (self.name, outcome)
+        )
+
+    def _retry_error(self, method, error, attempt):
+        """
+        Returns whether to retry a request that failed with error, counting
+        it against the upstream if not.
+        """
+        # Anything but an idempotent request may only be retried if it was
+        # never sent
+        retry = (
+            method in IDEMPOTENT_METHODS or
+            isinstance(error, requests.exceptions.ConnectTimeout)
+        )
+        if not retry or attempt >= self.retries:
+            self.breaker.record_failure()
+            return False
+        return True
+
+    def _retry_response(self, method, status_code, attempt):
+        """
+        Returns whether to retry a request that got a response with
+        status_code, recording the outcome against the upstream if not.
+        """
+        if (
+            method in IDEMPOTENT_METHODS and
+            status_code in RETRY_STATUSES and
+            attempt < self.retries
+        ):
+            return True
+
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return False
+
+    def _retry_delay(self, attempt):
+        logger.info("Retrying a request to %s.", self.name)
+        return self.backoff * 2 ** attempt
+
+
+def _ignore_cookies(jar):
+    # A client is shared by every request made to its upstream, so a cookie
+    # set in response to one user's request must not be sent with the next
+    jar.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
+class HttpClient(_BaseHttpClient):
+    """
+    Makes requests to one upstream service over a pool of kept-alive
+    connections, with deadlines, retries of idempotent requests and a
+    circuit breaker. Takes the same arguments as requests.Session.request.
+    """
+    def __init__(self, name, pool_size=HTTP_POOL_SIZE, **kwargs):
+        super().__init__(name, **kwargs)
+
+        self.session = requests.Session()
+        _ignore_cookies(self.session.cookies)
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _attempt(self, method, url, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            outcome = "timeout"
+            raise
+        except requests.exceptions.ConnectionError:
+            outcome = "connection_error"
+            raise
+        else:
+            outcome = "server_error" if response.status_code >= 500 else "ok"
+            return response
+        finally:
+            self._record_attempt(start, outcome)
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        self._check_breaker()
+
+        attempt = 0
+        while True:
+            try:
+                response = self._attempt(method, url, **kwargs)
+            except (
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError
+            ) as e:
+                if not self._retry_error(method, e, attempt):
+                    raise
+            else:
+                if not self._retry_response(
+                    method,
+                    response.status_code,
+                    attempt
+                ):
+                    return response
+                response.close()
+
+            time.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class AsyncHttpClient(_BaseHttpClient):
+    """
+    As HttpClient, but for async views, so that waiting for an upstream
+    does not hold up a thread. Requests take the same arguments as
+    httpx.AsyncClient.request, and fail with the same exceptions as those
+    made with HttpClient, so errors are handled the same way.
+    """
+    def __init__(
+        self,
+        name,
+        max_connections=HTTP_ASYNC_MAX_CONNECTIONS,
+        **kwargs
+    ):
+        super().__init__(name, **kwargs)
+
+        connect_timeout, read_timeout = self.timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+        _ignore_cookies(self.client.cookies.jar)
+
+    async def _attempt(self, method, url, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.UnsupportedProtocol as e:
+            raise requests.exceptions.MissingSchema(str(e)) from e
+        except httpx.InvalidURL as e:
+            raise requests.exceptions.InvalidURL(str(e)) from e
+        except httpx.ConnectTimeout as e:
+            outcome = "timeout"
+            raise requests.exceptions.ConnectTimeout(str(e)) from e
+        except httpx.TimeoutException as e:
+            outcome = "timeout"
+            raise requests.exceptions.ReadTimeout(str(e)) from e
+        except httpx.TransportError as e:
+            outcome = "connection_error"
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        else:
+            outcome = "server_error" if response.status_code >= 500 else "ok"
+            return response
+        finally:
+            # Redis cannot be written to from the event loop
+            self._record_attempt(start, outcome, flush=False)
+
+    async def request(self, method, url, **kwargs):
+        method = method.upper()
+        self._check_breaker()
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(method, url, **kwargs)
+            except (
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError
+            ) as e:
+                if not self._retry_error(method, e, attempt):
+                    raise
+            else:
+                if not self._retry_response(
+                    method,
+                    response.status_code,
+                    attempt
+                ):
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def http_client(name):
+    """Returns the client shared by this process for an upstream."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = HttpClient(name, **UPSTREAMS.get(name, {}))
+                _clients[name] = client
+    return client
+
+
+# Async clients can only be used on the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_http_client(name):
+    """
+    Returns the async client for an upstream on the running event loop. It
+    shares its circuit breaker with the client from http_client.
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None:
+        client = AsyncHttpClient(
+            name,
+            breaker=http_client(name).breaker,
+            **UPSTREAMS.get(name, {})
+        )
+        clients[name] = client
+    return client
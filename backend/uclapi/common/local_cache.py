@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from uclapi.settings import LOCAL_CACHE_MAX_SIZE
+
+from .metrics import increment_counter
+from .redis_client import InvalidationListener, get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Every worker subscribes to this channel. Writers publish the name of a
+# namespace on it once they have refreshed the data in Redis behind it.
+INVALIDATION_CHANNEL = "uclapi:local-cache:invalidate"
+
+
+class LocalCache:
+    """
+    A bounded LRU cache, local to one process, of values read from Redis
+    that are requested far more often than they change.
+
+    Keys belong to namespaces, which have to be registered with the TTL of
+    their entries. Writers invalidate a whole namespace at once in every
+    worker with invalidate_local_cache. As with the token cache, entries are
+    only served while this process is subscribed to invalidations, and the
+    TTL bounds staleness should a message be lost.
+
+    Cached values are shared between requests, so must not be modified.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self._namespaces = {}
+        self._entries = OrderedDict()
+        # Bumped on every invalidation, so that a value read from Redis
+        # before one arrived is never cached after it
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = InvalidationListener(
+            INVALIDATION_CHANNEL,
+            self.evict,
+            self.clear
+        )
+
+    def register(self, namespace, ttl, on_invalidate=None):
+        """
+        Allows values in a namespace to be cached for ttl seconds.
+        on_invalidate is called whenever the namespace is invalidated, so
+        that other process level caches of the same data can be cleared.
+        """
+        self._namespaces[namespace] = (ttl, on_invalidate)
+
+    def listen(self):
+        """
+        Makes sure this process is subscribed to invalidations, returning
+        whether it is. Code relying on on_invalidate should call this before
+        using what it caches.
+        """
+        return self.max_size > 0 and self._listener.listening()
+
+    def get(self, namespace, key, load):
+        """
+        Returns the value cached for a key in a namespace, or calls load to
+        read it from Redis and caches what it returns.
+        """
+        ttl, _ = self._namespaces[namespace]
+        if not self.listen():
+            return load()
+
+        cache_key = (namespace, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(cache_key)
+                increment_counter(
+                    "uclapi_local_cache_reads_total", (namespace, "hit")
+                )
+                return entry[1]
+            generation = self._generation
+
+        increment_counter("uclapi_local_cache_reads_total", (namespace, "miss"))
+        value = load()
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[cache_key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def evict(self, namespace):
+        """Drops every entry in a namespace."""
+        with self._lock:
+            stale = [
+                cache_key for cache_key in self._entries
+                if cache_key[0] == namespace
+            ]
+            for cache_key in stale:
+                del self._entries[cache_key]
+            self._generation += 1
+
+        _, on_invalidate = self._namespaces.get(namespace, (None, None))
+        if on_invalidate is not None:
+            on_invalidate()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+        for _, on_invalidate in self._namespaces.values():
+            if on_invalidate is not None:
+                on_invalidate()
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_SIZE)
+
+
+def invalidate_local_cache(namespace):
+    """
+    Evicts a namespace from the cache of this process and, via Redis, from
+    that of every other worker.
+    """
+    local_cache.evict(namespace)
+
+    try:
+        get_redis().publish(INVALIDATION_CHANNEL, namespace)
+    except redis.exceptions.RedisError:
+        logger.warning(
+            "Could not publish local cache invalidation for %s",
+            namespace,
+            exc_info=True
+        )
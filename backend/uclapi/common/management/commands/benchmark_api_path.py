@@ -0,0 +1,104 @@
+import time
+
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from rest_framework.decorators import api_view
+
+from common.decorators import simple_api_view
+from common.helpers import PrettyJsonResponse as JsonResponse
+from uclapi.settings import MIDDLEWARE
+
+
+# Django's own middleware, which the fast path versions replace
+FULL_MIDDLEWARE = [
+    middleware.replace(
+        'common.middleware.api_fast_path_middleware.SessionMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware'
+    ).replace(
+        'common.middleware.api_fast_path_middleware.CsrfViewMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware'
+    ).replace(
+        'common.middleware.api_fast_path_middleware.AuthenticationMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware'
+    ).replace(
+        'common.middleware.api_fast_path_middleware.MessageMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware'
+    )
+    for middleware in MIDDLEWARE
+]
+
+
+def _view(request, *args, **kwargs):
+    return JsonResponse({"ok": True, "surveys": []})
+
+
+# This module is used as the URL configuration while benchmarking
+urlpatterns = [
+    path('workspaces/benchmark/drf', api_view(['GET'])(_view)),
+    path('workspaces/benchmark/simple', simple_api_view(['GET'])(_view))
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures how long the middleware and view decorators take to '
+        'handle a request to a trivial API endpoint, with and without the '
+        'API fast path'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=5000,
+            help='How many requests to time for each configuration'
+        )
+
+    def _time(self, middleware, url, count):
+        with override_settings(
+            MIDDLEWARE=middleware,
+            ROOT_URLCONF=__name__,
+            ALLOWED_HOSTS=['testserver']
+        ):
+            handler = BaseHandler()
+            handler.load_middleware()
+            factory = RequestFactory()
+
+            # Warm up, so that URL resolution and imports are not timed
+            response = handler.get_response(factory.get(url))
+            if response.status_code != 200:
+                raise CommandError(
+                    "{} returned a {}".format(url, response.status_code)
+                )
+
+            start = time.perf_counter()
+            for _ in range(count):
+                handler.get_response(factory.get(url))
+            return (time.perf_counter() - start) / count
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        configurations = [
+            ('Full middleware, api_view', FULL_MIDDLEWARE, 'drf'),
+            ('Fast path middleware, api_view', MIDDLEWARE, 'drf'),
+            ('Fast path middleware, simple_api_view', MIDDLEWARE, 'simple')
+        ]
+
+        baseline = None
+        for name, middleware, view in configurations:
+            duration = self._time(
+                middleware,
+                '/workspaces/benchmark/{}'.format(view),
+                count
+            )
+            if baseline is None:
+                baseline = duration
+            self.stdout.write(
+                "{}: {:.1f}us per request ({:.1f}us saved)".format(
+                    name,
+                    duration * 1e6,
+                    (baseline - duration) * 1e6
+                )
+            )
@@ -0,0 +1,112 @@
+import time
+import uuid
+
+import psycopg2
+import redis
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from common.green import eventlet, patch_drivers
+from uclapi.settings import REDIS_UCLAPI_HOST
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures how long an eventlet worker takes to make many slow '
+        'Postgres queries and Redis requests at once, with the drivers as '
+        'they are and then once common.green has patched them. This '
+        'monkey-patches the process, so must be run on its own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--greenlets',
+            type=int,
+            default=50,
+            help='How many queries and requests to make at once'
+        )
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=0.1,
+            help='How many seconds each query and request waits'
+        )
+
+    def _time(self, work, count):
+        pool = eventlet.GreenPool(count)
+        start = time.perf_counter()
+        for _ in range(count):
+            pool.spawn(work)
+        pool.waitall()
+        return time.perf_counter() - start
+
+    def _postgres(self, count, delay):
+        # Django would share one connection between all the greenlets, as
+        # they run on the same thread, so each is given its own
+        params = connections['default'].get_connection_params()
+        pool = eventlet.Queue()
+        for _ in range(count):
+            pool.put(psycopg2.connect(**params))
+
+        def query():
+            connection = pool.get()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(%s)", [delay])
+            finally:
+                pool.put(connection)
+
+        try:
+            return self._time(query, count)
+        finally:
+            while not pool.empty():
+                pool.get().close()
+
+    def _redis(self, count, delay):
+        # A new client, so that its connections are made with the socket
+        # module as it currently is
+        client = redis.Redis(host=REDIS_UCLAPI_HOST)
+        key = "benchmark_green_drivers:{}".format(uuid.uuid4())
+        try:
+            # Nothing is ever pushed, so each waits out the timeout
+            return self._time(lambda: client.blpop(key, timeout=delay), count)
+        finally:
+            client.connection_pool.disconnect()
+
+    def handle(self, *args, **options):
+        if eventlet is None:
+            raise CommandError("eventlet and psycogreen must be installed.")
+        count = options['greenlets']
+        delay = options['delay']
+
+        results = []
+        for name, setup in (
+            ('Blocking drivers', lambda: None),
+            ('Cooperative drivers', self._patch)
+        ):
+            setup()
+            results.append((
+                name,
+                self._postgres(count, delay),
+                self._redis(count, delay)
+            ))
+
+        blocking = results[0]
+        for name, postgres, redis_ in results:
+            self.stdout.write(
+                "{}: Postgres {:.2f}s ({:.1f}x), Redis {:.2f}s ({:.1f}x) "
+                "for {} requests at once".format(
+                    name,
+                    postgres,
+                    blocking[1] / postgres,
+                    redis_,
+                    blocking[2] / redis_,
+                    count
+                )
+            )
+
+    def _patch(self):
+        # Only what the drivers need, as patching threading this late means
+        # searching every object for locks to replace
+        eventlet.monkey_patch(socket=True)
+        patch_drivers()
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+
+from common.redis_client import get_redis
+from common.redis_codec import (
+    NAMESPACES,
+    encode_value,
+    is_encoded,
+    original_size
+)
+
+# Replaces a value only if it has not been rewritten since it was read,
+# keeping its expiry
+COMPARE_AND_SET_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+    return 1
+end
+return 0
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Compresses large cached values in Redis that were written before '
+        'they were compressed, and reports the memory saved per namespace'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--report',
+            action='store_true',
+            help='Only report on the values, without compressing any'
+        )
+        parser.add_argument(
+            '--namespace',
+            choices=sorted(NAMESPACES),
+            action='append',
+            help='Only look at this namespace. Can be given more than once.'
+        )
+
+    def handle(self, *args, **options):
+        r = get_redis()
+        compare_and_set = r.register_script(COMPARE_AND_SET_SCRIPT)
+
+        for namespace in options['namespace'] or sorted(NAMESPACES):
+            keys = compressed = migrated = 0
+            stored_size = full_size = 0
+
+            for key in r.scan_iter(match=NAMESPACES[namespace], count=500):
+                raw = r.get(key)
+                # The key may have expired since it was scanned
+                if raw is None:
+                    continue
+                keys += 1
+
+                if not is_encoded(raw) and not options['report']:
+                    encoded = encode_value(raw)
+                    if is_encoded(encoded) and compare_and_set(
+                        keys=[key],
+                        args=[raw, encoded]
+                    ):
+                        migrated += 1
+                        raw = encoded
+
+                if is_encoded(raw):
+                    compressed += 1
+                stored_size += len(raw)
+                full_size += original_size(raw)
+
+            self.stdout.write(
+                "{}: {} keys, {} compressed{}, {} bytes stored, "
+                "{} bytes saved".format(
+                    namespace,
+                    keys,
+                    compressed,
+                    " ({} just now)".format(migrated) if migrated else "",
+                    stored_size,
+                    full_size - stored_size
+                )
+            )
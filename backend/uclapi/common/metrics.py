@@ -0,0 +1,262 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+import redis
+from django.db import connections
+
+from uclapi.settings import METRICS_FLUSH_INTERVAL
+
+from .redis_client import count_commands, get_redis
+from .timing import RequestTimer, current_timer
+
+
+logger = logging.getLogger(__name__)
+
+# Every worker adds its observations to this hash, so that /metrics reports
+# on the whole deployment rather than whichever worker served the scrape.
+METRICS_KEY = "metrics:requests"
+
+PHASE_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+HISTOGRAMS = {
+    "uclapi_request_phase_seconds": (
+        "Time spent in each phase of a protected API request.",
+        PHASE_BUCKETS,
+        ("service", "method", "phase")
+    ),
+    "uclapi_request_redis_commands": (
+        "Redis commands sent per protected API request.",
+        COUNT_BUCKETS,
+        ("service", "method")
+    ),
+    "uclapi_request_db_queries": (
+        "Database queries made per protected API request.",
+        COUNT_BUCKETS,
+        ("service", "method")
+    ),
+    "uclapi_upstream_request_seconds": (
+        "Time taken by each attempt at a request to an upstream service.",
+        PHASE_BUCKETS + (30, 60),
+        ("upstream",)
+    )
+}
+
+COUNTERS = {
+    "uclapi_local_cache_reads_total": (
+        "Reads from the in-process cache, by whether they were hits.",
+        ("namespace", "result")
+    ),
+    "uclapi_token_cache_reads_total": (
+        "Lookups in the in-process token cache, by whether they were hits.",
+        ("result",)
+    ),
+    "uclapi_token_cache_evictions_total": (
+        "Entries dropped from the in-process token cache, by reason.",
+        ("reason",)
+    ),
+    "uclapi_requests_shed_total": (
+        "Protected API requests rejected by admission control, by reason.",
+        ("service", "reason")
+    ),
+    "uclapi_upstream_requests_total": (
+        "Attempts at requests to upstream services, by outcome.",
+        ("upstream", "outcome")
+    )
+}
+
+
+@contextmanager
+def count_db_queries(timer):
+    """
+    Counts the database queries made by this thread within the block, which
+    measure_request does for the thread it is used in.
+    """
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(
+                connection.execute_wrapper(timer.count_db_query)
+            )
+        yield
+
+
+@contextmanager
+def measure_request():
+    """
+    Measures the request handled within the block, counting every Redis
+    command and database query it makes.
+    """
+    timer = RequestTimer()
+    token = current_timer.set(timer)
+    try:
+        with count_commands(timer.count_redis_commands):
+            with count_db_queries(timer):
+                yield timer
+    finally:
+        current_timer.reset(token)
+
+
+class _Histograms:
+    """
+    Observations made by this process that have not yet been added to the
+    totals in Redis.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(float)
+        self._last_flush = time.monotonic()
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        # Buckets are stored individually and only made cumulative when
+        # they are rendered
+        bucket = next((str(b) for b in buckets if value <= b), "+Inf")
+        labels = list(labels)
+        with self._lock:
+            self._pending[json.dumps([name] + labels + [bucket])] += 1
+            self._pending[json.dumps([name] + labels + ["sum"])] += value
+
+    def increment(self, name, labels, value=1):
+        labels = list(labels)
+        with self._lock:
+            self._pending[json.dumps([name] + labels + ["total"])] += value
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+                return
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = now
+
+        if not pending:
+            return
+
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for field, value in pending.items():
+                pipe.hincrbyfloat(METRICS_KEY, field, value)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            logger.warning(
+                "Could not flush request metrics; %d series dropped.",
+                len(pending),
+                exc_info=True
+            )
+
+
+_histograms = _Histograms()
+
+
+def record_request(service, method, timer):
+    """Adds a measured request to the latency histograms."""
+    for phase, duration in timer.phases.items():
+        _histograms.observe(
+            "uclapi_request_phase_seconds",
+            (service, method, phase),
+            duration
+        )
+    _histograms.observe(
+        "uclapi_request_phase_seconds",
+        (service, method, "total"),
+        timer.total()
+    )
+    _histograms.observe(
+        "uclapi_request_redis_commands",
+        (service, method),
+        timer.redis_commands
+    )
+    _histograms.observe(
+        "uclapi_request_db_queries",
+        (service, method),
+        timer.db_queries
+    )
+    _histograms.flush()
+
+
+def observe_histogram(name, labels, value, flush=True):
+    """
+    Adds an observation made outside of a protected API request, such as in
+    a task, to a histogram. Observations are sent to Redis at most every
+    METRICS_FLUSH_INTERVAL seconds, or along with the next request recorded
+    if flush is False, as it must be on an event loop.
+    """
+    _histograms.observe(name, labels, value)
+    if flush:
+        _histograms.flush()
+
+
+def increment_counter(name, labels, value=1):
+    """
+    Adds to a counter. Counts are sent to Redis along with the histograms
+    of the next request this process records.
+    """
+    _histograms.increment(name, labels, value)
+
+
+def _format_labels(names, values):
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"')
+        )
+        for name, value in zip(names, values)
+    )
+
+
+def render_metrics(extra_metrics=None):
+    """
+    Renders the histograms from every worker, along with any other metrics
+    given as a dictionary of name to (type, help, value), in the Prometheus
+    text format.
+    """
+    _histograms.flush(force=True)
+    raw = get_redis(decode_responses=True).hgetall(METRICS_KEY)
+
+    # series[name][labels][bucket] = value
+    series = defaultdict(lambda: defaultdict(dict))
+    for field, value in raw.items():
+        parts = json.loads(field)
+        series[parts[0]][tuple(parts[1:-1])][parts[-1]] = float(value)
+
+    lines = []
+    for name, (help_text, buckets, label_names) in HISTOGRAMS.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} histogram".format(name))
+        for labels, values in sorted(series[name].items()):
+            label_text = _format_labels(label_names, labels)
+            count = 0
+            for bound in [str(b) for b in buckets] + ["+Inf"]:
+                count += values.get(bound, 0)
+                lines.append('{}_bucket{{{},le="{}"}} {:d}'.format(
+                    name, label_text, bound, int(count)
+                ))
+            lines.append("{}_sum{{{}}} {!r}".format(
+                name, label_text, values.get("sum", 0)
+            ))
+            lines.append("{}_count{{{}}} {:d}".format(
+                name, label_text, int(count)
+            ))
+
+    for name, (help_text, label_names) in COUNTERS.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} counter".format(name))
+        for labels, values in sorted(series[name].items()):
+            lines.append("{}{{{}}} {:d}".format(
+                name,
+                _format_labels(label_names, labels),
+                int(values.get("total", 0))
+            ))
+
+    for name, (metric_type, help_text, value) in (extra_metrics or {}).items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        lines.append("{} {}".format(name, value))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,62 @@
+from django.contrib.auth.middleware import (
+    AuthenticationMiddleware as BaseAuthenticationMiddleware
+)
+from django.contrib.messages.middleware import (
+    MessageMiddleware as BaseMessageMiddleware
+)
+from django.contrib.sessions.middleware import (
+    SessionMiddleware as BaseSessionMiddleware
+)
+from django.middleware.csrf import CsrfViewMiddleware as BaseCsrfViewMiddleware
+
+
+# The endpoints under these paths are authenticated by their tokens alone, so
+# never use sessions, CSRF protection, logged in users or messages
+API_PATH_PREFIXES = (
+    "/roombookings/",
+    "/timetable/",
+    "/workspaces/",
+    "/libcal/",
+    "/search/",
+    "/resources/"
+)
+
+
+def is_api_request(request):
+    return request.path_info.startswith(API_PATH_PREFIXES)
+
+
+class ApiFastPathMixin:
+    """
+    Skips a middleware for requests to the API, which then go straight on to
+    the next one. The middleware subclassed is otherwise unchanged, so it
+    still satisfies Django's checks for it.
+    """
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(ApiFastPathMixin, BaseSessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(ApiFastPathMixin, BaseCsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(
+            request,
+            callback,
+            callback_args,
+            callback_kwargs
+        )
+
+
+class AuthenticationMiddleware(ApiFastPathMixin, BaseAuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(ApiFastPathMixin, BaseMessageMiddleware):
+    pass
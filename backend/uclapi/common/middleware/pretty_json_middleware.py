@@ -0,0 +1,49 @@
+import asyncio
+
+from django.utils.cache import patch_vary_headers
+
+from common.rendering import pretty_json, wants_pretty_json
+from common.renderers import BULK_MEDIA_TYPES
+
+
+class PrettyJsonMiddleware:
+    """
+    Records whether the client asked for indented JSON for the rest of the
+    request, so that every JSON response is rendered accordingly.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Served over ASGI, the middleware must be async too so that a
+        # thread is not held for the whole of an async view
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        token = pretty_json.set(wants_pretty_json(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            pretty_json.reset(token)
+        return self._vary_on_accept(response)
+
+    async def __acall__(self, request):
+        token = pretty_json.set(wants_pretty_json(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            pretty_json.reset(token)
+        return self._vary_on_accept(response)
+
+    def _vary_on_accept(self, response):
+        # Pretty printing and the bulk data formats can be requested in the
+        # Accept header
+        content_type = response.get("Content-Type", "")
+        if content_type.startswith(("application/json",) + BULK_MEDIA_TYPES):
+            patch_vary_headers(response, ("Accept",))
+        return response
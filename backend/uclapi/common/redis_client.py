@@ -0,0 +1,288 @@
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import redis
+from redis.cluster import ClusterNode
+from redis.exceptions import RedisClusterException
+
+from uclapi.settings import (
+    REDIS_CLUSTER_MODE,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_SOCKET_CONNECT_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_UCLAPI_HOST
+)
+
+
+logger = logging.getLogger(__name__)
+
+# One connection pool per process for each response mode. redis-py resets a
+# pool the first time it is used after a fork, so gunicorn and Celery workers
+# each end up with their own connections.
+_pools = {}
+_pools_lock = threading.Lock()
+# In cluster mode, one client per process for each response mode instead.
+# Each holds a pool for every node.
+_clusters = {}
+
+# Every key used by the authorisation script in common.decorators has this
+# hash tag, as all of the keys a script uses must be in the same slot.
+AUTH_TAG = "auth"
+
+# Called with the number of commands sent whenever commands are sent to Redis
+# from within count_commands.
+_command_listener = contextvars.ContextVar(
+    "redis_command_listener",
+    default=None
+)
+
+
+class _CountingConnection(redis.Connection):
+    # Pipelines pack each of their commands with this too
+    def pack_command(self, *args):
+        listener = _command_listener.get()
+        if listener is not None:
+            listener(1)
+        return super().pack_command(*args)
+
+
+@contextmanager
+def count_commands(listener):
+    """
+    Calls listener with the number of commands sent each time this thread
+    sends commands to Redis within the block.
+    """
+    token = _command_listener.set(listener)
+    try:
+        yield
+    finally:
+        _command_listener.reset(token)
+
+
+def hash_tag(tag):
+    """
+    Returns the hash tag to start a key with so that, in cluster mode, it is
+    stored in the same slot as every other key with the tag. Keys that a
+    script or transaction uses together need one.
+    Outside cluster mode there is no tag, so that standalone deployments
+    keep the keys their data is already stored under.
+    """
+    if not REDIS_CLUSTER_MODE:
+        return ""
+    return "{" + tag + "}"
+
+
+def auth_key(name):
+    """Returns the key called name among those the auth script uses."""
+    return hash_tag(AUTH_TAG) + name
+
+
+def last_modified_key(name):
+    """Returns the key holding when the data called name last changed."""
+    return auth_key("http:headers:Last-Modified:" + name)
+
+
+class _SlotPipeline(redis.client.Pipeline):
+    """
+    A transaction on a cluster. It is run with MULTI and EXEC on the node
+    serving the slot its keys are in, so they must all be in the same one.
+    """
+    def __init__(self, cluster):
+        super().__init__(
+            connection_pool=None,
+            response_callbacks=redis.Redis.RESPONSE_CALLBACKS,
+            transaction=True,
+            shard_hint=None
+        )
+        self._cluster = cluster
+
+    def execute(self, raise_on_error=True):
+        slots = {
+            self._cluster.determine_slot(*args)
+            for args, _ in self.command_stack
+        }
+        if len(slots) > 1:
+            self.reset()
+            raise RedisClusterException(
+                "The keys in a transaction must all be in the same slot, "
+                "so should share a hash tag."
+            )
+
+        if slots:
+            node = self._cluster.nodes_manager.get_node_from_slot(slots.pop())
+            node_client = self._cluster.get_redis_connection(node)
+            self.connection_pool = node_client.connection_pool
+        return super().execute(raise_on_error)
+
+
+class _ClusterRedis(redis.RedisCluster):
+    """
+    A cluster client that, unlike redis-py's, can run a pipeline as a
+    transaction if it is asked to. Pipelines are not transactions by
+    default, as redis-py relies on that itself.
+    """
+    def pipeline(self, transaction=None, shard_hint=None):
+        if transaction:
+            return _SlotPipeline(self)
+        return super().pipeline(shard_hint=shard_hint)
+
+
+def _parse_node(node):
+    host, _, port = node.strip().rpartition(":")
+    if not host:
+        return ClusterNode(port, 6379)
+    return ClusterNode(host, int(port))
+
+
+def _get_cluster(decode_responses):
+    cluster = _clusters.get(decode_responses)
+    if cluster is not None:
+        return cluster
+
+    with _pools_lock:
+        if decode_responses not in _clusters:
+            nodes = [_parse_node(node) for node in REDIS_UCLAPI_HOST.split(",")]
+            _clusters[decode_responses] = _ClusterRedis(
+                # redis-py only gives the pools of the nodes our connection
+                # class if the first node is given as a URL
+                url="redis://{}:{}".format(nodes[0].host, nodes[0].port),
+                startup_nodes=nodes[1:],
+                connection_class=_CountingConnection,
+                encoding="utf-8",
+                decode_responses=decode_responses,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                socket_keepalive=True
+            )
+        return _clusters[decode_responses]
+
+
+def _get_pool(decode_responses):
+    pool = _pools.get(decode_responses)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        if decode_responses not in _pools:
+            _pools[decode_responses] = redis.ConnectionPool(
+                connection_class=_CountingConnection,
+                host=REDIS_UCLAPI_HOST,
+                encoding="utf-8",
+                decode_responses=decode_responses,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                socket_keepalive=True,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL
+            )
+        return _pools[decode_responses]
+
+
+def get_redis(decode_responses=False):
+    """
+    Returns a Redis client backed by this process's shared connection pool.
+    Clients are cheap, so call this wherever a client is needed rather than
+    holding on to one.
+    Responses are bytes unless decode_responses is True, in which case they
+    are decoded as UTF-8 strings.
+    In cluster mode this process's cluster client is returned instead. Its
+    pipelines are only transactions when created with transaction=True, and
+    those may only use keys with the same hash tag.
+    """
+    if REDIS_CLUSTER_MODE:
+        return _get_cluster(decode_responses)
+    return redis.Redis(connection_pool=_get_pool(decode_responses))
+
+
+def _describe_pool(pool):
+    # The private counters are read without taking the pool's lock as
+    # these numbers are only indicative.
+    return {
+        "created": pool._created_connections,
+        "available": len(pool._available_connections),
+        "in_use": len(pool._in_use_connections),
+        "max": pool.max_connections
+    }
+
+
+def get_pool_stats():
+    """Returns connection counts for each of this process's pools."""
+    stats = {}
+    for decode_responses, pool in _pools.items():
+        stats["decoded" if decode_responses else "bytes"] = (
+            _describe_pool(pool)
+        )
+
+    for decode_responses, cluster in _clusters.items():
+        for node in cluster.get_nodes():
+            if node.redis_connection is None:
+                continue
+            stats["{}:{}".format(
+                "decoded" if decode_responses else "bytes",
+                node.name
+            )] = _describe_pool(node.redis_connection.connection_pool)
+    return stats
+
+
+class InvalidationListener:
+    """
+    Keeps this process subscribed to a channel on which writers publish
+    invalidation messages, passing the data of each to on_message.
+
+    Anything cached in the process may only be served while listening()
+    returns True. Whenever a fresh subscription has to be made, because this
+    is the first call in a newly forked worker or because the subscriber has
+    died and may have missed messages, on_reset is called first so that
+    nothing already cached is trusted.
+    """
+    def __init__(self, channel, on_message, on_reset):
+        self.channel = channel
+        self._on_message = on_message
+        self._on_reset = on_reset
+        self._lock = threading.Lock()
+        self._subscriber = None
+        self._pid = None
+
+    def _handle(self, message):
+        self._on_message(message["data"].decode("utf-8"))
+
+    def _subscribed(self, pid):
+        if self._pid != pid or self._subscriber is None:
+            return False
+        return self._subscriber.is_alive()
+
+    def listening(self):
+        pid = os.getpid()
+        if self._subscribed(pid):
+            return True
+
+        with self._lock:
+            if self._subscribed(pid):
+                return True
+
+            self._on_reset()
+            self._subscriber = None
+            self._pid = None
+
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._handle})
+                self._subscriber = pubsub.run_in_thread(
+                    sleep_time=1,
+                    daemon=True
+                )
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "Could not subscribe to %s; nothing will be cached.",
+                    self.channel,
+                    exc_info=True
+                )
+                return False
+
+            self._pid = pid
+            return True
@@ -0,0 +1,91 @@
+import struct
+import zlib
+
+from uclapi.settings import REDIS_COMPRESSION_MIN_SIZE
+
+from .redis_client import hash_tag
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compressed values start with one of these, followed by the length of the
+# original value. Nothing we store uncompressed (JSON, base64 or plain text)
+# can start with a NUL byte, so values written before they were compressed
+# can still be read.
+ZLIB_MAGIC = b"\x00UZ\x01"
+ZSTD_MAGIC = b"\x00UZ\x02"
+_HEADER = struct.Struct(">4sI")
+
+# The large values written by the caches, by the namespace they are reported
+# under, along with the pattern matching their keys
+NAMESPACES = {
+    "timetable:personal": "timetable:personal:*",
+    "occupeye:summaries": hash_tag("occupeye") + "occupeye:summaries:*",
+    "occupeye:timeaverages": (
+        hash_tag("occupeye") + "occupeye:query:timeaverage:*"
+    ),
+    "occupeye:images": hash_tag("occupeye") + "occupeye:image:*:base64"
+}
+
+
+def _compress(data):
+    if zstandard is not None:
+        return ZSTD_MAGIC, zstandard.ZstdCompressor(level=3).compress(data)
+    return ZLIB_MAGIC, zlib.compress(data, 6)
+
+
+def encode_value(value):
+    """
+    Returns the bytes to store in Redis for a str or bytes value, which are
+    compressed if the value is at least REDIS_COMPRESSION_MIN_SIZE bytes long.
+    """
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if len(value) < REDIS_COMPRESSION_MIN_SIZE:
+        return value
+
+    magic, compressed = _compress(value)
+    if _HEADER.size + len(compressed) >= len(value):
+        return value
+    return _HEADER.pack(magic, len(value)) + compressed
+
+
+def is_encoded(raw):
+    return raw is not None and raw[:4] in (ZLIB_MAGIC, ZSTD_MAGIC)
+
+
+def original_size(raw):
+    """Returns the length of the value that raw bytes from Redis hold."""
+    if not is_encoded(raw):
+        return len(raw)
+    return _HEADER.unpack_from(raw)[1]
+
+
+def decode_value(raw):
+    """
+    Returns the original bytes of a value read from Redis, whether or not it
+    was compressed, or None if there was no value.
+    """
+    if not is_encoded(raw):
+        return raw
+
+    magic, _ = _HEADER.unpack_from(raw)
+    data = raw[_HEADER.size:]
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError(
+                "A value was compressed with zstd, which is not installed."
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def decode_text(raw):
+    """As decode_value, but returns the value as a str."""
+    value = decode_value(raw)
+    if value is None:
+        return None
+    return value.decode("utf-8")
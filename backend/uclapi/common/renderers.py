@@ -0,0 +1,203 @@
+import csv
+import io
+
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.renderers import (
+    BaseRenderer,
+    BrowsableAPIRenderer,
+    JSONRenderer
+)
+
+from .helpers import (
+    STREAMING_CHUNK_SIZE,
+    StreamingJsonResponse,
+    pretty_response
+)
+from .rendering import render_json
+from .timing import timed
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """
+    Renders REST framework responses in the same way as PrettyJsonResponse,
+    so that they are compact unless pretty printing was requested.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        with timed("render"):
+            return render_json(data)
+
+
+def _find_rows(data):
+    """
+    Returns the list of results in a paginated response, along with the
+    pagination object it came from, or the whole response as a single row
+    if it is not paginated (e.g. if it is an error).
+    """
+    for value in data.values():
+        if isinstance(value, dict) and "results" in value:
+            return (value["results"], value)
+    return ([data], {})
+
+
+class RowsRenderer(BaseRenderer):
+    """
+    A renderer for bulk data that only sends the rows of a list, one after
+    another, rather than the whole response. The rows can be rendered as
+    they are streamed with render_rows, and links to the next and previous
+    pages are sent in a Link header.
+    """
+    charset = None
+
+    def render_row(self, row, fields):
+        raise NotImplementedError
+
+    def render_header(self, fields):
+        return b""
+
+    def render_rows(self, rows, fields=None):
+        """
+        Renders an iterable of rows in chunks. If fields is not given then
+        the keys of the first row are used.
+        """
+        chunk = bytearray()
+        if fields is not None:
+            chunk += self.render_header(fields)
+        for row in rows:
+            if fields is None:
+                fields = list(row.keys())
+                chunk += self.render_header(fields)
+            chunk += self.render_row(row, fields)
+            if len(chunk) >= STREAMING_CHUNK_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+        yield bytes(chunk)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        rows, page = _find_rows(data)
+
+        fields = None
+        view = renderer_context.get("view")
+        if page and hasattr(view, "get_serializer"):
+            fields = list(view.get_serializer().fields)
+
+        response = renderer_context.get("response")
+        if response is not None:
+            links = [
+                '<{}>; rel="{}"'.format(page[rel], rel)
+                for rel in ("next", "previous")
+                if page.get(rel)
+            ]
+            if links:
+                response["Link"] = ", ".join(links)
+
+        with timed("render"):
+            return b"".join(self.render_rows(rows, fields))
+
+
+class NDJSONRenderer(RowsRenderer):
+    """Renders each row as a JSON object on its own line."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render_row(self, row, fields):
+        return render_json(row, pretty=False) + b"\n"
+
+
+class CSVRenderer(RowsRenderer):
+    """Renders rows as CSV with a header line naming the fields."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def _write(self, values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(values)
+        return buffer.getvalue().encode("utf-8")
+
+    def render_header(self, fields):
+        return self._write(fields)
+
+    def render_row(self, row, fields):
+        return self._write([
+            "" if row.get(field) is None else row.get(field)
+            for field in fields
+        ])
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders the whole response as MessagePack, the binary form of JSON."""
+    media_type = "application/x-msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        with timed("render"):
+            return msgpack.packb(data, default=str)
+
+
+# The formats offered by endpoints serving bulk data
+BULK_RENDERER_CLASSES = [
+    CompactJSONRenderer,
+    NDJSONRenderer,
+    CSVRenderer
+] + ([MessagePackRenderer] if msgpack is not None else []) + [
+    BrowsableAPIRenderer
+]
+
+BULK_MEDIA_TYPES = tuple(
+    renderer.media_type
+    for renderer in (NDJSONRenderer, CSVRenderer, MessagePackRenderer)
+)
+
+
+def rows_response(
+    renderer,
+    data,
+    rows_key,
+    fields=None,
+    next_link=None,
+    custom_header_data=None
+):
+    """
+    Returns a response serving data, a dictionary in which data[rows_key]
+    is an iterator of rows, in the format of the negotiated renderer.
+    JSON and the row formats are streamed. Row formats only contain the rows,
+    so the link to the next page is sent in a Link header instead.
+    """
+    if isinstance(renderer, RowsRenderer):
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += "; charset=" + renderer.charset
+        response = StreamingHttpResponse(
+            renderer.render_rows(data[rows_key], fields),
+            content_type=content_type
+        )
+        if next_link:
+            response["Link"] = '<{}>; rel="next"'.format(next_link)
+    elif isinstance(renderer, MessagePackRenderer):
+        data = dict(data)
+        data[rows_key] = list(data[rows_key])
+        response = HttpResponse(
+            renderer.render(data),
+            content_type=renderer.media_type
+        )
+    else:
+        return StreamingJsonResponse(data, custom_header_data)
+
+    return pretty_response(response, custom_header_data=custom_header_data)
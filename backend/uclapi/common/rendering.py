@@ -0,0 +1,66 @@
+import json
+from contextvars import ContextVar
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Whether the client asked for indented JSON. It is set for each request by
+# common.middleware.pretty_json_middleware.
+pretty_json = ContextVar("pretty_json", default=False)
+
+_TRUE_VALUES = ("true", "1", "yes")
+
+_encoder = DjangoJSONEncoder()
+
+
+def wants_pretty_json(request):
+    """
+    Returns whether a request asked for indented JSON, either with
+    ?pretty=true or a pretty=true parameter on an Accept media type, e.g.
+    Accept: application/json; pretty=true
+    """
+    if request.GET.get("pretty", "").lower() in _TRUE_VALUES:
+        return True
+
+    for media_type in request.META.get("HTTP_ACCEPT", "").split(","):
+        for param in media_type.split(";")[1:]:
+            key, _, value = param.partition("=")
+            if (
+                key.strip().lower() == "pretty" and
+                value.strip().strip('"').lower() in _TRUE_VALUES
+            ):
+                return True
+    return False
+
+
+def render_json(data, pretty=None):
+    """
+    Serialises data to UTF-8 encoded JSON. The output is compact unless
+    pretty is True or, if pretty is not given, the current request asked
+    for indented JSON.
+    """
+    if pretty is None:
+        pretty = pretty_json.get()
+
+    if pretty:
+        return json.dumps(data, cls=DjangoJSONEncoder, indent=4).encode("utf-8")
+
+    if orjson is not None:
+        # Dates are passed through to the Django encoder so that they are
+        # formatted exactly as they always have been
+        return orjson.dumps(
+            data,
+            default=_encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    return json.dumps(
+        data,
+        cls=DjangoJSONEncoder,
+        separators=(",", ":")
+    ).encode("utf-8")
@@ -0,0 +1,97 @@
+import logging
+from functools import wraps
+
+import redis
+from django.http import HttpResponse
+
+from uclapi.settings import RESPONSE_CACHE_TTL
+
+from .helpers import pretty_response
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def _response_key(etag):
+    return "response:{}".format(etag.strip('"'))
+
+
+def get_cached_response(etag, custom_header_data=None):
+    """
+    Returns a response holding the body cached for an ETag, or None if it
+    is not cached.
+    """
+    try:
+        cached = get_redis().hgetall(_response_key(etag))
+    except redis.exceptions.RedisError:
+        logger.warning("Could not read a cached response.", exc_info=True)
+        return None
+    if not cached:
+        return None
+
+    response = HttpResponse(
+        cached[b"body"],
+        content_type=cached[b"content_type"].decode("utf-8")
+    )
+    return pretty_response(response, custom_header_data=custom_header_data)
+
+
+def set_cached_response(etag, response):
+    """
+    Caches the body of a successful, uncompressed response under its ETag.
+    The ETag changes with every data generation, so stale bodies are never
+    served and are left to expire.
+    """
+    if (
+        response.streaming or
+        response.status_code != 200 or
+        response.has_header("Content-Encoding")
+    ):
+        return
+
+    try:
+        key = _response_key(etag)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "content_type": response["Content-Type"],
+            "body": response.content
+        })
+        pipe.expire(key, RESPONSE_CACHE_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        logger.warning("Could not cache a response.", exc_info=True)
+
+
+def cached_response(view_func):
+    """
+    Caches the responses of a view that depend on nothing but the request
+    and the data generation, so that the view only runs once for each
+    generation of each distinct request.
+    It must be applied under uclapi_protected_endpoint, so that every call
+    is still authorised and counted. The ETag that decorator generates
+    identifies the data generation, normalised query and representation,
+    so it is used as the cache key. Responses without one are not cached,
+    nor are streaming responses, which are sent as they are rendered.
+    """
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        etag = kwargs.get('ETag')
+        if etag is None or request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        response = get_cached_response(etag, custom_header_data=kwargs)
+        if response is not None:
+            return response
+
+        response = view_func(request, *args, **kwargs)
+
+        # REST framework responses are only rendered after the view returns
+        if getattr(response, 'is_rendered', True):
+            set_cached_response(etag, response)
+        else:
+            response.add_post_render_callback(
+                lambda rendered: set_cached_response(etag, rendered)
+            )
+        return response
+    return wrapped
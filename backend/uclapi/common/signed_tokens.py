@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import hmac
+
+from uclapi.settings import SIGNED_TOKENS_SECRET
+
+from .redis_client import auth_key, get_redis
+
+
+# Signed tokens carry everything needed to authorise a request, signed with
+# SIGNED_TOKENS_SECRET, so they can be checked without a database lookup.
+# They keep the prefixes of the opaque tokens they replace so that the
+# decorator can still tell their types apart.
+GENERAL_PREFIX = "uclapi-s1."
+OAUTH_PREFIX = "uclapi-user-s1."
+
+# Signed tokens cannot be changed once issued, so a token that should no
+# longer work is added to this set instead. Members are "app:<id>" once an
+# app is deleted, "app:<id>:<version>" for a regenerated general token and
+# "oauth:<id>:<version>" for a deactivated, rescoped or deleted OAuth token.
+REVOKED_TOKENS_KEY = auth_key("tokens:revoked")
+
+
+def _mac(message, length=16):
+    digest = hmac.new(
+        SIGNED_TOKENS_SECRET.encode("utf-8"),
+        message.encode("utf-8"),
+        hashlib.sha256
+    ).digest()
+    return base64.urlsafe_b64encode(digest[:length]).decode("ascii").rstrip("=")
+
+
+def _sign(*fields):
+    payload = ".".join(str(field) for field in fields)
+    return payload + "." + _mac(payload)
+
+
+def _verify(token_code, prefix, field_count):
+    """Returns the fields of a validly signed token, or None."""
+    if not SIGNED_TOKENS_SECRET or not token_code.startswith(prefix):
+        return None
+
+    payload, _, mac = token_code.rpartition(".")
+    if not hmac.compare_digest(mac, _mac(payload)):
+        return None
+
+    fields = payload[len(prefix):].split(".")
+    if len(fields) != field_count:
+        return None
+    return fields
+
+
+def _client_secret_digest(client_secret):
+    # A keyed digest, so the secret cannot be guessed from a leaked token
+    return _mac("client_secret:" + client_secret, length=12)
+
+
+def is_signed_token(token_code):
+    return token_code.startswith((GENERAL_PREFIX, OAUTH_PREFIX))
+
+
+def make_app_token(app):
+    """Returns a signed general token for an App."""
+    return _sign(
+        GENERAL_PREFIX + app.id,
+        app.user_id,
+        app.token_version
+    )
+
+
+def make_oauth_token(token):
+    """Returns a signed token for an OAuthToken, which must have been saved."""
+    return _sign(
+        OAUTH_PREFIX + str(token.id),
+        token.app_id,
+        token.user_id,
+        token.scope.scope_number,
+        token.version,
+        _client_secret_digest(token.app.client_secret)
+    )
+
+
+def app_revocation(app_id, version=None):
+    if version is None:
+        return "app:{}".format(app_id)
+    return "app:{}:{}".format(app_id, version)
+
+
+def oauth_revocation(token_id, version):
+    return "oauth:{}:{}".format(token_id, version)
+
+
+def revoke_tokens(*revocations):
+    get_redis().sadd(REVOKED_TOKENS_KEY, *revocations)
+
+
+def parse_app_token(token_code):
+    """Returns the claims of a validly signed general token, or None."""
+    fields = _verify(token_code, GENERAL_PREFIX, 3)
+    if fields is None:
+        return None
+    return {
+        "app_id": fields[0],
+        "user_id": int(fields[1]),
+        "version": int(fields[2])
+    }
+
+
+def parse_oauth_token(token_code):
+    """Returns the claims of a validly signed OAuth token, or None."""
+    fields = _verify(token_code, OAUTH_PREFIX, 6)
+    if fields is None:
+        return None
+    return {
+        "token_id": int(fields[0]),
+        "app_id": fields[1],
+        "user_id": int(fields[2]),
+        "scope_number": int(fields[3]),
+        "version": int(fields[4]),
+        "client_secret_digest": fields[5]
+    }
+
+
+class SignedApp:
+    """
+    A general token resolved from its claims, with the same interface as
+    common.token_cache.CachedApp.
+    """
+    def __init__(self, token_code, claims, user):
+        self.id = claims["app_id"]
+        self.api_token = token_code
+        self.user_id = claims["user_id"]
+        self.user = user
+        self.version = claims["version"]
+
+    def revocations(self):
+        return [
+            app_revocation(self.id),
+            app_revocation(self.id, self.version)
+        ]
+
+
+class SignedOAuthToken:
+    """
+    An OAuth token resolved from its claims, with the same interface as
+    common.token_cache.CachedOAuthToken.
+    """
+    # Deactivated tokens and those of deleted apps are revoked instead
+    active = True
+    app_deleted = False
+
+    def __init__(self, token_code, claims, user):
+        self.id = claims["token_id"]
+        self.token = token_code
+        self.app_id = claims["app_id"]
+        self.user_id = claims["user_id"]
+        self.user = user
+        self.scope_number = claims["scope_number"]
+        self.version = claims["version"]
+        self._client_secret_digest = claims["client_secret_digest"]
+
+    def client_secret_matches(self, client_secret):
+        return hmac.compare_digest(
+            self._client_secret_digest,
+            _client_secret_digest(client_secret)
+        )
+
+    def revocations(self):
+        return [
+            app_revocation(self.app_id),
+            oauth_revocation(self.id, self.version)
+        ]
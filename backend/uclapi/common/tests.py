@@ -1,20 +1,83 @@
-from django.test import TestCase, SimpleTestCase
+from django.test import Client, RequestFactory, TestCase, SimpleTestCase
+from django.core.management import call_command
+from django.db import connections
 
 from .decorators import (
+    AUTH_SCRIPT,
+    _authorise_api_call,
     _check_general_token_issues,
     _check_oauth_token_issues,
-    _check_temp_token_issues,
     _get_last_modified_header,
     how_many_seconds_until_midnight,
+    simple_api_view,
     get_var,
     throttle_api_call,
+    uclapi_protected_endpoint,
     UclApiIncorrectTokenTypeException
 )
 
+from .admission import AdmissionController, admission_controller
+from .compression import compress_response, negotiate_encoding
+from .fields import is_selected, parse_fields, select_fields
+from .green import _execute_in_thread, _execute_oracle_in_threads, eventlet
+from .http_client import (
+    AsyncHttpClient,
+    CircuitBreaker,
+    CircuitOpenError,
+    HttpClient
+)
+from .local_cache import (
+    INVALIDATION_CHANNEL as LOCAL_CACHE_CHANNEL,
+    LocalCache,
+    invalidate_local_cache,
+    local_cache
+)
+from .metrics import METRICS_KEY, measure_request, render_metrics
+from .middleware.api_fast_path_middleware import (
+    CsrfViewMiddleware,
+    SessionMiddleware
+)
+from .middleware.pretty_json_middleware import PrettyJsonMiddleware
+from .redis_client import (
+    auth_key,
+    count_commands,
+    get_pool_stats,
+    get_redis,
+    hash_tag,
+    last_modified_key
+)
+from .redis_codec import (
+    decode_text,
+    decode_value,
+    encode_value,
+    is_encoded,
+    original_size
+)
+from .response_cache import cached_response
+from .renderers import (
+    CompactJSONRenderer,
+    CSVRenderer,
+    MessagePackRenderer,
+    NDJSONRenderer,
+    msgpack,
+    rows_response
+)
+from .rendering import pretty_json, render_json
+from .signed_tokens import (
+    GENERAL_PREFIX,
+    OAUTH_PREFIX,
+    REVOKED_TOKENS_KEY,
+    parse_app_token
+)
+from .timing import RequestTimer, timed
+from .token_cache import CachedApp, TokenCache, token_cache
+
 from .helpers import (
     generate_api_token,
     PrettyJsonResponse as JsonResponse,
-    RateLimitHttpResponse as HttpResponse
+    RateLimitHttpResponse as HttpResponse,
+    STREAMING_CHUNK_SIZE,
+    StreamingJsonResponse
 )
 
 from dashboard.models import (
@@ -25,17 +88,112 @@ from dashboard.models import (
 from dashboard.app_helpers import get_temp_token, generate_temp_api_token
 
 from oauth.models import OAuthToken, OAuthScope
+from timetable.models import Lock, ModuleA
 from oauth.scoping import Scopes
 
+from asgiref.sync import async_to_sync
 from freezegun import freeze_time
 from rest_framework.test import APIRequestFactory
 
+from uclapi.dbrouters import (
+    ModelRouter,
+    _ReplicaLag,
+    read_from_replicas,
+    replica_reads,
+    wait_for_replicas
+)
 from uclapi.settings import REDIS_UCLAPI_HOST
 
 import datetime
+import gzip
+import http.server
+import httpx
+import io
 import json
+import os
+import psycopg2
 import redis
+import requests
+import requests_mock
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
 import time
+import unittest.mock
+
+
+@uclapi_protected_endpoint(last_modified_redis_key=__name__)
+def conditional_view(request, *args, **kwargs):
+    return JsonResponse({
+        "ok": True
+    }, custom_header_data=kwargs)
+
+
+@uclapi_protected_endpoint(last_modified_redis_key=__name__)
+def temp_token_view(request, *args, **kwargs):
+    return JsonResponse({
+        "ok": True,
+        "token_type": kwargs["token_type"]
+    }, custom_header_data=kwargs)
+
+
+@uclapi_protected_endpoint(
+    personal_data=True,
+    last_modified_redis_key=__name__
+)
+def personal_data_view(request, *args, **kwargs):
+    return JsonResponse({
+        "ok": True
+    }, custom_header_data=kwargs)
+
+
+precompressed_view_calls = []
+
+
+@uclapi_protected_endpoint(
+    last_modified_redis_key=__name__,
+    precompress=True
+)
+def precompressed_view(request, *args, **kwargs):
+    precompressed_view_calls.append(request)
+    return JsonResponse({
+        "ok": True,
+        "rooms": ["Room {}".format(i) for i in range(int(request.GET["n"]))]
+    }, custom_header_data=kwargs)
+
+
+@uclapi_protected_endpoint(last_modified_redis_key=__name__)
+@read_from_replicas
+def replica_view(request, *args, **kwargs):
+    return JsonResponse({
+        "ok": True,
+        "email": kwargs["token"].user.email
+    }, custom_header_data=kwargs)
+
+
+cached_view_calls = []
+
+
+@uclapi_protected_endpoint(last_modified_redis_key=__name__)
+@cached_response
+def cached_view(request, *args, **kwargs):
+    cached_view_calls.append(request)
+    if "stream" in request.GET:
+        return StreamingJsonResponse({
+            "ok": True,
+            "rooms": iter(request.GET["rooms"].split(","))
+        }, custom_header_data=kwargs)
+    response = JsonResponse({
+        "ok": "error" not in request.GET,
+        "rooms": request.GET["rooms"].split(",")
+    }, custom_header_data=kwargs)
+    if "error" in request.GET:
+        response.status_code = 400
+    return response
+
 
 class SecondsUntilMidnightTestCase(SimpleTestCase):
     def test_seconds_until_midnight(self):
@@ -75,6 +233,270 @@ class HttpResponseTestCase(TestCase):
             self.assertEqual(response[key], headers[key])
 
 
+class JsonRenderingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.middleware = PrettyJsonMiddleware(
+            lambda request: JsonResponse({"ok": True, "rooms": [1, 2]})
+        )
+
+    def test_compact_by_default(self):
+        response = self.middleware(self.factory.get("/test"))
+
+        self.assertEqual(response.content, b'{"ok":true,"rooms":[1,2]}')
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response["Vary"], "Accept")
+
+    def test_pretty_query_parameter(self):
+        response = self.middleware(self.factory.get("/test", {"pretty": "true"}))
+
+        self.assertEqual(
+            response.content.decode(),
+            json.dumps({"ok": True, "rooms": [1, 2]}, indent=4)
+        )
+
+    def test_pretty_accept_parameter(self):
+        response = self.middleware(self.factory.get(
+            "/test",
+            HTTP_ACCEPT="text/html, application/json; pretty=true"
+        ))
+
+        self.assertIn(b'\n    "ok": true', response.content)
+
+    def test_pretty_only_for_its_request(self):
+        self.middleware(self.factory.get("/test", {"pretty": "true"}))
+
+        self.assertFalse(pretty_json.get())
+        self.assertEqual(render_json([1, 2]), b"[1,2]")
+
+    def test_dates_match_django_encoder(self):
+        data = {
+            "time": datetime.datetime(2019, 1, 24, 0, 10, 5, 123456),
+            "date": datetime.date(2019, 1, 24),
+            1: "non-string key"
+        }
+
+        self.assertEqual(
+            json.loads(render_json(data)),
+            json.loads(render_json(data, pretty=True))
+        )
+        self.assertEqual(
+            json.loads(render_json(data))["time"],
+            "2019-01-24T00:10:05.123"
+        )
+
+    def test_streaming(self):
+        rendered = []
+
+        def rooms():
+            for i in range(3):
+                rendered.append(i)
+                yield {"room": i}
+
+        response = StreamingJsonResponse(
+            {"ok": True, "rooms": rooms(), "count": 3},
+            custom_header_data={"Last-Modified": "1"}
+        )
+
+        # Nothing is rendered until the response is sent
+        self.assertEqual(rendered, [])
+        self.assertEqual(response["Last-Modified"], "1")
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            b'{"ok":true,"rooms":[{"room":0},{"room":1},{"room":2}],"count":3}'
+        )
+
+    def test_streaming_chunks(self):
+        response = StreamingJsonResponse({
+            "rooms": ("x" * 1000 for _ in range(200))
+        })
+
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertGreaterEqual(len(chunks[0]), STREAMING_CHUNK_SIZE)
+        self.assertEqual(len(json.loads(b"".join(chunks))["rooms"]), 200)
+
+    def test_streaming_pretty(self):
+        token = pretty_json.set(True)
+        try:
+            response = StreamingJsonResponse({"rooms": iter([1, 2])})
+        finally:
+            pretty_json.reset(token)
+
+        self.assertEqual(
+            b"".join(response.streaming_content).decode(),
+            json.dumps({"rooms": [1, 2]}, indent=4)
+        )
+
+    def test_streaming_compressed(self):
+        response = StreamingJsonResponse({"rooms": iter(range(10))})
+
+        self.assertTrue(compress_response(response, "gzip"))
+        self.assertFalse(response.has_header("Content-Length"))
+        self.assertEqual(
+            json.loads(gzip.decompress(b"".join(response.streaming_content))),
+            {"rooms": list(range(10))}
+        )
+
+    def test_rest_framework_renderer(self):
+        self.assertEqual(
+            CompactJSONRenderer().render({"okay": True}),
+            b'{"okay":true}'
+        )
+
+
+class BulkRenderersTestCase(SimpleTestCase):
+    page = {
+        "okay": True,
+        "data": {
+            "next": "https://uclapi.com/workspaces/historical/data?cursor=b",
+            "previous": None,
+            "results": [
+                {"sensor_id": 1, "datetime": "2019-01-01T09:00:00", "state": 0},
+                {"sensor_id": 2, "datetime": "2019-01-01T09:10:00", "state": 1}
+            ]
+        }
+    }
+
+    def test_ndjson(self):
+        response = HttpResponse()
+        content = NDJSONRenderer().render(
+            self.page, renderer_context={"response": response}
+        )
+
+        self.assertEqual(
+            [json.loads(line) for line in content.decode().splitlines()],
+            self.page["data"]["results"]
+        )
+        self.assertEqual(
+            response["Link"],
+            '<https://uclapi.com/workspaces/historical/data?cursor=b>; rel="next"'
+        )
+
+    def test_csv(self):
+        content = CSVRenderer().render(self.page)
+
+        self.assertEqual(content.decode().splitlines(), [
+            "sensor_id,datetime,state",
+            "1,2019-01-01T09:00:00,0",
+            "2,2019-01-01T09:10:00,1"
+        ])
+
+    def test_csv_quoting_and_missing_values(self):
+        content = b"".join(CSVRenderer().render_rows(
+            [{"name": "Room, 1", "phone": None}],
+            ["name", "phone"]
+        ))
+
+        self.assertEqual(content.decode(), 'name,phone\r\n"Room, 1",\r\n')
+
+    def test_csv_header_without_rows(self):
+        content = b"".join(CSVRenderer().render_rows(iter([]), ["a", "b"]))
+
+        self.assertEqual(content.decode(), "a,b\r\n")
+
+    def test_unpaginated_data_is_one_row(self):
+        content = NDJSONRenderer().render({"detail": "Not found."})
+
+        self.assertEqual(json.loads(content), {"detail": "Not found."})
+
+    def test_rows_streamed(self):
+        response = rows_response(
+            NDJSONRenderer(),
+            {"ok": True, "bookings": iter([{"slotid": 1}, {"slotid": 2}])},
+            "bookings",
+            next_link="https://uclapi.com/roombookings/bookings?page_token=a"
+        )
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            b'{"slotid":1}\n{"slotid":2}\n'
+        )
+        self.assertIn("page_token=a", response["Link"])
+
+    def test_rows_json_by_default(self):
+        response = rows_response(
+            None, {"ok": True, "bookings": iter([{"slotid": 1}])}, "bookings"
+        )
+
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)),
+            {"ok": True, "bookings": [{"slotid": 1}]}
+        )
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        response = rows_response(
+            MessagePackRenderer(),
+            {"ok": True, "bookings": iter([{"slotid": 1}])},
+            "bookings"
+        )
+
+        self.assertEqual(
+            msgpack.unpackb(response.content),
+            {"ok": True, "bookings": [{"slotid": 1}]}
+        )
+
+
+class FieldsTestCase(SimpleTestCase):
+    event = {
+        "start_time": "09:00",
+        "module": {
+            "module_id": "COMP0001",
+            "lecturer": {"name": "A Lecturer", "email": "a@ucl.ac.uk"}
+        },
+        "location": {
+            "name": "Room 1",
+            "coordinates": {"lat": "51.5", "lng": "-0.13"}
+        }
+    }
+
+    def test_no_fields(self):
+        self.assertIsNone(parse_fields(None))
+        self.assertIsNone(parse_fields(""))
+        self.assertIsNone(parse_fields(" , ."))
+        self.assertEqual(select_fields(self.event, None), self.event)
+
+    def test_parse_nested_fields(self):
+        self.assertEqual(
+            parse_fields("start_time, module.module_id,module.lecturer.name"),
+            {
+                "start_time": None,
+                "module": {"module_id": None, "lecturer": {"name": None}}
+            }
+        )
+
+    def test_whole_field_overrides_nested_fields(self):
+        self.assertEqual(
+            parse_fields("location.name,location,location.coordinates.lat"),
+            {"location": None}
+        )
+
+    def test_is_selected(self):
+        selection = parse_fields("start_time,location.name")
+
+        self.assertTrue(is_selected(None, "module.lecturer"))
+        self.assertTrue(is_selected(selection, "location"))
+        self.assertTrue(is_selected(selection, "location.name"))
+        self.assertFalse(is_selected(selection, "location.coordinates"))
+        self.assertFalse(is_selected(selection, "module.lecturer"))
+
+    def test_select_fields(self):
+        self.assertEqual(
+            select_fields(
+                [self.event],
+                parse_fields("start_time,module.module_id,location,missing")
+            ),
+            [{
+                "start_time": "09:00",
+                "module": {"module_id": "COMP0001"},
+                "location": self.event["location"]
+            }]
+        )
+
+
 class GetVarTestCase(TestCase):
     test_factory = APIRequestFactory()
 
@@ -151,6 +573,22 @@ class ThrottleApiCallTest(TestCase):
         self.assertEqual(limit, 1)
         self.assertEqual(remaining, 0)
 
+    def test_concurrent_calls_never_exceed_quota(self):
+        token = generate_api_token("test")
+        results = []
+
+        def call():
+            results.append(throttle_api_call(token, "test-token")[0])
+
+        threads = [threading.Thread(target=call) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(False), 1)
+        self.assertEqual(results.count(True), 19)
+
     def test_throttle_bad_token_type(self):
         token = generate_api_token()
         with self.assertRaises(UclApiIncorrectTokenTypeException):
@@ -164,70 +602,42 @@ class ThrottleApiCallTest(TestCase):
 
 class TempTokenCheckerTest(TestCase):
     def setUp(self):
+        self.factory = RequestFactory()
         self.valid_token = get_temp_token()
 
-    def test_personal_data_requested(self):
-        result = _check_temp_token_issues(
-            self.valid_token,
-            True,
-            "/roombookings/bookings",
-            None
-        )
-        self.assertTrue(isinstance(result, JsonResponse))
-        data = json.loads(result.content.decode())
-        self.assertEqual(result.status_code, 400)
+    def get(self, token, path="/roombookings/bookings", view=temp_token_view,
+            **params):
+        params["token"] = token
+        return view(self.factory.get(path, params))
+
+    def assertError(self, response, error):
+        self.assertTrue(isinstance(response, JsonResponse))
+        data = json.loads(response.content.decode())
+        self.assertEqual(response.status_code, 400)
         self.assertFalse(data['ok'])
-        self.assertEqual(
-            data['error'],
+        self.assertEqual(data['error'], error)
+
+    def test_personal_data_requested(self):
+        self.assertError(
+            self.get(self.valid_token, view=personal_data_view),
             "Personal data requires OAuth."
         )
 
     def test_token_does_not_exist(self):
-        invalid_token = "uclapi-temp-this-token-does-not-exist"
-        result = _check_temp_token_issues(
-            invalid_token,
-            False,
-            "/roombookings/bookings",
-            None
-        )
-        self.assertTrue(isinstance(result, JsonResponse))
-        data = json.loads(result.content.decode())
-        self.assertEqual(result.status_code, 400)
-        self.assertFalse(data['ok'])
-        self.assertEqual(
-            data['error'],
+        self.assertError(
+            self.get("uclapi-temp-this-token-does-not-exist"),
             "Temporary token is either invalid or expired."
         )
 
     def test_invalid_path_requested(self):
-        result = _check_temp_token_issues(
-            self.valid_token,
-            False,
-            "/roombookings/some_other_path",
-            None
-        )
-        self.assertTrue(isinstance(result, JsonResponse))
-        data = json.loads(result.content.decode())
-        self.assertEqual(result.status_code, 400)
-        self.assertFalse(data['ok'])
-        self.assertEqual(
-            data['error'],
+        self.assertError(
+            self.get(self.valid_token, path="/roombookings/some_other_path"),
             "Temporary token can only be used for /bookings."
         )
 
     def test_page_token_provided(self):
-        result = _check_temp_token_issues(
-            self.valid_token,
-            False,
-            "/roombookings/bookings",
-            "abcdefgXYZ"
-        )
-        self.assertTrue(isinstance(result, JsonResponse))
-        data = json.loads(result.content.decode())
-        self.assertEqual(result.status_code, 400)
-        self.assertFalse(data['ok'])
-        self.assertEqual(
-            data['error'],
+        self.assertError(
+            self.get(self.valid_token, page_token="abcdefgXYZ"),
             "Temporary token can only return one booking."
         )
 
@@ -239,34 +649,67 @@ class TempTokenCheckerTest(TestCase):
         # as it is generated at its first usage.
         r.set(expired_token, 1, px=1)
         time.sleep(0.002)
-        result = _check_temp_token_issues(
-            expired_token,
-            False,
-            "/roombookings/bookings",
-            None
-        )
-        self.assertTrue(isinstance(result, JsonResponse))
-        data = json.loads(result.content.decode())
-        self.assertEqual(result.status_code, 400)
-        self.assertFalse(data['ok'])
-        self.assertEqual(
-            data['error'],
+        self.assertError(
+            self.get(expired_token),
             "Temporary token is either invalid or expired."
         )
 
     def test_all_passes(self):
-        result = _check_temp_token_issues(
-            self.valid_token,
-            False,
-            "/roombookings/bookings",
-            None
-        )
+        response = self.get(self.valid_token)
+        self.assertEqual(response.status_code, 200)
         self.assertEqual(
-            result,
-            self.valid_token
+            json.loads(response.content.decode())["token_type"],
+            "general-temp"
         )
 
 
+class AuthoriseApiCallTest(TestCase):
+    def test_missing_temp_token_is_not_counted(self):
+        r = redis.Redis(host=REDIS_UCLAPI_HOST)
+        token = generate_temp_api_token()
+
+        (
+            temp_token_exists,
+            throttle_data,
+            _
+        ) = _authorise_api_call(token, "general-temp", temp_token=token)
+
+        self.assertFalse(temp_token_exists)
+        self.assertIsNone(throttle_data)
+        # The counter must not have brought the expired token back to life
+        self.assertIsNone(r.get(token))
+
+    def test_temp_token_is_counted(self):
+        token = get_temp_token()
+
+        (
+            temp_token_exists,
+            throttle_data,
+            _
+        ) = _authorise_api_call(token, "general-temp", temp_token=token)
+
+        self.assertTrue(temp_token_exists)
+        self.assertEqual(throttle_data[:3], (False, 10, 9))
+
+    def test_last_modified_returned(self):
+        r = redis.Redis(host=REDIS_UCLAPI_HOST)
+        r.set(
+            "http:headers:Last-Modified:" + __name__,
+            "2019-01-24T00:10:05+00:00"
+        )
+        token = generate_api_token("test")
+
+        _, _, last_modified = _authorise_api_call(
+            token,
+            "test-token",
+            last_modified_redis_key=__name__
+        )
+
+        self.assertEqual(last_modified, b"2019-01-24T00:10:05+00:00")
+        r.delete("http:headers:Last-Modified:" + __name__)
+        r.delete(token)
+
+
 class GeneralTokenCheckerTest(TestCase):
     def setUp(self):
         self.valid_user = User.objects.create(
@@ -615,3 +1058,1707 @@ class LastModifiedHeaderTestCase(TestCase):
                 last_modified_timestamp + margin
             )
         )
+
+
+class TokenCacheTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.valid_user = User.objects.create(
+            email="testuserabc@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test2",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True
+        )
+        self.valid_app = App.objects.create(
+            user=self.valid_user,
+            name="Test App"
+        )
+
+    def test_second_lookup_hits_cache(self):
+        render_metrics()
+        get_redis().delete(METRICS_KEY)
+        self.addCleanup(get_redis().delete, METRICS_KEY)
+        _check_general_token_issues(self.valid_app.api_token, False)
+
+        with self.assertNumQueries(0):
+            result = _check_general_token_issues(
+                self.valid_app.api_token,
+                False
+            )
+
+        self.assertEqual(result.api_token, self.valid_app.api_token)
+        self.assertEqual(result.user.dev_quota, self.valid_user.dev_quota)
+
+        metrics = render_metrics()
+        self.assertIn('uclapi_token_cache_reads_total{result="hit"} 1', metrics)
+        self.assertIn(
+            'uclapi_token_cache_reads_total{result="miss"} 1',
+            metrics
+        )
+
+    def test_regenerated_token_is_evicted(self):
+        old_token = self.valid_app.api_token
+        _check_general_token_issues(old_token, False)
+
+        self.valid_app.regenerate_token()
+
+        result = _check_general_token_issues(old_token, False)
+        self.assertTrue(isinstance(result, JsonResponse))
+        self.assertEqual(result.status_code, 400)
+
+    def test_deleted_app_is_evicted(self):
+        _check_general_token_issues(self.valid_app.api_token, False)
+
+        self.valid_app.deleted = True
+        self.valid_app.save()
+
+        result = _check_general_token_issues(
+            self.valid_app.api_token,
+            False
+        )
+        self.assertTrue(isinstance(result, JsonResponse))
+        self.assertEqual(result.status_code, 400)
+
+    def test_token_loaded_during_invalidation_not_cached(self):
+        identity = CachedApp(self.valid_app)
+
+        def load():
+            # The app changes while it is being loaded
+            token_cache.evict("app:{}".format(self.valid_app.id))
+            return identity
+
+        token_cache.get("uclapi-abc", load)
+        loads = []
+        token_cache.get("uclapi-abc", lambda: loads.append(1) or identity)
+        self.assertEqual(loads, [1])
+
+    def test_expired_entries_are_not_served(self):
+        identity = CachedApp(self.valid_app)
+        reloaded = CachedApp(self.valid_app)
+        cache = TokenCache(max_size=10, ttl=0)
+        cache.get("uclapi-abc", lambda: identity)
+        time.sleep(0.01)
+        self.assertIs(cache.get("uclapi-abc", lambda: reloaded), reloaded)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        render_metrics()
+        get_redis().delete(METRICS_KEY)
+        self.addCleanup(get_redis().delete, METRICS_KEY)
+        identity = CachedApp(self.valid_app)
+        reloaded = CachedApp(self.valid_app)
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.get("uclapi-a", lambda: identity)
+        cache.get("uclapi-b", lambda: identity)
+        cache.get("uclapi-a", lambda: reloaded)
+        cache.get("uclapi-c", lambda: identity)
+
+        self.assertIn(
+            'uclapi_token_cache_evictions_total{reason="size"} 1',
+            render_metrics()
+        )
+        self.assertIs(cache.get("uclapi-a", lambda: reloaded), identity)
+        self.assertIs(cache.get("uclapi-b", lambda: reloaded), reloaded)
+
+
+class RedisClientTestCase(SimpleTestCase):
+    def test_clients_share_a_pool(self):
+        self.assertIs(
+            get_redis().connection_pool,
+            get_redis().connection_pool
+        )
+        self.assertIsNot(
+            get_redis().connection_pool,
+            get_redis(decode_responses=True).connection_pool
+        )
+
+    def test_response_modes(self):
+        r = get_redis()
+        r.set(__name__, "value")
+        self.assertEqual(r.get(__name__), b"value")
+        self.assertEqual(
+            get_redis(decode_responses=True).get(__name__),
+            "value"
+        )
+        r.delete(__name__)
+
+    def test_pool_stats(self):
+        get_redis().ping()
+        stats = get_pool_stats()["bytes"]
+        self.assertGreaterEqual(stats["created"], 1)
+        self.assertEqual(
+            stats["created"],
+            stats["available"] + stats["in_use"]
+        )
+
+
+class ConditionalGetTestCase(TestCase):
+    last_modified_key = "http:headers:Last-Modified:" + __name__
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="conditional@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=0
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:05+00:00")
+
+    def tearDown(self):
+        self.r.delete(self.last_modified_key, self.user.email)
+
+    def get(self, if_modified_since=None, if_none_match=None, **params):
+        headers = {}
+        if if_modified_since:
+            headers["HTTP_IF_MODIFIED_SINCE"] = if_modified_since
+        if if_none_match:
+            headers["HTTP_IF_NONE_MATCH"] = if_none_match
+        params["token"] = self.app.api_token
+        request = self.factory.get("/test/conditional", params, **headers)
+        return conditional_view(request)
+
+    def test_not_modified(self):
+        response = self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(
+            response["Last-Modified"],
+            "Thu, 24 Jan 2019 00:10:05 GMT"
+        )
+        self.assertEqual(response["X-RateLimit-Remaining"], "9999")
+
+    def test_modified(self):
+        response = self.get("Thu, 24 Jan 2019 00:10:04 GMT")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content.decode())["ok"])
+
+    def test_unconditional(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get("not a date").status_code, 200)
+
+    def test_unknown_last_modified(self):
+        self.r.delete(self.last_modified_key)
+
+        response = self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_counted(self):
+        self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+        self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+
+        self.assertEqual(int(self.r.get(self.user.email)), 2)
+
+    @unittest.mock.patch(
+        "common.decorators.NOT_MODIFIED_COUNTS_TOWARDS_QUOTA",
+        False
+    )
+    def test_not_modified_free(self):
+        response = self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["X-RateLimit-Remaining"], "10000")
+        self.assertIsNone(self.r.get(self.user.email))
+
+        response = self.get("Thu, 24 Jan 2019 00:10:04 GMT")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(self.r.get(self.user.email)), 1)
+
+        # Free 304s are still served once the quota has been used up
+        self.r.set(self.user.email, self.user.dev_quota)
+        response = self.get("Thu, 24 Jan 2019 00:10:05 GMT")
+        self.assertEqual(response.status_code, 304)
+        response = self.get("Thu, 24 Jan 2019 00:10:04 GMT")
+        self.assertEqual(response.status_code, 429)
+
+    def test_etag(self):
+        etag = self.get()["ETag"]
+
+        self.assertRegex(etag, r'^"[0-9a-f]{40}"$')
+        # The token is not part of the ETag but every other parameter is
+        self.app.regenerate_token()
+        self.assertEqual(self.get()["ETag"], etag)
+        self.assertEqual(self.get(b="2", a="1")["ETag"], self.get(a="1", b="2")["ETag"])
+        self.assertNotEqual(self.get(a="1")["ETag"], etag)
+
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:06+00:00")
+        self.assertNotEqual(self.get()["ETag"], etag)
+
+    def test_pretty_json_etag(self):
+        etag = self.get()["ETag"]
+
+        token = pretty_json.set(True)
+        try:
+            self.assertNotEqual(self.get()["ETag"], etag)
+        finally:
+            pretty_json.reset(token)
+
+    def test_no_etag_without_last_modified(self):
+        self.r.delete(self.last_modified_key)
+
+        self.assertFalse(self.get().has_header("ETag"))
+
+    def test_if_none_match(self):
+        etag = self.get()["ETag"]
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.assertEqual(self.get(if_none_match="W/" + etag).status_code, 304)
+        self.assertEqual(self.get(if_none_match="*").status_code, 304)
+        self.assertEqual(
+            self.get(if_none_match='"other", ' + etag).status_code,
+            304
+        )
+
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:06+00:00")
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+    def test_if_none_match_takes_precedence(self):
+        response = self.get(
+            if_modified_since="Thu, 24 Jan 2019 00:10:05 GMT",
+            if_none_match='"other"'
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="metrics@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+        # Rendering flushes requests measured by earlier tests to Redis
+        render_metrics()
+        self.r.delete(METRICS_KEY)
+
+    def tearDown(self):
+        self.r.delete(METRICS_KEY, self.user.email)
+
+    def get(self, **headers):
+        request = self.factory.get(
+            "/test/conditional",
+            {"token": self.app.api_token},
+            **headers
+        )
+        return conditional_view(request)
+
+    def test_server_timing_not_sent_by_default(self):
+        response = self.get()
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertIn("X-Server-Timing", response["Vary"])
+
+    def test_server_timing(self):
+        response = self.get(HTTP_X_SERVER_TIMING="1")
+
+        phases = [
+            metric.split(";")[0]
+            for metric in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(
+            phases,
+            ["auth", "throttle", "log", "render", "view", "total", "redis", "db"]
+        )
+
+    def test_unmeasured(self):
+        with timed("render"):
+            pass
+        self.assertEqual(RequestTimer().phases, {})
+
+    def test_nested_phase_is_excluded_from_lap(self):
+        with measure_request() as timer:
+            with timed("render"):
+                time.sleep(0.02)
+            timer.lap("view")
+
+        self.assertGreaterEqual(timer.phases["render"], 0.02)
+        self.assertLess(timer.phases["view"], 0.02)
+
+    def test_counts(self):
+        with measure_request() as timer:
+            self.r.get(__name__)
+            pipe = self.r.pipeline(transaction=False)
+            pipe.get(__name__)
+            pipe.get(__name__)
+            pipe.execute()
+            list(User.objects.all())
+
+        self.assertEqual(timer.redis_commands, 3)
+        self.assertEqual(timer.db_queries, 1)
+
+    @unittest.mock.patch("common.views.METRICS_TOKEN", "secret")
+    def test_metrics_endpoint(self):
+        self.get()
+        self.get()
+
+        response = Client().get(
+            "/metrics",
+            HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn(
+            'uclapi_request_phase_seconds_count'
+            '{service="test",method="conditional",phase="view"} 2',
+            metrics
+        )
+        self.assertIn(
+            'uclapi_request_db_queries_bucket'
+            '{service="test",method="conditional",le="+Inf"} 2',
+            metrics
+        )
+        self.assertIn("# TYPE uclapi_api_call_log_queued gauge", metrics)
+
+    @unittest.mock.patch("common.views.METRICS_TOKEN", "secret")
+    def test_metrics_token(self):
+        self.assertEqual(Client().get("/metrics").status_code, 401)
+        response = Client().get(
+            "/metrics",
+            HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @unittest.mock.patch("common.views.METRICS_TOKEN", "")
+    def test_metrics_not_served_without_token(self):
+        self.assertEqual(Client().get("/metrics").status_code, 404)
+
+
+class BurstLimitTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="burst@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=3,
+            burst_limit_per_minute=0
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+
+    def tearDown(self):
+        self.r.delete(self.user.email, "burst:app:" + self.app.id)
+
+    def throttle(self):
+        self.user.refresh_from_db()
+        token = CachedApp(App.objects.get(id=self.app.id))
+        return throttle_api_call(token, "general")
+
+    def test_per_second_limit(self):
+        self.assertEqual(self.throttle()[:3], (False, 3, 2))
+        self.assertEqual(self.throttle()[:3], (False, 3, 1))
+        self.assertEqual(self.throttle()[:3], (False, 3, 0))
+        self.assertEqual(self.throttle(), (True, 3, 0, 1))
+
+        # Calls rejected by a burst limit do not use up the daily quota
+        self.assertEqual(int(self.r.get(self.user.email)), 3)
+
+    def test_bucket_refills(self):
+        token = CachedApp(self.app)
+        for _ in range(3):
+            throttle_api_call(token, "general")
+        self.assertTrue(throttle_api_call(token, "general")[0])
+
+        # A call is allowed every third of a second
+        time.sleep(0.34)
+        self.assertFalse(throttle_api_call(token, "general")[0])
+        self.assertTrue(throttle_api_call(token, "general")[0])
+
+    def test_per_minute_limit(self):
+        User.objects.filter(id=self.user.id).update(
+            burst_limit_per_second=0,
+            burst_limit_per_minute=2
+        )
+
+        self.throttle()
+        self.throttle()
+        throttled, limit, remaining, reset_secs = self.throttle()
+
+        self.assertTrue(throttled)
+        self.assertEqual((limit, remaining), (2, 0))
+        self.assertGreater(reset_secs, 25)
+        self.assertLessEqual(reset_secs, 30)
+
+    def test_tightest_limit_reported(self):
+        User.objects.filter(id=self.user.id).update(
+            burst_limit_per_second=20000,
+            burst_limit_per_minute=0
+        )
+
+        # The daily quota of 10000 is closest to being reached
+        self.assertEqual(self.throttle()[:3], (False, 10000, 9999))
+
+    def test_daily_quota_takes_precedence(self):
+        self.r.set(self.user.email, self.user.dev_quota)
+
+        throttled, limit, _, reset_secs = self.throttle()
+
+        self.assertTrue(throttled)
+        self.assertEqual(limit, self.user.dev_quota)
+        self.assertGreater(reset_secs, 1)
+
+
+class SignedTokenTestCase(TestCase):
+    def setUp(self):
+        for target, value in (
+            ("common.signed_tokens.SIGNED_TOKENS_SECRET", "secret"),
+            ("dashboard.models.SIGNED_TOKENS_SECRET", "secret"),
+            ("dashboard.models.ISSUE_SIGNED_TOKENS", True),
+            ("oauth.models.ISSUE_SIGNED_TOKENS", True)
+        ):
+            patcher = unittest.mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="signed@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=0
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.app.issue_signed_token()
+        self.r = get_redis()
+        token_cache.clear()
+
+    def tearDown(self):
+        self.r.delete(
+            REVOKED_TOKENS_KEY,
+            self.user.email,
+            "oauth:" + self.user.email
+        )
+
+    def get(self, token, **params):
+        params["token"] = token
+        request = self.factory.get("/test/conditional", params)
+        return conditional_view(request)
+
+    def assertRevoked(self, response):
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content.decode())["error"],
+            "The token has been revoked."
+        )
+
+    def create_oauth_token(self):
+        token = OAuthToken.objects.create(
+            app=self.app,
+            user=self.user,
+            scope=OAuthScope.objects.create(scope_number=0)
+        )
+        token.reissue()
+        return token
+
+    def test_round_trip(self):
+        self.assertTrue(self.app.api_token.startswith(GENERAL_PREFIX))
+        self.assertEqual(parse_app_token(self.app.api_token), {
+            "app_id": self.app.id,
+            "user_id": self.user.id,
+            "version": 0
+        })
+
+    def test_tampered_token_rejected(self):
+        # Another user's ID with the original signature
+        mac = self.app.api_token.rpartition(".")[2]
+        forged = "{}{}.{}.0.{}".format(
+            GENERAL_PREFIX,
+            self.app.id,
+            self.user.id + 1,
+            mac
+        )
+        self.assertIsNone(parse_app_token(forged))
+
+        response = self.get(forged)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content.decode())["error"],
+            "Token does not exist."
+        )
+
+    def test_not_accepted_without_secret(self):
+        with unittest.mock.patch("common.signed_tokens.SIGNED_TOKENS_SECRET", ""):
+            self.assertIsNone(parse_app_token(self.app.api_token))
+
+    def test_authorised_without_database(self):
+        self.assertEqual(self.get(self.app.api_token).status_code, 200)
+
+        # Once the user's quota has been cached no queries are needed
+        with self.assertNumQueries(0):
+            response = self.get(self.app.api_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(self.r.get(self.user.email)), 2)
+
+    def test_regenerated_token_revoked(self):
+        old_token = self.app.api_token
+        new_token = self.app.regenerate_token()
+
+        self.assertRevoked(self.get(old_token))
+        self.assertEqual(self.get(new_token).status_code, 200)
+
+    def test_deleted_app_revoked(self):
+        oauth_token = self.create_oauth_token()
+        self.app.deleted = True
+        self.app.save()
+
+        self.assertRevoked(self.get(self.app.api_token))
+        self.assertRevoked(self.get(
+            oauth_token.token,
+            client_secret=self.app.client_secret
+        ))
+
+    def test_oauth_token(self):
+        token = self.create_oauth_token()
+        self.assertTrue(token.token.startswith(OAUTH_PREFIX))
+
+        response = self.get(token.token, client_secret=self.app.client_secret)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.get(token.token, client_secret="wrong")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content.decode())["error"],
+            "Client secret incorrect."
+        )
+
+    def test_deactivated_oauth_token_revoked(self):
+        token = self.create_oauth_token()
+        token.active = False
+        token.save()
+
+        self.assertRevoked(
+            self.get(token.token, client_secret=self.app.client_secret)
+        )
+
+        # Reactivating the token issues a new one
+        old_token = token.token
+        token.active = True
+        token.save()
+        token.reissue()
+
+        self.assertNotEqual(token.token, old_token)
+        response = self.get(token.token, client_secret=self.app.client_secret)
+        self.assertEqual(response.status_code, 200)
+
+    def test_opaque_tokens_kept_when_not_issuing(self):
+        with unittest.mock.patch("oauth.models.ISSUE_SIGNED_TOKENS", False):
+            token = OAuthToken.objects.create(
+                app=self.app,
+                user=self.user,
+                scope=OAuthScope.objects.create(scope_number=0)
+            )
+            opaque_token = token.token
+            token.reissue()
+
+        self.assertEqual(token.token, opaque_token)
+
+
+class CompressionTestCase(TestCase):
+    last_modified_key = "http:headers:Last-Modified:" + __name__
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="compression@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=0
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:05+00:00")
+        precompressed_view_calls.clear()
+
+    def tearDown(self):
+        self.r.delete(self.last_modified_key, self.user.email)
+        for key in self.r.scan_iter("precompressed:*"):
+            self.r.delete(key)
+
+    def get(self, n=500, accept_encoding="gzip"):
+        request = self.factory.get(
+            "/test/precompressed",
+            {"token": self.app.api_token, "n": n},
+            HTTP_ACCEPT_ENCODING=accept_encoding
+        )
+        return precompressed_view(request)
+
+    def test_negotiate_encoding(self):
+        def negotiate(accept_encoding):
+            return negotiate_encoding(self.factory.get(
+                "/test",
+                HTTP_ACCEPT_ENCODING=accept_encoding
+            ))
+
+        self.assertEqual(negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(negotiate("*"), negotiate("gzip, br"))
+        self.assertIsNone(negotiate(""))
+        self.assertIsNone(negotiate("identity"))
+        self.assertIsNone(negotiate("gzip;q=0, deflate"))
+
+    def test_compressed(self):
+        response = self.get()
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        data = json.loads(gzip.decompress(response.content).decode())
+        self.assertEqual(len(data["rooms"]), 500)
+
+    def test_small_response_not_compressed(self):
+        response = self.get(n=1)
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertTrue(json.loads(response.content.decode())["ok"])
+
+    def test_not_compressed_unless_accepted(self):
+        response = self.get(accept_encoding="identity")
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(precompressed_view_calls), 1)
+
+    def test_precompressed_once_per_generation(self):
+        first = self.get()
+        second = self.get()
+
+        self.assertEqual(len(precompressed_view_calls), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Content-Type"], "application/json")
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertTrue(second.has_header("X-RateLimit-Remaining"))
+        self.assertEqual(int(self.r.get(self.user.email)), 2)
+
+        # Other parameters and data generations are not served the same bytes
+        self.get(n=499)
+        self.assertEqual(len(precompressed_view_calls), 2)
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:06+00:00")
+        self.get()
+        self.assertEqual(len(precompressed_view_calls), 3)
+
+
+class ResponseCacheTestCase(TestCase):
+    last_modified_key = "http:headers:Last-Modified:" + __name__
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="responsecache@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=0
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:05+00:00")
+        cached_view_calls.clear()
+
+    def tearDown(self):
+        self.r.delete(self.last_modified_key, self.user.email)
+        for key in self.r.scan_iter("response:*"):
+            self.r.delete(key)
+
+    def get(self, rooms="a,b", token=None, **params):
+        params.update({"token": token or self.app.api_token, "rooms": rooms})
+        return cached_view(self.factory.get("/test/cached", params))
+
+    def test_cached_once_per_generation(self):
+        first = self.get()
+        second = self.get()
+
+        self.assertEqual(len(cached_view_calls), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Content-Type"], "application/json")
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second["Last-Modified"], first["Last-Modified"])
+
+        # Every call is still authorised and counted
+        self.assertEqual(int(self.r.get(self.user.email)), 2)
+        self.assertEqual(self.get(token="uclapi-invalid").status_code, 400)
+        self.assertEqual(len(cached_view_calls), 1)
+
+        # The data generation changing invalidates the cache
+        self.r.set(self.last_modified_key, "2019-01-24T00:10:06+00:00")
+        self.get()
+        self.assertEqual(len(cached_view_calls), 2)
+
+    def test_keyed_by_normalised_query(self):
+        self.get(rooms="a,b")
+        self.get(rooms="a,c")
+        self.assertEqual(len(cached_view_calls), 2)
+
+        # Tokens are not part of the key, so another app shares the cache
+        other_app = App.objects.create(user=self.user, name="Other App")
+        self.assertEqual(
+            json.loads(self.get(rooms="a,c", token=other_app.api_token).content),
+            {"ok": True, "rooms": ["a", "c"]}
+        )
+        self.assertEqual(len(cached_view_calls), 2)
+
+    def test_errors_not_cached(self):
+        self.assertEqual(self.get(error=1).status_code, 400)
+        self.assertEqual(self.get(error=1).status_code, 400)
+        self.assertEqual(len(cached_view_calls), 2)
+
+    def test_streaming_response_not_cached(self):
+        first = self.get(stream=1)
+        second = self.get(stream=1)
+
+        # Streaming responses are left to stream rather than buffered
+        self.assertTrue(first.streaming)
+        self.assertEqual(len(cached_view_calls), 2)
+        self.assertEqual(
+            json.loads(b"".join(first.streaming_content)),
+            json.loads(b"".join(second.streaming_content))
+        )
+
+    def test_not_cached_without_generation(self):
+        self.r.delete(self.last_modified_key)
+        self.get()
+        self.get()
+        self.assertEqual(len(cached_view_calls), 2)
+
+
+class LocalCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = LocalCache(max_size=2)
+        self.invalidated = []
+        self.cache.register("test", 60)
+        self.cache.register(
+            "other",
+            60,
+            on_invalidate=lambda: self.invalidated.append("other")
+        )
+        self.loads = []
+
+    def load(self, value):
+        def load():
+            self.loads.append(value)
+            return value
+        return load
+
+    def test_loaded_once(self):
+        self.assertEqual(self.cache.get("test", "a", self.load(1)), 1)
+        self.assertEqual(self.cache.get("test", "a", self.load(2)), 1)
+        self.assertEqual(self.loads, [1])
+
+    def test_expired_entries_are_reloaded(self):
+        self.cache.register("test", 0)
+        self.cache.get("test", "a", self.load(1))
+        time.sleep(0.01)
+        self.assertEqual(self.cache.get("test", "a", self.load(2)), 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.get("test", "a", self.load(1))
+        self.cache.get("test", "b", self.load(2))
+        self.cache.get("test", "a", self.load(None))
+        self.cache.get("test", "c", self.load(3))
+
+        self.assertEqual(self.cache.get("test", "a", self.load(None)), 1)
+        self.assertEqual(self.cache.get("test", "b", self.load(4)), 4)
+
+    def test_evict_namespace(self):
+        self.cache.get("test", "a", self.load(1))
+        self.cache.get("other", "a", self.load(2))
+        # Subscribing for the first time clears everything
+        self.assertEqual(self.invalidated, ["other"])
+        self.invalidated.clear()
+        self.cache.evict("other")
+
+        self.assertEqual(self.invalidated, ["other"])
+        self.assertEqual(self.cache.get("test", "a", self.load(None)), 1)
+        self.assertEqual(self.cache.get("other", "a", self.load(3)), 3)
+
+    def test_value_loaded_during_invalidation_not_cached(self):
+        def load():
+            self.cache.evict("test")
+            return 1
+
+        self.cache.get("test", "a", load)
+        self.assertEqual(self.cache.get("test", "a", self.load(2)), 2)
+
+    def test_disabled(self):
+        cache = LocalCache(max_size=0)
+        cache.register("test", 60)
+        cache.get("test", "a", self.load(1))
+        cache.get("test", "a", self.load(2))
+        self.assertEqual(self.loads, [1, 2])
+
+    def test_invalidated_by_other_workers(self):
+        local_cache.register("test-local-cache", 60)
+        local_cache.get("test-local-cache", "a", self.load(1))
+
+        # Published as another worker would, so only the subscriber evicts
+        get_redis().publish(LOCAL_CACHE_CHANNEL, "test-local-cache")
+        for _ in range(100):
+            value = local_cache.get("test-local-cache", "a", self.load(2))
+            if value == 2:
+                break
+            time.sleep(0.02)
+        self.assertEqual(value, 2)
+
+        invalidate_local_cache("test-local-cache")
+        self.assertEqual(
+            local_cache.get("test-local-cache", "a", self.load(3)),
+            3
+        )
+
+    def test_reads_counted(self):
+        render_metrics()
+        get_redis().delete(METRICS_KEY)
+
+        self.cache.get("test", "a", self.load(1))
+        self.cache.get("test", "a", self.load(1))
+        metrics = render_metrics()
+
+        self.assertIn(
+            'uclapi_local_cache_reads_total{namespace="test",result="hit"} 1',
+            metrics
+        )
+        self.assertIn(
+            'uclapi_local_cache_reads_total{namespace="test",result="miss"} 1',
+            metrics
+        )
+        get_redis().delete(METRICS_KEY)
+
+
+class RedisCodecTestCase(TestCase):
+    large = json.dumps([{"sensor_id": i, "state": "absent"} for i in range(100)])
+
+    def tearDown(self):
+        get_redis().delete(
+            "timetable:personal:codec-small",
+            "timetable:personal:codec-large",
+            "timetable:personal:codec-compressed"
+        )
+
+    def test_small_values_not_compressed(self):
+        self.assertEqual(encode_value('{"ok":true}'), b'{"ok":true}')
+        self.assertEqual(decode_value(b'{"ok":true}'), b'{"ok":true}')
+
+    def test_large_values_compressed(self):
+        encoded = encode_value(self.large)
+
+        self.assertTrue(is_encoded(encoded))
+        self.assertLess(len(encoded), len(self.large) // 4)
+        self.assertEqual(original_size(encoded), len(self.large))
+        self.assertEqual(decode_text(encoded), self.large)
+
+    def test_incompressible_values_not_compressed(self):
+        value = os.urandom(4096)
+        self.assertEqual(encode_value(value), value)
+
+    def test_missing_values(self):
+        self.assertIsNone(decode_value(None))
+        self.assertIsNone(decode_text(None))
+
+    def test_migrate_and_report(self):
+        r = get_redis()
+        r.set("timetable:personal:codec-small", '{"ok":true}')
+        r.set("timetable:personal:codec-large", self.large, ex=600)
+        r.set("timetable:personal:codec-compressed", encode_value(self.large))
+
+        out = io.StringIO()
+        call_command(
+            "compress_redis_values",
+            "--report",
+            "--namespace", "timetable:personal",
+            stdout=out
+        )
+        self.assertIn("3 keys, 1 compressed,", out.getvalue())
+        self.assertEqual(r.get("timetable:personal:codec-large"), self.large.encode())
+
+        out = io.StringIO()
+        call_command(
+            "compress_redis_values",
+            "--namespace", "timetable:personal",
+            stdout=out
+        )
+        self.assertIn("3 keys, 2 compressed (1 just now),", out.getvalue())
+
+        migrated = r.get("timetable:personal:codec-large")
+        self.assertTrue(is_encoded(migrated))
+        self.assertEqual(decode_text(migrated), self.large)
+        self.assertGreater(r.ttl("timetable:personal:codec-large"), 0)
+        self.assertEqual(r.get("timetable:personal:codec-small"), b'{"ok":true}')
+
+
+REDIS_SERVER = shutil.which("redis-server")
+
+
+def _free_port():
+    # Cluster nodes also listen on their port plus 10000
+    while True:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        if port + 10000 <= 65535:
+            return port
+
+
+@unittest.skipIf(REDIS_SERVER is None, "redis-server is not installed")
+class RedisClusterTestCase(SimpleTestCase):
+    """Runs against a local three node cluster of redis-server processes."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        cls.ports = [_free_port() for _ in range(3)]
+        try:
+            cls._start_cluster()
+        except Exception:
+            cls._stop_cluster()
+            raise
+
+    @classmethod
+    def _start_cluster(cls):
+        cls.servers = [
+            subprocess.Popen(
+                [
+                    REDIS_SERVER,
+                    "--port", str(port),
+                    "--cluster-enabled", "yes",
+                    "--cluster-config-file", "nodes-{}.conf".format(port),
+                    "--save", "",
+                    "--appendonly", "no"
+                ],
+                cwd=cls.directory,
+                stdout=subprocess.DEVNULL
+            )
+            for port in cls.ports
+        ]
+
+        nodes = [redis.Redis(port=port) for port in cls.ports]
+        for node in nodes:
+            for _ in range(100):
+                try:
+                    node.ping()
+                    break
+                except redis.exceptions.ConnectionError:
+                    time.sleep(0.1)
+
+        # Split the slots evenly between the nodes and join them up
+        for i, node in enumerate(nodes):
+            node.execute_command(
+                "CLUSTER ADDSLOTS",
+                *range(i * 16384 // 3, (i + 1) * 16384 // 3)
+            )
+        for port in cls.ports[1:]:
+            nodes[0].execute_command("CLUSTER MEET", "127.0.0.1", port)
+        for _ in range(100):
+            if all(
+                node.cluster("info")["cluster_state"] == "ok" and
+                int(node.cluster("info")["cluster_known_nodes"]) == 3
+                for node in nodes
+            ):
+                break
+            time.sleep(0.1)
+
+    @classmethod
+    def _stop_cluster(cls):
+        for server in getattr(cls, "servers", []):
+            server.terminate()
+            server.wait()
+        shutil.rmtree(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._stop_cluster()
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = unittest.mock.patch.multiple(
+            "common.redis_client",
+            REDIS_CLUSTER_MODE=True,
+            REDIS_UCLAPI_HOST=",".join(
+                "127.0.0.1:{}".format(port) for port in self.ports
+            ),
+            _clusters={}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.r = get_redis()
+
+    def test_keys_unchanged_outside_cluster_mode(self):
+        with unittest.mock.patch(
+            "common.redis_client.REDIS_CLUSTER_MODE",
+            False
+        ):
+            self.assertEqual(auth_key("test@ucl.ac.uk"), "test@ucl.ac.uk")
+            self.assertEqual(
+                last_modified_key("gencache"),
+                "http:headers:Last-Modified:gencache"
+            )
+
+    def test_keys_spread_across_nodes(self):
+        self.assertIsInstance(self.r, redis.RedisCluster)
+
+        nodes = {
+            self.r.get_node_from_key("test:cluster:{}".format(i)).name
+            for i in range(20)
+        }
+        self.assertEqual(len(nodes), 3)
+
+        tag = hash_tag("test")
+        self.assertEqual(len({
+            self.r.keyslot(tag + "test:cluster:{}".format(i))
+            for i in range(20)
+        }), 1)
+
+    def test_transaction_within_slot(self):
+        tag = hash_tag("test")
+        pipeline = self.r.pipeline(transaction=True)
+        pipeline.delete(tag + "list", tag + "hash")
+        pipeline.rpush(tag + "list", "a", "b")
+        pipeline.hset(tag + "hash", "field", "value")
+        self.assertEqual(pipeline.execute(), [0, 2, 1])
+
+        self.assertEqual(self.r.lrange(tag + "list", 0, -1), [b"a", b"b"])
+        self.assertEqual(self.r.hget(tag + "hash", "field"), b"value")
+        self.r.delete(tag + "list", tag + "hash")
+
+    def test_transaction_across_slots(self):
+        pipeline = self.r.pipeline(transaction=True)
+        pipeline.set("test:cluster:a", 1)
+        pipeline.set("test:cluster:b", 2)
+        with self.assertRaises(redis.exceptions.RedisClusterException):
+            pipeline.execute()
+        self.assertIsNone(self.r.get("test:cluster:a"))
+
+        # Pipelines that are not transactions are split between the nodes
+        pipeline = self.r.pipeline()
+        pipeline.set("test:cluster:a", 1)
+        pipeline.set("test:cluster:b", 2)
+        self.assertEqual(pipeline.execute(), [True, True])
+        self.r.delete("test:cluster:a", "test:cluster:b")
+
+    def test_commands_counted(self):
+        counts = []
+        with count_commands(counts.append):
+            self.r.get("test:cluster:a")
+            pipeline = self.r.pipeline(transaction=True)
+            pipeline.get(hash_tag("test") + "a")
+            pipeline.get(hash_tag("test") + "b")
+            pipeline.execute()
+        # MULTI and EXEC are counted along with the queued commands
+        self.assertEqual(sum(counts), 5)
+
+        self.assertEqual(len([
+            name for name in get_pool_stats() if name.startswith("bytes:")
+        ]), 3)
+
+    def test_authorise_api_call(self):
+        user = unittest.mock.Mock(
+            email="cluster@ucl.ac.uk",
+            dev_quota=2,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=10
+        )
+        token = unittest.mock.Mock(id="A1", user=user)
+        revoked_key = auth_key("tokens:revoked")
+        self.r.set(last_modified_key("gencache"), "2020-01-01T00:00:00+00:00")
+        self.addCleanup(
+            self.r.delete,
+            auth_key(user.email),
+            auth_key("burst:app:A1"),
+            revoked_key,
+            last_modified_key("gencache")
+        )
+
+        with unittest.mock.patch(
+            "common.decorators._auth_script",
+            self.r.register_script(AUTH_SCRIPT)
+        ), unittest.mock.patch(
+            "common.decorators.REVOKED_TOKENS_KEY",
+            revoked_key
+        ):
+            token_valid, throttle_data, last_modified = _authorise_api_call(
+                token,
+                "general",
+                last_modified_redis_key="gencache",
+                revocations=("revoked",)
+            )
+            self.assertTrue(token_valid)
+            self.assertFalse(throttle_data[0])
+            self.assertEqual(last_modified, b"2020-01-01T00:00:00+00:00")
+            self.assertEqual(int(self.r.get(auth_key(user.email))), 1)
+
+            self.r.sadd(revoked_key, "revoked")
+            token_valid, _, _ = _authorise_api_call(
+                token,
+                "general",
+                revocations=("revoked",)
+            )
+            self.assertFalse(token_valid)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        self.router = ModelRouter()
+        patcher = unittest.mock.patch.dict(
+            "uclapi.dbrouters.DATABASE_REPLICAS",
+            {"gencache": ["gencache_replica_1"]},
+            clear=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.fresh = {"gencache_replica_1": True}
+        patcher = unittest.mock.patch(
+            "uclapi.dbrouters._replica_lag.is_fresh",
+            side_effect=lambda alias: self.fresh[alias]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(ModuleA), "gencache")
+        self.assertEqual(self.router.db_for_read(Lock), "default")
+
+    def test_replica_reads(self):
+        with replica_reads():
+            self.assertEqual(
+                self.router.db_for_read(ModuleA),
+                "gencache_replica_1"
+            )
+            # Databases without replicas and writes use the primary
+            self.assertEqual(self.router.db_for_read(Lock), "default")
+            self.assertEqual(self.router.db_for_write(ModuleA), "gencache")
+
+        self.assertEqual(self.router.db_for_read(ModuleA), "gencache")
+
+    def test_lagging_replica(self):
+        self.fresh["gencache_replica_1"] = False
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(ModuleA), "gencache")
+
+    def test_read_from_replicas(self):
+        routed = []
+
+        def rooms():
+            for _ in range(2):
+                routed.append(self.router.db_for_read(ModuleA))
+                yield {}
+
+        @read_from_replicas
+        def view(request):
+            routed.append(self.router.db_for_read(ModuleA))
+            return StreamingJsonResponse({"rooms": rooms()})
+
+        response = view(None)
+        b"".join(response.streaming_content)
+        self.assertEqual(routed, ["gencache_replica_1"] * 3)
+        self.assertEqual(self.router.db_for_read(ModuleA), "gencache")
+
+    def test_token_loaded_from_primary(self):
+        user = User.objects.create(
+            email="replicas@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True,
+            burst_limit_per_second=0,
+            burst_limit_per_minute=0
+        )
+        app = App.objects.create(user=user, name="Test App")
+        self.addCleanup(get_redis().delete, user.email)
+
+        # The replica does not exist, so reading the token from it would fail
+        self.fresh["default_replica_1"] = True
+        with unittest.mock.patch.dict(
+            "uclapi.dbrouters.DATABASE_REPLICAS",
+            {"default": ["default_replica_1"]}
+        ):
+            request = APIRequestFactory().get(
+                "/test/replicas",
+                {"token": app.api_token}
+            )
+            response = replica_view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content.decode())["email"],
+            user.email
+        )
+
+    def test_lag_measured(self):
+        lag = _ReplicaLag()
+        # The primary is never behind
+        self.assertEqual(lag._measure("default"), 0)
+
+        with unittest.mock.patch.object(
+            lag,
+            "_measure",
+            return_value=120.0
+        ) as measure:
+            self.assertFalse(lag.is_fresh("gencache_replica_1"))
+            self.assertFalse(lag.is_fresh("gencache_replica_1"))
+        # Checks are only repeated every DATABASE_REPLICA_CHECK_INTERVAL
+        measure.assert_called_once_with("gencache_replica_1")
+
+    def test_stalled_replica(self):
+        lag = _ReplicaLag()
+        cursor = unittest.mock.MagicMock()
+        # No lag is given for a replica that is no longer streaming
+        cursor.__enter__.return_value.fetchone.return_value = (None,)
+        with unittest.mock.patch(
+            "uclapi.dbrouters.connections",
+            {"gencache_replica_1": unittest.mock.Mock(
+                cursor=unittest.mock.Mock(return_value=cursor)
+            )}
+        ):
+            self.assertFalse(lag.is_fresh("gencache_replica_1"))
+
+    def test_wait_for_replicas(self):
+        self.assertTrue(wait_for_replicas("default"))
+
+        with unittest.mock.patch.dict(
+            "uclapi.dbrouters.DATABASE_REPLICAS",
+            {"default": ["default"]}
+        ):
+            self.assertTrue(wait_for_replicas("default", timeout=1))
+
+
+class AdmissionControlTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            email="admission@ucl.ac.uk",
+            full_name="Test User",
+            given_name="Test",
+            cn="test",
+            department="Dept. of Tests",
+            employee_id="TESTU12345",
+            raw_intranet_groups="test1;test2",
+            agreement=True
+        )
+        self.app = App.objects.create(user=self.user, name="Test App")
+        self.r = get_redis()
+        render_metrics()
+        self.r.delete(METRICS_KEY)
+
+        patcher = unittest.mock.patch.multiple(
+            admission_controller,
+            limits={"test": 1},
+            max_queue_time=30
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.r.delete(METRICS_KEY, self.user.email)
+
+    def get(self, **extra):
+        request = self.factory.get(
+            "/test/conditional",
+            {"token": self.app.api_token},
+            **extra
+        )
+        return conditional_view(request)
+
+    def test_in_flight_limit(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(admission_controller.in_flight("test"), 0)
+
+        self.assertIsNone(admission_controller.acquire("test"))
+        try:
+            response = self.get()
+        finally:
+            admission_controller.release("test")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        # Shed requests use none of the quota
+        self.assertEqual(int(self.r.get(self.user.email)), 1)
+        self.assertIn(
+            'uclapi_requests_shed_total'
+            '{service="test",reason="in_flight"} 1',
+            render_metrics()
+        )
+
+    def test_queue_time_budget(self):
+        response = self.get(
+            HTTP_X_REQUEST_START="t={:.3f}".format(time.time() - 60)
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(
+            'uclapi_requests_shed_total'
+            '{service="test",reason="queue_time"} 1',
+            render_metrics()
+        )
+
+        response = self.get(
+            HTTP_X_REQUEST_START="t={:.3f}".format(time.time() - 1)
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_released_when_view_fails(self):
+        controller = AdmissionController({}, 1, 0)
+        with unittest.mock.patch(
+            "common.decorators.admission_controller",
+            controller
+        ), unittest.mock.patch(
+            "common.tests.JsonResponse",
+            side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.get()
+        self.assertEqual(controller.in_flight("test"), 0)
+
+
+class HttpClientTestCase(SimpleTestCase):
+    url = "https://upstream.example.com/data"
+
+    def setUp(self):
+        self.client = HttpClient("test", retries=2, backoff=0)
+        render_metrics()
+        get_redis().delete(METRICS_KEY)
+
+    def tearDown(self):
+        get_redis().delete(METRICS_KEY)
+
+    def test_deadlines(self):
+        with requests_mock.Mocker() as m:
+            m.get(self.url, json={"ok": True})
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertEqual(m.request_history[0].timeout, self.client.timeout)
+
+    def test_cookies_not_kept(self):
+        # requests_mock does not fill the session's cookie jar, so a real
+        # server is used
+        cookies = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                cookies.append(self.headers.get("Cookie"))
+                self.send_response(200)
+                self.send_header("Set-Cookie", "session=abc; Path=/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{}/data".format(server.server_port)
+            self.client.get(url)
+            self.client.get(url)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(cookies, [None, None])
+        self.assertEqual(len(self.client.session.cookies), 0)
+
+    def test_retries(self):
+        with requests_mock.Mocker() as m:
+            m.get(self.url, [
+                {"exc": requests.exceptions.ConnectTimeout},
+                {"status_code": 503},
+                {"status_code": 200}
+            ])
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.assertEqual(m.call_count, 3)
+
+        metrics = render_metrics()
+        for outcome in ("timeout", "server_error", "ok"):
+            self.assertIn(
+                'uclapi_upstream_requests_total'
+                '{{upstream="test",outcome="{}"}} 1'.format(outcome),
+                metrics
+            )
+        self.assertIn(
+            'uclapi_upstream_request_seconds_count{upstream="test"} 3',
+            metrics
+        )
+
+    def test_retries_are_bounded(self):
+        with requests_mock.Mocker() as m:
+            m.get(self.url, status_code=503)
+            self.assertEqual(self.client.get(self.url).status_code, 503)
+            self.assertEqual(m.call_count, 3)
+
+    def test_sent_post_not_retried(self):
+        with requests_mock.Mocker() as m:
+            m.post(self.url, [
+                {"exc": requests.exceptions.ReadTimeout},
+                {"status_code": 200}
+            ])
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                self.client.post(self.url)
+            self.assertEqual(m.call_count, 1)
+
+            m.post(self.url, [
+                {"exc": requests.exceptions.ConnectTimeout},
+                {"status_code": 200}
+            ])
+            self.assertEqual(self.client.post(self.url).status_code, 200)
+
+    def test_circuit_breaker(self):
+        self.client.breaker = CircuitBreaker(2, 0.1)
+
+        with requests_mock.Mocker() as m:
+            m.get(self.url, exc=requests.exceptions.ConnectionError)
+            for _ in range(2):
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    self.client.get(self.url)
+            self.assertEqual(m.call_count, 6)
+
+            # Requests fail without being made while the circuit is open
+            with self.assertRaises(CircuitOpenError):
+                self.client.get(self.url)
+            self.assertEqual(m.call_count, 6)
+
+            # Then a single request is let through to test the upstream
+            time.sleep(0.1)
+            m.get(self.url, status_code=200)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.assertFalse(self.client.breaker.is_open())
+
+    def test_half_open_allows_one_request(self):
+        breaker = CircuitBreaker(1, 0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.05)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+
+class AsyncHttpClientTestCase(SimpleTestCase):
+    url = "https://upstream.example.com/data"
+
+    def setUp(self):
+        self.client = AsyncHttpClient("test", retries=2, backoff=0)
+        self.requests = []
+
+    def _respond(self, *responses):
+        """Answers each request with the next response, or raises it."""
+        responses = list(responses)
+
+        def handler(request):
+            self.requests.append(request)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.client.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+
+    def test_cookies_not_kept(self):
+        def handler(request):
+            self.requests.append(request)
+            return httpx.Response(
+                200,
+                headers={"Set-Cookie": "session=abc; Path=/"}
+            )
+
+        # Only the transport is replaced, so the client keeps its cookie jar
+        self.client.client._transport = httpx.MockTransport(handler)
+        async_to_sync(self.client.get)(self.url)
+        async_to_sync(self.client.get)(self.url)
+
+        self.assertNotIn("Cookie", self.requests[1].headers)
+        self.assertEqual(len(self.client.client.cookies), 0)
+
+    def test_retries(self):
+        self._respond(
+            httpx.ConnectTimeout("timed out"),
+            httpx.Response(503),
+            httpx.Response(200, json={"ok": True})
+        )
+        response = async_to_sync(self.client.get)(self.url)
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertEqual(len(self.requests), 3)
+
+    def test_errors_are_those_of_requests(self):
+        self._respond(httpx.ReadTimeout("timed out"))
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            async_to_sync(self.client.post)(self.url)
+        self.assertEqual(len(self.requests), 1)
+
+        self._respond(*[httpx.ConnectError("refused")] * 3)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            async_to_sync(self.client.get)(self.url)
+
+        # A malformed URL is the caller's fault, so is not retried. Only a
+        # real transport checks the scheme.
+        self.client.client = httpx.AsyncClient()
+        with self.assertRaises(requests.exceptions.MissingSchema):
+            async_to_sync(self.client.get)("not a url")
+        self.assertFalse(self.client.breaker.is_open())
+
+    def test_circuit_breaker(self):
+        self.client.breaker = CircuitBreaker(1, 60)
+        self._respond(*[httpx.Response(503)] * 3)
+        async_to_sync(self.client.get)(self.url)
+        self.assertTrue(self.client.breaker.is_open())
+
+        with self.assertRaises(CircuitOpenError):
+            async_to_sync(self.client.get)(self.url)
+        self.assertEqual(len(self.requests), 3)
+
+
+class ApiFastPathTestCase(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_session_skipped_for_api(self):
+        seen = []
+
+        def get_response(request):
+            seen.append(hasattr(request, "session"))
+            return HttpResponse()
+
+        middleware = SessionMiddleware(get_response)
+        middleware(self.factory.get("/workspaces/surveys"))
+        middleware(self.factory.get("/dashboard/"))
+        self.assertEqual(seen, [False, True])
+
+    def test_csrf_skipped_for_api(self):
+        def view(request):
+            return HttpResponse()
+
+        middleware = CsrfViewMiddleware(lambda request: HttpResponse())
+        for path, expected in (
+            ("/libcal/space/reserve", None),
+            ("/dashboard/api/apps/", 403)
+        ):
+            request = self.factory.post(path)
+            response = middleware.process_view(request, view, (), {})
+            self.assertEqual(getattr(response, "status_code", None), expected)
+
+    def test_simple_api_view(self):
+        view = simple_api_view(["GET"])(
+            lambda request: JsonResponse({"ok": True})
+        )
+        self.assertTrue(view.csrf_exempt)
+        self.assertEqual(view(self.factory.get("/")).status_code, 200)
+
+        response = view(self.factory.post("/"))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response["Allow"], "GET")
+        self.assertEqual(
+            json.loads(response.content.decode()),
+            {"okay": False, "error": 'Method "POST" not allowed.'}
+        )
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command("benchmark_api_path", requests=10, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+@unittest.skipIf(eventlet is None, "eventlet or psycogreen is not installed")
+class GreenDriversTestCase(SimpleTestCase):
+    def test_postgres_queries_cooperate(self):
+        from psycogreen.eventlet import patch_psycopg
+
+        patch_psycopg()
+        self.addCleanup(psycopg2.extensions.set_wait_callback, None)
+
+        params = connections['default'].get_connection_params()
+        pool = eventlet.GreenPool()
+        start = time.perf_counter()
+        for _ in range(5):
+            pool.spawn(self._sleep, psycopg2.connect(**params))
+        pool.waitall()
+        # The queries would take a second one after another
+        self.assertLess(time.perf_counter() - start, 0.6)
+
+    def _sleep(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(0.2)")
+        finally:
+            connection.close()
+
+    def test_oracle_queries_run_in_threads(self):
+        def wrapper(execute, sql, params, many, context):
+            return execute(sql, params, many, context)
+
+        oracle = unittest.mock.Mock(vendor="oracle", execute_wrappers=[wrapper])
+        postgres = unittest.mock.Mock(vendor="postgresql", execute_wrappers=[])
+        for _ in range(2):
+            for connection in (oracle, postgres):
+                _execute_oracle_in_threads(None, connection)
+
+        self.assertEqual(oracle.execute_wrappers, [_execute_in_thread, wrapper])
+        self.assertEqual(postgres.execute_wrappers, [])
+        self.assertEqual(
+            _execute_in_thread(lambda *args: args, "SELECT 1", None, False, {}),
+            ("SELECT 1", None, False, {})
+        )
+
+    def test_benchmark(self):
+        # The benchmark monkey-patches the process it runs in
+        result = subprocess.run(
+            [
+                sys.executable, "manage.py", "benchmark_green_drivers",
+                "--greenlets", "5", "--delay", "0.05"
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.PIPE,
+            check=True
+        )
+        lines = result.stdout.decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("Cooperative drivers"))
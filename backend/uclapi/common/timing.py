@@ -0,0 +1,77 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+# The timer for the request being handled in this context, if it is being
+# measured by common.metrics.measure_request.
+current_timer = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Records how long each phase of a request takes."""
+    def __init__(self):
+        self.start = self._last_lap = time.perf_counter()
+        self.phases = {}
+        self.redis_commands = 0
+        self.db_queries = 0
+
+    def _add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0) + duration
+
+    def lap(self, phase):
+        """Attributes the time since the previous lap to phase."""
+        now = time.perf_counter()
+        self._add(phase, now - self._last_lap)
+        self._last_lap = now
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def count_redis_commands(self, count):
+        self.redis_commands += count
+
+    def count_db_query(self, execute, sql, params, many, context):
+        self.db_queries += 1
+        return execute(sql, params, many, context)
+
+    def server_timing(self):
+        """Formats the phases as a Server-Timing header value."""
+        metrics = [
+            "{};dur={:.1f}".format(phase, duration * 1000)
+            for phase, duration in self.phases.items()
+        ]
+        metrics.append("total;dur={:.1f}".format(self.total() * 1000))
+        metrics.append('redis;desc="{} commands"'.format(self.redis_commands))
+        metrics.append('db;desc="{} queries"'.format(self.db_queries))
+        return ", ".join(metrics)
+
+
+def lap(phase):
+    """
+    Attributes the time since the previous lap to phase, if a request is
+    being measured.
+    """
+    timer = current_timer.get()
+    if timer is not None:
+        timer.lap(phase)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Attributes the time spent in the block to phase, and not to the lap it
+    happens within, if a request is being measured.
+    """
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        timer._add(phase, duration)
+        timer._last_lap += duration
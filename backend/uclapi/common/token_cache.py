@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.utils.crypto import constant_time_compare
+
+from uclapi.settings import TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL
+
+from .metrics import increment_counter
+from .redis_client import InvalidationListener, get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Every worker subscribes to this channel. Writers publish a tag such as
+# "app:<id>" on it whenever a row backing a cached token changes.
+INVALIDATION_CHANNEL = "uclapi:token-cache:invalidate"
+
+
+class CachedUser:
+    """The parts of a dashboard User needed to throttle a request."""
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.dev_quota = user.dev_quota
+        self.oauth_quota = user.oauth_quota
+        self.burst_limit_per_second = user.burst_limit_per_second
+        self.burst_limit_per_minute = user.burst_limit_per_minute
+
+    def tags(self):
+        return {"user:{}".format(self.id)}
+
+
+class CachedApp:
+    """A resolved general (App) token."""
+    def __init__(self, app):
+        self.id = app.id
+        self.api_token = app.api_token
+        self.user_id = app.user_id
+        self.user = CachedUser(app.user)
+
+    def revocations(self):
+        return []
+
+    def tags(self):
+        return {
+            "token:" + self.api_token,
+            "app:{}".format(self.id),
+            "user:{}".format(self.user_id)
+        }
+
+
+class CachedOAuthToken:
+    """A resolved OAuth token, along with the state of its app and scope."""
+    def __init__(self, token):
+        self.id = token.id
+        self.token = token.token
+        self.active = token.active
+        self.app_id = token.app_id
+        self.app_deleted = token.app.deleted
+        self.client_secret = token.app.client_secret
+        self.user_id = token.user_id
+        self.user = CachedUser(token.user)
+        self.scope_id = token.scope_id
+        self.scope_number = token.scope.scope_number
+
+    def client_secret_matches(self, client_secret):
+        return constant_time_compare(self.client_secret, client_secret)
+
+    def revocations(self):
+        return []
+
+    def tags(self):
+        return {
+            "token:" + self.token,
+            "oauth:{}".format(self.id),
+            "app:{}".format(self.app_id),
+            "user:{}".format(self.user_id),
+            "scope:{}".format(self.scope_id)
+        }
+
+
+class TokenCache:
+    """
+    A bounded, TTL'd LRU cache of resolved tokens, local to one process.
+
+    Entries are only served while this process is subscribed to the
+    invalidation channel, so that a token that has been regenerated, revoked
+    or deleted elsewhere is never trusted for longer than it takes the
+    message to arrive. The TTL bounds staleness should a message be lost.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        # Bumped on every invalidation, so that a token loaded from the
+        # database before one arrived is never cached after it
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = InvalidationListener(
+            INVALIDATION_CHANNEL,
+            self.evict,
+            self.clear
+        )
+
+    def get(self, token_code, load):
+        """
+        Returns the identity cached for a token, or calls load to resolve it
+        from the database and caches what it returns. Exceptions raised by
+        load, such as DoesNotExist, are passed on and nothing is cached.
+        """
+        if not self._listening():
+            return load()
+
+        with self._lock:
+            entry = self._entries.get(token_code)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(token_code)
+                increment_counter("uclapi_token_cache_reads_total", ("hit",))
+                return entry[1]
+            generation = self._generation
+
+        increment_counter("uclapi_token_cache_reads_total", ("miss",))
+        identity = load()
+
+        with self._lock:
+            if generation != self._generation:
+                return identity
+            self._entries[token_code] = (
+                time.monotonic() + self.ttl,
+                identity
+            )
+            self._entries.move_to_end(token_code)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            increment_counter(
+                "uclapi_token_cache_evictions_total", ("size",), evicted
+            )
+        return identity
+
+    def evict(self, tag):
+        """Drops every entry that depends on the row identified by tag."""
+        with self._lock:
+            stale = [
+                token_code
+                for token_code, (_, identity) in self._entries.items()
+                if tag in identity.tags()
+            ]
+            for token_code in stale:
+                del self._entries[token_code]
+            self._generation += 1
+        if stale:
+            increment_counter(
+                "uclapi_token_cache_evictions_total",
+                ("invalidated",),
+                len(stale)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _listening(self):
+        return self.max_size > 0 and self._listener.listening()
+
+
+token_cache = TokenCache(TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL)
+
+
+def invalidate_tokens(*tags):
+    """
+    Evicts cached tokens depending on any of the given tags, both in this
+    process and, via Redis, in every other worker.
+    """
+    for tag in tags:
+        token_cache.evict(tag)
+
+    try:
+        r = get_redis()
+        for tag in tags:
+            r.publish(INVALIDATION_CHANNEL, tag)
+    except redis.exceptions.RedisError:
+        logger.warning(
+            "Could not publish token cache invalidation for %s",
+            ", ".join(tags),
+            exc_info=True
+        )
@@ -1,11 +1,17 @@
 
 from django.db import connections
 from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from common.helpers import PrettyJsonResponse
+from common.metrics import render_metrics
+from common.redis_client import get_pool_stats
+from dashboard.api_call_log import get_dropped_api_calls, get_queued_api_calls
 
 from datetime import datetime, timedelta
 from time import sleep
 from uclapi.celery import ping_sample_task
+from uclapi.settings import METRICS_TOKEN
 
 
 def ping_view(request):
@@ -62,6 +68,36 @@ def ping_view(request):
         "ping": {
             "databases": database_connections,
             "cache": cache_connection,
-            "celery": celery_connection
+            "celery": celery_connection,
+            "redis_pools": get_pool_stats()
         }
     })
+
+
+def metrics_view(request):
+    # The metrics are not public, so are not served at all until a token
+    # to request them with has been set
+    if not METRICS_TOKEN:
+        return HttpResponse(status=404)
+    if not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''),
+        'Bearer ' + METRICS_TOKEN
+    ):
+        return HttpResponse(status=401)
+
+    metrics = render_metrics({
+        "uclapi_api_call_log_queued": (
+            "gauge",
+            "API calls waiting to be written to the database.",
+            get_queued_api_calls()
+        ),
+        "uclapi_api_call_log_dropped_total": (
+            "counter",
+            "API calls dropped because the log queue was full.",
+            get_dropped_api_calls()
+        )
+    })
+    return HttpResponse(
+        metrics,
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,7 +1,6 @@
 import json
 import logging
 
-import redis
 from django.db.models import Count
 
 from django.http import JsonResponse
@@ -11,7 +10,7 @@ from django.utils.datetime_safe import datetime
 from oauth.models import OAuthToken
 from oauth.scoping import Scopes
 from common.helpers import PrettyJsonResponse
-from uclapi.settings import REDIS_UCLAPI_HOST
+from common.redis_client import auth_key, get_redis
 
 from .app_helpers import (is_url_unsafe, NOT_HTTPS,
                           NOT_VALID, URL_BLACKLISTED, NOT_PUBLIC)
@@ -47,6 +46,7 @@ def create_app(request):
 
     new_app = App(name=name, user=user)
     new_app.save()
+    new_app.issue_signed_token()
 
     s = Scopes()
 
@@ -479,14 +479,14 @@ def get_apps(request):
 
 
 def get_quota_remaining(token):
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
+    r = get_redis()
 
     if token.startswith('uclapi-user-'):
         Otoken = OAuthToken.objects.filter(token__exact=token).first()
         if Otoken is None:
             return None
 
-        cache_key = "oauth:" + Otoken.user.email
+        cache_key = auth_key("oauth:" + Otoken.user.email)
         limit = Otoken.user.oauth_quota
 
     elif token.startswith('uclapi-'):
@@ -494,7 +494,7 @@ def get_quota_remaining(token):
         if app is None:
             return None
 
-        cache_key = app.user.email
+        cache_key = auth_key(app.user.email)
         limit = app.user.dev_quota
 
     else:
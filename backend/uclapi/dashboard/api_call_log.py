@@ -0,0 +1,190 @@
+import datetime
+import json
+import logging
+
+from django.db import InterfaceError, OperationalError, transaction
+
+from common.redis_client import get_redis, hash_tag
+from oauth.models import OAuthToken
+from uclapi.settings import API_CALL_LOG_FLUSH_SIZE, API_CALL_LOG_MAX_QUEUE
+
+from .models import App, APICall, User
+
+logger = logging.getLogger(__name__)
+
+# API calls are queued in Redis by the protected endpoint decorator and
+# written to the database in batches by the flush_api_calls task. Both keys
+# are used by the enqueue script, so share a hash tag.
+API_CALL_QUEUE_KEY = hash_tag("apicalls") + "dashboard:apicalls:queue"
+API_CALL_DROPPED_KEY = hash_tag("apicalls") + "dashboard:apicalls:dropped"
+# Calls that could not be written, kept so that they can be looked into
+API_CALL_DEAD_LETTER_KEY = (
+    hash_tag("apicalls") + "dashboard:apicalls:deadletter"
+)
+
+# KEYS[1] is the queue and KEYS[2] the dropped call counter.
+# ARGV[1] is the serialised call and ARGV[2] the maximum queue length.
+# Returns 1 if the call was queued and 0 if it was dropped.
+ENQUEUE_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[2]) then
+    redis.call('INCR', KEYS[2])
+    return 0
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+return 1
+"""
+
+_enqueue_script = get_redis().register_script(ENQUEUE_SCRIPT)
+
+
+def enqueue_api_call(
+    app_id,
+    user_id,
+    token_id,
+    token_type,
+    service,
+    method,
+    queryparams
+):
+    """
+    Queues an API call to be logged. If the flush task has fallen so far
+    behind that the queue is full the call is dropped and counted instead.
+    Returns whether the call was queued.
+    """
+    record = json.dumps({
+        "ts": datetime.datetime.now().isoformat(),
+        "app_id": app_id,
+        "user_id": user_id,
+        "token_id": token_id,
+        "token_type": token_type,
+        "service": service,
+        "method": method,
+        "queryparams": queryparams
+    })
+    return bool(_enqueue_script(
+        keys=[API_CALL_QUEUE_KEY, API_CALL_DROPPED_KEY],
+        args=[record, API_CALL_LOG_MAX_QUEUE]
+    ))
+
+
+def get_dropped_api_calls():
+    r = get_redis()
+    return int(r.get(API_CALL_DROPPED_KEY) or 0)
+
+
+def get_queued_api_calls():
+    r = get_redis()
+    return r.llen(API_CALL_QUEUE_KEY)
+
+
+def _existing_ids(model, ids):
+    ids = {i for i in ids if i is not None}
+    return set(
+        model.objects.filter(id__in=ids).values_list("id", flat=True)
+    )
+
+
+def _build_api_calls(records):
+    # The app, user or token may have been deleted since the call was
+    # queued. Their calls would have been deleted along with them, so the
+    # same is done here rather than failing the whole batch.
+    app_ids = _existing_ids(App, (r["app_id"] for r in records))
+    user_ids = _existing_ids(User, (r["user_id"] for r in records))
+    token_ids = _existing_ids(OAuthToken, (r["token_id"] for r in records))
+
+    return [
+        APICall(
+            ts=datetime.datetime.fromisoformat(r["ts"]),
+            app_id=r["app_id"],
+            user_id=r["user_id"],
+            token_id=r["token_id"],
+            token_type=r["token_type"],
+            service=r["service"],
+            method=r["method"],
+            queryparams=r["queryparams"]
+        )
+        for r in records
+        if (
+            r["app_id"] in app_ids
+            and r["user_id"] in user_ids
+            and (r["token_id"] is None or r["token_id"] in token_ids)
+        )
+    ]
+
+
+def _write_api_calls(raw_records):
+    calls = _build_api_calls([json.loads(r) for r in raw_records])
+    # A failed insert must not abort any transaction the flush is part of
+    with transaction.atomic(using="default"):
+        APICall.objects.bulk_create(calls)
+    return len(calls)
+
+
+def _requeue(r, raw_records):
+    # Put the calls back where they came from so they are retried
+    if raw_records:
+        r.lpush(API_CALL_QUEUE_KEY, *reversed(raw_records))
+
+
+def _dead_letter(r, raw_records):
+    if raw_records:
+        logger.error(
+            "Could not log %d API calls, so moved them to %s.",
+            len(raw_records),
+            API_CALL_DEAD_LETTER_KEY
+        )
+        r.rpush(API_CALL_DEAD_LETTER_KEY, *raw_records)
+
+
+def _write_one_by_one(r, raw_records):
+    # Finds the calls that stopped the batch being written, so that only
+    # they are set aside and the rest of the queue keeps moving
+    written = 0
+    failed = []
+    for i, raw_record in enumerate(raw_records):
+        try:
+            written += _write_api_calls([raw_record])
+        except (InterfaceError, OperationalError):
+            _requeue(r, raw_records[i:])
+            _dead_letter(r, failed)
+            raise
+        except Exception:
+            logger.warning("Could not log an API call.", exc_info=True)
+            failed.append(raw_record)
+    _dead_letter(r, failed)
+    return written
+
+
+def flush_api_calls(batch_size=API_CALL_LOG_FLUSH_SIZE):
+    """
+    Drains the queue into the database with one bulk insert per batch.
+    If the database cannot be reached the batch is put back to be retried.
+    If a batch fails for any other reason it is written one call at a time,
+    and the calls that still fail are moved to API_CALL_DEAD_LETTER_KEY.
+    Returns the number of calls written.
+    """
+    r = get_redis()
+    written = 0
+
+    while True:
+        # Take a batch off the front of the queue atomically
+        pipe = r.pipeline(transaction=True)
+        pipe.lrange(API_CALL_QUEUE_KEY, 0, batch_size - 1)
+        pipe.ltrim(API_CALL_QUEUE_KEY, batch_size, -1)
+        raw_records, _ = pipe.execute()
+
+        if not raw_records:
+            break
+
+        try:
+            written += _write_api_calls(raw_records)
+        except (InterfaceError, OperationalError):
+            _requeue(r, raw_records)
+            raise
+        except Exception:
+            written += _write_one_by_one(r, raw_records)
+
+        if len(raw_records) < batch_size:
+            break
+
+    return written
@@ -2,14 +2,13 @@ from binascii import hexlify
 from random import SystemRandom
 
 from common.helpers import generate_api_token
+from common.redis_client import auth_key, get_redis
 from uclapi.settings import (
     MEDIUM_ARTICLE_QUANTITY,
-    REDIS_UCLAPI_HOST,
     DEBUG
 )
 from django.core.management import call_command
 import os
-import redis
 import textwrap
 import validators
 
@@ -19,7 +18,7 @@ URL_BLACKLISTED = 3
 NOT_PUBLIC = 4
 
 def get_articles():
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
+    r = get_redis()
     if not r.exists("Blog:item:1:updated"):
         if DEBUG:
             call_command('update_medium')
@@ -69,12 +68,12 @@ def generate_temp_api_token():
 
 
 def get_temp_token():
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
+    r = get_redis()
 
     token = generate_temp_api_token()
     # We initialise a new temporary token and set it to 1
     # as it is generated at its first usage.
-    r.set(token, 1, 600)
+    r.set(auth_key(token), 1, 600)
     return token
 
 
@@ -1,9 +1,10 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
-import redis
 import xml.etree.ElementTree as ET
 from requests import get as rget
 
+from common.redis_client import get_redis
+
 
 class Command(BaseCommand):
 
@@ -16,11 +17,7 @@ class Command(BaseCommand):
         medium_article_iterator = root.iter('item')
 
         print("Connecting to Redis")
-        self._redis = redis.Redis(
-            host=settings.REDIS_UCLAPI_HOST,
-            charset="utf-8",
-            decode_responses=True
-        )
+        self._redis = get_redis(decode_responses=True)
         pipe = self._redis.pipeline()
         print("Setting Blog keys")
         for i in range(0, settings.MEDIUM_ARTICLE_QUANTITY):
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.13 on 2026-10-17 07:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0017_webhook_last_success_squashed_0019_webhooktriggerhistory_status_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apicall',
+            name='ts',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-17 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0018_alter_apicall_ts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='burst_limit_per_minute',
+            field=models.IntegerField(default=600),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='burst_limit_per_second',
+            field=models.IntegerField(default=25),
+        ),
+    ]
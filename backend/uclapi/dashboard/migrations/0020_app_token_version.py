@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-17 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0019_user_burst_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='token_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
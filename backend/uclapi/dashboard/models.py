@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from .app_helpers import (
     generate_app_id,
     generate_app_client_id,
@@ -7,12 +8,21 @@ from .app_helpers import (
 )
 
 from common.helpers import generate_api_token
+from common.signed_tokens import (
+    app_revocation,
+    is_signed_token,
+    make_app_token,
+    revoke_tokens
+)
+from common.token_cache import invalidate_tokens
 
 from oauth.models import OAuthScope, OAuthToken
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from uclapi.settings import ISSUE_SIGNED_TOKENS, SIGNED_TOKENS_SECRET
+
 models.options.DEFAULT_NAMES += ('_DATABASE',)
 
 
@@ -37,6 +47,9 @@ class User(models.Model):
     created = models.DateTimeField(auto_now=False, auto_now_add=True)
     dev_quota = models.IntegerField(default=10000)
     oauth_quota = models.IntegerField(default=10000)
+    # Calls allowed in a burst by each of the user's tokens. 0 means no limit.
+    burst_limit_per_second = models.IntegerField(default=25)
+    burst_limit_per_minute = models.IntegerField(default=600)
 
     class Meta:
         _DATABASE = 'default'
@@ -60,6 +73,9 @@ class App(models.Model):
         unique=True,
         default=generate_api_token
     )
+    # Incremented whenever the token is regenerated, so that a signed token
+    # can be revoked without also revoking its replacement
+    token_version = models.IntegerField(default=0)
     created = models.DateTimeField(auto_now=False, auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
@@ -91,17 +107,31 @@ class App(models.Model):
     )
 
     def regenerate_token(self):
-        new_token = generate_api_token()
-        self.api_token = new_token
+        if is_signed_token(self.api_token):
+            revoke_tokens(app_revocation(self.id, self.token_version))
+        self.token_version += 1
+
+        if ISSUE_SIGNED_TOKENS:
+            self.api_token = make_app_token(self)
+        else:
+            self.api_token = generate_api_token()
         self.save()
         return self.api_token
 
+    def issue_signed_token(self):
+        """Swaps the token of a new app for a signed one, if enabled."""
+        if ISSUE_SIGNED_TOKENS and not is_signed_token(self.api_token):
+            self.api_token = make_app_token(self)
+            self.save()
+
     class Meta:
         _DATABASE = 'default'
 
 
 class APICall(models.Model):
-    ts = models.DateTimeField(auto_now_add=True)
+    # Calls are written in batches some time after they are made, so the
+    # timestamp is set when the call is queued rather than when it is saved.
+    ts = models.DateTimeField(default=timezone.now, editable=False)
     app = models.ForeignKey(
         App,
         on_delete=models.CASCADE,
@@ -172,3 +202,29 @@ def create_webhook_on_app_creation(sender, instance, created, **kwargs):
     if created:
         new_webhook = Webhook(app=instance)
         new_webhook.save()
+
+
+# Evict cached tokens whenever the rows they were resolved from change, e.g.
+# when a token is regenerated, an app is deleted or a quota is changed.
+@receiver([post_save, post_delete], sender=App)
+def invalidate_cached_app_tokens(sender, instance, **kwargs):
+    invalidate_tokens("app:{}".format(instance.id))
+
+
+# Signed tokens are checked without looking the app up, so they have to be
+# revoked explicitly once it is deleted.
+@receiver(post_save, sender=App)
+def revoke_deleted_app_tokens(sender, instance, **kwargs):
+    if SIGNED_TOKENS_SECRET and instance.deleted:
+        revoke_tokens(app_revocation(instance.id))
+
+
+@receiver(post_delete, sender=App)
+def revoke_removed_app_tokens(sender, instance, **kwargs):
+    if SIGNED_TOKENS_SECRET:
+        revoke_tokens(app_revocation(instance.id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user_tokens(sender, instance, **kwargs):
+    invalidate_tokens("user:{}".format(instance.id))
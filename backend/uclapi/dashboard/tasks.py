@@ -1,16 +1,24 @@
 from __future__ import absolute_import
 
 import os
-import requests
 
 from celery import shared_task
 
+from common.http_client import http_client
+
+from .api_call_log import flush_api_calls
+
 
 @shared_task
 def test_task(param):
     return 'The test task executed with argument "%s" ' % param
 
 
+@shared_task
+def flush_api_calls_task():
+    return flush_api_calls()
+
+
 @shared_task
 def add_user_to_mailing_list_task(email, name):
     add_user_to_mailing_list(email, name)
@@ -29,4 +37,4 @@ def add_user_to_mailing_list(email, name):
 
         headers = {"Authorization": "apikey {}".format(os.environ["MAILCHIMP_API_KEY"])}
 
-        requests.post(os.environ["MAILCHIMP_ENDPOINT"], json=data, headers=headers)
+        http_client("mailchimp").post(os.environ["MAILCHIMP_ENDPOINT"], json=data, headers=headers)
@@ -1,6 +1,7 @@
 import json
 from unittest.mock import patch
 
+from django.db import OperationalError
 from django.test import RequestFactory, TestCase
 from django.utils.datetime_safe import datetime
 from rest_framework.test import APIRequestFactory
@@ -13,6 +14,10 @@ from uclapi.settings import REDIS_UCLAPI_HOST
 from .app_helpers import is_url_unsafe, generate_api_token, \
     generate_app_client_id, generate_app_client_secret, \
     generate_app_id, get_articles
+from .api_call_log import (
+    API_CALL_DEAD_LETTER_KEY, API_CALL_QUEUE_KEY, enqueue_api_call,
+    flush_api_calls, get_dropped_api_calls
+)
 from .middleware.fake_shibboleth_middleware import FakeShibbolethMiddleWare
 from .models import App, User, APICall
 from .webhook_views import (
@@ -104,6 +109,95 @@ class MediumArticleScraperTestCase(TestCase):
         self.assertEqual(articles, medium_article_iterator)
 
 
+class ApiCallLogTestCase(TestCase):
+    def setUp(self):
+        self.r = redis.Redis(host=REDIS_UCLAPI_HOST)
+        # Discard anything queued by other tests
+        self.r.delete(API_CALL_QUEUE_KEY, API_CALL_DEAD_LETTER_KEY)
+        self.addCleanup(self.r.delete, API_CALL_DEAD_LETTER_KEY)
+
+        self.user = User.objects.create(
+            email="apicalls@ucl.ac.uk",
+            cn="apicalls",
+            given_name="Test Test"
+        )
+        self.app = App.objects.create(user=self.user, name="An App")
+
+    def _enqueue(self, app_id=None, service="roombookings"):
+        return enqueue_api_call(
+            app_id=app_id or self.app.id,
+            user_id=self.user.id,
+            token_id=None,
+            token_type="general",
+            service=service,
+            method="rooms",
+            queryparams="{}"
+        )
+
+    def test_calls_written_in_batches(self):
+        for _ in range(5):
+            self._enqueue()
+
+        # Two batches, each checking the app and user exist then inserting
+        # within a savepoint
+        with self.assertNumQueries(2 * 5):
+            written = flush_api_calls(batch_size=3)
+
+        self.assertEqual(written, 5)
+        self.assertEqual(APICall.objects.filter(app=self.app).count(), 5)
+        self.assertEqual(self.r.llen(API_CALL_QUEUE_KEY), 0)
+
+    def test_calls_for_deleted_apps_discarded(self):
+        self._enqueue()
+        self._enqueue(app_id="Adoesnotexist")
+
+        self.assertEqual(flush_api_calls(), 1)
+
+    def test_calls_dropped_when_queue_full(self):
+        dropped = get_dropped_api_calls()
+        with patch("dashboard.api_call_log.API_CALL_LOG_MAX_QUEUE", 2):
+            self.assertTrue(self._enqueue())
+            self.assertTrue(self._enqueue())
+            self.assertFalse(self._enqueue())
+
+        self.assertEqual(get_dropped_api_calls(), dropped + 1)
+        self.assertEqual(flush_api_calls(), 2)
+
+    def test_failing_calls_set_aside(self):
+        self._enqueue()
+        # Too long for the column, so cannot be inserted
+        self._enqueue(service="x" * 101)
+        self.r.rpush(API_CALL_QUEUE_KEY, "not json")
+        self._enqueue()
+
+        with self.assertLogs("dashboard.api_call_log") as logs:
+            self.assertEqual(flush_api_calls(batch_size=4), 2)
+        self.assertIn("Could not log 2 API calls", logs.output[-1])
+        self.assertEqual(APICall.objects.filter(app=self.app).count(), 2)
+        self.assertEqual(self.r.llen(API_CALL_QUEUE_KEY), 0)
+
+        dead_letters = self.r.lrange(API_CALL_DEAD_LETTER_KEY, 0, -1)
+        self.assertEqual(len(dead_letters), 2)
+        self.assertEqual(json.loads(dead_letters[0])["service"], "x" * 101)
+        self.assertEqual(dead_letters[1], b"not json")
+
+    def test_calls_requeued_when_database_unavailable(self):
+        for _ in range(3):
+            self._enqueue()
+        queued = self.r.lrange(API_CALL_QUEUE_KEY, 0, -1)
+
+        with patch(
+            "dashboard.api_call_log.APICall.objects.bulk_create",
+            side_effect=OperationalError
+        ):
+            with self.assertRaises(OperationalError):
+                flush_api_calls(batch_size=2)
+
+        self.assertEqual(self.r.lrange(API_CALL_QUEUE_KEY, 0, -1), queued)
+        self.assertEqual(self.r.llen(API_CALL_DEAD_LETTER_KEY), 0)
+        self.assertEqual(flush_api_calls(), 3)
+
+
 class DashboardTestCase(TestCase):
 
     TEST_USER = dict(
@@ -459,7 +553,7 @@ class VerifyOwnershipTestCase(TestCase):
         return MockResponse(kwargs['json'], 200)
 
     @patch(
-        "requests.post",
+        "requests.Session.request",
         side_effect=mocked_request_correct_challenge_behaviour
     )
     def test_verify_ownership_success(self, mock):
@@ -468,7 +562,7 @@ class VerifyOwnershipTestCase(TestCase):
         )
 
     @patch(
-        "requests.post",
+        "requests.Session.request",
         side_effect=mocked_request_incorrect_challenge_behaviour
     )
     def test_verify_ownership_failure(self, mock):
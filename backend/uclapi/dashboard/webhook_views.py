@@ -1,4 +1,5 @@
 from common.helpers import PrettyJsonResponse
+from common.http_client import http_client
 from .models import App, User
 import requests
 from .app_helpers import NOT_HTTPS, NOT_VALID, URL_BLACKLISTED, generate_secret, is_url_unsafe
@@ -22,7 +23,7 @@ def verify_ownership(webhook_url, ownership_challenge, verification_secret):
     }
 
     try:
-        req = requests.post(webhook_url, json=payload, timeout=3)
+        req = http_client("webhooks").post(webhook_url, json=payload)
         resp = req.json()
     except (ValueError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
         return False
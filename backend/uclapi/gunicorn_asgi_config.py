@@ -0,0 +1,17 @@
+import multiprocessing
+
+# Used in place of gunicorn_config.py to serve uclapi.asgi:application
+
+bind = "127.0.0.1:9000"
+
+# The recommended number of workers is 2 * cores + 1
+workers = multiprocessing.cpu_count() * 2 + 1
+
+worker_class = "uvicorn.workers.UvicornWorker"
+
+daemon = False
+
+proc_name = "uclapi_gunicorn"
+
+timeout = 600
+graceful_timeout = 600
@@ -5,6 +5,8 @@ bind = "127.0.0.1:9000"
 # The recommended number of workers is 2 * cores + 1
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# uclapi/wsgi.py makes the database and Redis drivers cooperate with
+# eventlet, so each worker can carry on with other requests while one waits
 worker_class = "eventlet"
 
 daemon = False
@@ -7,28 +7,26 @@ import requests
 import json
 import redis
 
-from uclapi.settings import REDIS_UCLAPI_HOST
+from common.http_client import http_client
+from common.redis_client import get_redis
 
 
 @shared_task
 def refresh_libcal_token():
     if "HEALTHCHECK_LIBCAL" in os.environ:
         try:
-            requests.get(os.environ.get("HEALTHCHECK_LIBCAL") + "/start", timeout=5)
+            http_client("healthchecks").get(os.environ.get("HEALTHCHECK_LIBCAL") + "/start")
         except requests.exceptions.RequestException:
             pass
 
-    r: redis.Redis = redis.Redis(host=REDIS_UCLAPI_HOST,
-                                 charset="utf-8",
-                                 decode_responses=True)
+    r: redis.Redis = get_redis(decode_responses=True)
     url: str = os.environ["LIBCAL_BASE_URL"] + "/1.1/oauth/token"
     body: Dict[str, str] = {
         "client_id": os.environ["LIBCAL_CLIENT_ID"],
         "client_secret": os.environ["LIBCAL_CLIENT_SECRET"],
         "grant_type": "client_credentials"
     }
-    response: requests.Response = requests.post(url=url,
-                                                data=body)
+    response: requests.Response = http_client("libcal").post(url, data=body)
     if response.status_code != 200:
         raise Ignore()
 
@@ -38,6 +36,6 @@ def refresh_libcal_token():
 
     if "HEALTHCHECK_LIBCAL" in os.environ:
         try:
-            requests.get(os.environ.get("HEALTHCHECK_LIBCAL"), timeout=5)
+            http_client("healthchecks").get(os.environ.get("HEALTHCHECK_LIBCAL"))
         except requests.exceptions.RequestException:
             pass
@@ -3,16 +3,21 @@ import os
 from unittest import mock
 from urllib import parse
 
+import httpx
 import redis
 import requests_mock
+from asgiref.sync import async_to_sync
 from celery.exceptions import Ignore
+from django.test import RequestFactory
 from parameterized import parameterized
 from rest_framework.test import APISimpleTestCase, APITestCase, APIClient
 
 from dashboard.models import App, User
 from oauth.models import OAuthScope, OAuthToken
 from oauth.scoping import Scopes
+from common.http_client import AsyncHttpClient
 from uclapi.settings import REDIS_UCLAPI_HOST
+from . import views
 from .tasks import refresh_libcal_token
 from .utils import underscore
 
@@ -103,7 +108,9 @@ class LibCalRequestForwarderTestCase(APITestCase):
             decode_responses=True
         )
         cls.client: APIClient = APIClient()
-        cls.user_ = User.objects.create(cn="test", employee_id=7357, dev_quota=9999999)
+        cls.user_ = User.objects.create(
+            cn="test", employee_id=7357, dev_quota=9999999, burst_limit_per_second=0, burst_limit_per_minute=0
+        )
         cls.app = App.objects.create(user=cls.user_, name="An App")
         cls.token: str = "random-token"
         cls.headers: dict = {
@@ -176,7 +183,9 @@ class LibcalNonPersonalEndpointsTestCase(APITestCase):
         # We prefer client to factory as we want to test if
         # the regex is correct as well.
         cls.client: APIClient = APIClient()
-        cls.user_ = User.objects.create(cn="test", employee_id=7357, dev_quota=9999999)
+        cls.user_ = User.objects.create(
+            cn="test", employee_id=7357, dev_quota=9999999, burst_limit_per_second=0, burst_limit_per_minute=0
+        )
         cls.app = App.objects.create(user=cls.user_, name="An App")
         cls.token: str = "random-token"
         cls.headers: dict = {
@@ -493,6 +502,75 @@ class LibcalNonPersonalEndpointsTestCase(APITestCase):
             self.assertEqual(response.status_code, 400)
 
 
+@mock.patch.dict(os.environ, {"LIBCAL_BASE_URL": "https://library-calendars.ucl.ac.uk"})
+class LibcalAsyncEndpointsTestCase(APITestCase):
+    """Tests for the async versions of the LibCal endpoints, which are served under ASGI."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.factory = RequestFactory()
+        cls.user_ = User.objects.create(
+            cn="test", employee_id=7357, dev_quota=9999999, burst_limit_per_second=0, burst_limit_per_minute=0
+        )
+        cls.app = App.objects.create(user=cls.user_, name="An App")
+        cls.token: str = "random-token"
+        cls.r: redis.Redis = redis.Redis(
+            host=REDIS_UCLAPI_HOST,
+            charset="utf-8",
+            decode_responses=True
+        )
+        cls.r.set("libcal:token", cls.token)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.r.delete("libcal:token")
+        super().tearDownClass()
+
+    def setUp(self):
+        self.requests = []
+        client = AsyncHttpClient("libcal", retries=0)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(self._libcal))
+        patcher = mock.patch.object(views, "async_http_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _libcal(self, request):
+        self.requests.append(request)
+        if request.url.path == "/1.1/space/bookings":
+            return httpx.Response(200, json=[{'email': 'delete_me', 'seat_name': 'leave_me'}])
+        return httpx.Response(200, json=[{'lid': 1, 'publicName': 'Main Library'}])
+
+    def _get(self, view, params):
+        return async_to_sync(view)(self.factory.get('/libcal/space/', params))
+
+    def test_request_forwarded(self):
+        response = self._get(views.async_get_locations, {'details': 1, 'token': self.app.api_token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content.decode()),
+            {"ok": True, "locations": [{'lid': 1, 'public_name': 'Main Library'}]}
+        )
+
+        libcal_request = self.requests[0]
+        self.assertEqual(str(libcal_request.url), "https://library-calendars.ucl.ac.uk/1.1/space/locations?details=1")
+        self.assertEqual(libcal_request.headers["Authorization"], f"Bearer {self.token}")
+
+    def test_bookings_personal_information_stripped(self):
+        response = self._get(views.async_get_bookings, {'eid': 123, 'token': self.app.api_token})
+        self.assertEqual(json.loads(response.content.decode())["bookings"], [{'seat_name': 'leave_me'}])
+
+    def test_invalid_requests(self):
+        # No UCL API token
+        self.assertEqual(self._get(views.async_get_zone, {'ids': 1}).status_code, 400)
+        # Invalid query parameters
+        self.assertEqual(self._get(views.async_get_zone, {'ids': 'a', 'token': self.app.api_token}).status_code, 400)
+        # Only GET is allowed
+        response = async_to_sync(views.async_get_zone)(self.factory.post('/libcal/space/zone'))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(self.requests, [])
+
+
 @requests_mock.Mocker()
 @mock.patch.dict(os.environ, {"LIBCAL_BASE_URL": "https://library-calendars.ucl.ac.uk"})
 class LibcalPersonalEndpointsTestCase(APITestCase):
@@ -1,22 +1,44 @@
 from django.urls import path
 
+from uclapi.settings import ASYNC_PROXY_VIEWS
+
 from . import views
 
 urlpatterns = [
-    path('space/locations', views.get_locations),
-    path('space/form', views.get_form),
-    path('space/question', views.get_question),
-    path('space/categories', views.get_categories),
-    path('space/category', views.get_category),
-    path('space/item', views.get_item),
-    path('space/nickname', views.get_nickname),
-    path('space/utilization', views.get_utilization),
-    path('space/seat', views.get_seat),
-    path('space/seats', views.get_seats),
-    path('space/zone', views.get_zone),
-    path('space/zones', views.get_zones),
-    path('space/bookings', views.get_bookings),
     path('space/personal_bookings', views.get_personal_bookings),
     path('space/reserve', views.reserve),
     path('space/cancel', views.cancel)
 ]
+
+if ASYNC_PROXY_VIEWS:
+    urlpatterns += [
+        path('space/locations', views.async_get_locations),
+        path('space/form', views.async_get_form),
+        path('space/question', views.async_get_question),
+        path('space/categories', views.async_get_categories),
+        path('space/category', views.async_get_category),
+        path('space/item', views.async_get_item),
+        path('space/nickname', views.async_get_nickname),
+        path('space/utilization', views.async_get_utilization),
+        path('space/seat', views.async_get_seat),
+        path('space/seats', views.async_get_seats),
+        path('space/zone', views.async_get_zone),
+        path('space/zones', views.async_get_zones),
+        path('space/bookings', views.async_get_bookings)
+    ]
+else:
+    urlpatterns += [
+        path('space/locations', views.get_locations),
+        path('space/form', views.get_form),
+        path('space/question', views.get_question),
+        path('space/categories', views.get_categories),
+        path('space/category', views.get_category),
+        path('space/item', views.get_item),
+        path('space/nickname', views.get_nickname),
+        path('space/utilization', views.get_utilization),
+        path('space/seat', views.get_seat),
+        path('space/seats', views.get_seats),
+        path('space/zone', views.get_zone),
+        path('space/zones', views.get_zones),
+        path('space/bookings', views.get_bookings)
+    ]
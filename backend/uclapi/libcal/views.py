@@ -4,6 +4,7 @@ from typing import Optional
 
 import redis
 
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
@@ -11,9 +12,10 @@ from rest_framework.request import Request
 from rest_framework.serializers import Serializer
 import requests
 
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
 from common.helpers import PrettyJsonResponse as JsonResponse
-from uclapi.settings import REDIS_UCLAPI_HOST
+from common.http_client import async_http_client, http_client
+from common.redis_client import get_redis
 
 from .serializers import (
     LibCalLocationGETSerializer,
@@ -34,40 +36,27 @@ from .serializers import (
 from .utils import cameliser, underscorer, whitelist_fields
 
 
-def _libcal_request_forwarder(
-    url: str, request: Request, serializer: Serializer, key: str, method: str = 'GET', **kwargs
-) -> JsonResponse:
-    """
-    Forwards a request to LibCal for a given URL.
+def _token_error(**kwargs) -> JsonResponse:
+    uclapi_response = JsonResponse({
+        "ok": False,
+        "error": "Unable to refresh LibCal OAuth token"
+    }, custom_header_data=kwargs)
+    uclapi_response.status_code = 500
+    return uclapi_response
 
-    This method implements all the boiler plate needed to proxy a request from
-    the client to LibCal and present the response in UCL API style.
 
-    :param url: The URL path to send a request to (e.g. /space/locations)
-    :param request: The client's request
-    :param method: Method to use for the request.
-    :param key: The key that holds the LibCal JSON response (if the response is HTTP 200).
-    :return: A JSON Response.
+def _libcal_request(
+    url: str, request, serializer: Serializer, method: str, libcal_token: Optional[str], **kwargs
+):
+    """
+    Validates a request to forward to LibCal.
 
+    :return: Either a response to send to the client instead, or the method, URL and arguments to send the request to
+    LibCal with.
     """
-    r: redis.Redis = redis.Redis(
-        host=REDIS_UCLAPI_HOST,
-        charset="utf-8",
-        decode_responses=True
-    )
-    # Get OAuth token needed to proxy request
-    token: Optional[str] = r.get("libcal:token")
-    if not token:
-        uclapi_response = JsonResponse({
-            "ok": False,
-            "error": "Unable to refresh LibCal OAuth token"
-        }, custom_header_data=kwargs)
-        uclapi_response.status_code = 500
-        return uclapi_response
+    if not libcal_token:
+        return _token_error(**kwargs)
 
-    headers: dict = {
-        "Authorization": f"Bearer {token}"
-    }
     if not serializer.is_valid():
         uclapi_response = JsonResponse({
             "ok": False,
@@ -80,20 +69,33 @@ def _libcal_request_forwarder(
     # NOTE: A serializer may set the "ids" field. This field, if set, is appended to the URL instead of sent as a GET
     # parameter.
     ids = str(serializer.validated_data.pop("ids", ""))
+    request_kwargs: dict = {
+        "headers": {
+            "Authorization": f"Bearer {libcal_token}"
+        }
+    }
     if method == 'GET':
-        libcal_response: requests.Response = requests.get(
-            url=f'{os.environ["LIBCAL_BASE_URL"]}{url}{"/" + ids if ids else ""}',
-            headers=headers,
-            params=serializer.validated_data
-        )
+        # Formatted as requests would, since the async client does not format dates
+        request_kwargs["params"] = {
+            name: str(value) for name, value in serializer.validated_data.items() if value is not None
+        }
     else:  # Assume request.method == 'POST'
-        libcal_response: requests.Response = requests.post(
-            url=f'{os.environ["LIBCAL_BASE_URL"]}{url}{"/" + ids if ids else ""}',
-            headers=headers,
-            # /1.1/space/reserve expects JSON payload
-            data=JSONRenderer().render(serializer.validated_data)
-        )
+        # /1.1/space/reserve expects JSON payload
+        request_kwargs["data"] = JSONRenderer().render(serializer.validated_data)
+    return method, f'{os.environ["LIBCAL_BASE_URL"]}{url}{"/" + ids if ids else ""}', request_kwargs
+
+
+def _libcal_unavailable(**kwargs) -> JsonResponse:
+    uclapi_response = JsonResponse({
+        "ok": False,
+        "error": "Unable to reach LibCal"
+    }, custom_header_data=kwargs)
+    uclapi_response.status_code = 503
+    return uclapi_response
+
 
+def _libcal_response(libcal_response, key: str, **kwargs) -> JsonResponse:
+    """Presents a response from LibCal in UCL API style."""
     if libcal_response.status_code == 200:
         uclapi_response = JsonResponse({
             "ok": True,
@@ -105,12 +107,7 @@ def _libcal_request_forwarder(
         # For some reason our OAuth token isn't accepted by LibCal...
         # The fact that we're unauthorised is "our" issue so don't confuse the
         # client with this information and instead send back a 500.
-        uclapi_response = JsonResponse({
-            "ok": False,
-            "error": "Unable to refresh LibCal OAuth token"
-        }, custom_header_data=kwargs)
-        uclapi_response.status_code = 500
-        return uclapi_response
+        return _token_error(**kwargs)
     else:
         try:
             data = libcal_response.json()
@@ -129,6 +126,59 @@ def _libcal_request_forwarder(
         return uclapi_response
 
 
+def _libcal_request_forwarder(
+    url: str, request: Request, serializer: Serializer, key: str, method: str = 'GET', **kwargs
+) -> JsonResponse:
+    """
+    Forwards a request to LibCal for a given URL.
+
+    This method implements all the boiler plate needed to proxy a request from
+    the client to LibCal and present the response in UCL API style.
+
+    :param url: The URL path to send a request to (e.g. /space/locations)
+    :param request: The client's request
+    :param method: Method to use for the request.
+    :param key: The key that holds the LibCal JSON response (if the response is HTTP 200).
+    :return: A JSON Response.
+
+    """
+    r: redis.Redis = get_redis(decode_responses=True)
+    # Get OAuth token needed to proxy request
+    libcal_token: Optional[str] = r.get("libcal:token")
+    libcal_request = _libcal_request(url, request, serializer, method, libcal_token, **kwargs)
+    if isinstance(libcal_request, JsonResponse):
+        return libcal_request
+
+    method, libcal_url, request_kwargs = libcal_request
+    try:
+        libcal_response: requests.Response = http_client("libcal").request(method, libcal_url, **request_kwargs)
+    except requests.exceptions.RequestException:
+        return _libcal_unavailable(**kwargs)
+    return _libcal_response(libcal_response, key, **kwargs)
+
+
+async def _async_libcal_request_forwarder(
+    url: str, request, serializer: Serializer, key: str, **kwargs
+) -> JsonResponse:
+    """
+    As _libcal_request_forwarder, for async views. Only GET requests are forwarded, as the views that make changes
+    need the user's details from the database.
+    """
+    r: redis.Redis = get_redis(decode_responses=True)
+    # Redis is only used synchronously, so is read in a thread that the event loop does not wait on
+    libcal_token: Optional[str] = await sync_to_async(r.get, thread_sensitive=False)("libcal:token")
+    libcal_request = _libcal_request(url, request, serializer, 'GET', libcal_token, **kwargs)
+    if isinstance(libcal_request, JsonResponse):
+        return libcal_request
+
+    method, libcal_url, request_kwargs = libcal_request
+    try:
+        libcal_response = await async_http_client("libcal").request(method, libcal_url, **request_kwargs)
+    except requests.exceptions.RequestException:
+        return _libcal_unavailable(**kwargs)
+    return _libcal_response(libcal_response, key, **kwargs)
+
+
 @api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key=None)
 def get_locations(request, *args, **kwargs):
@@ -302,6 +352,11 @@ def get_bookings(request, *args, **kwargs):
         data=cameliser(request.query_params))
     booking_response = _libcal_request_forwarder(
         "/1.1/space/bookings", request, serializer, 'data', **kwargs)
+    return _public_bookings(booking_response, **kwargs)
+
+
+def _public_bookings(booking_response: JsonResponse, **kwargs) -> JsonResponse:
+    """Removes the personal details from the bookings LibCal returned."""
     data = json.loads(booking_response.content.decode('utf-8'))
     if "data" in data:
         data["bookings"] = data.pop("data")
@@ -407,3 +462,43 @@ def cancel(request, *args, **kwargs):
         'POST',
         **kwargs
     )
+
+
+# The views that only read from LibCal have async versions for the ASGI deployment, so that a worker can wait on
+# many requests to LibCal at once. Those that make changes or need the user's details stay synchronous.
+def _async_libcal_view(url: str, serializer_class, key: str, special: bool = True):
+    @simple_api_view(["GET"])
+    @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key=None)
+    async def view(request, *args, **kwargs):
+        return await _async_libcal_request_forwarder(
+            url,
+            request,
+            serializer_class(data=cameliser(request.GET, special=special)),
+            key,
+            **kwargs
+        )
+    return view
+
+
+async_get_locations = _async_libcal_view("/1.1/space/locations", LibCalLocationGETSerializer, 'locations')
+async_get_form = _async_libcal_view("/1.1/space/form", LibCalIdListSerializer, 'forms')
+async_get_question = _async_libcal_view("/1.1/space/question", LibCalIdListSerializer, 'questions')
+async_get_categories = _async_libcal_view("/1.1/space/categories", LibCalIdListSerializer, 'categories')
+async_get_category = _async_libcal_view("/1.1/space/category", LibCalCategoryGETSerializer, 'categories')
+async_get_item = _async_libcal_view("/1.1/space/item", LibCalItemGETSerializer, 'items')
+async_get_nickname = _async_libcal_view("/1.1/space/nickname", LibCalNicknameGETSerializer, 'nicknames')
+async_get_utilization = _async_libcal_view("/api/1.1/space/utilization", LibCalUtilizationGETSerializer, 'data')
+async_get_seat = _async_libcal_view("/api/1.1/space/seat", LibCalSeatGETSerializer, 'seat')
+async_get_seats = _async_libcal_view("/api/1.1/space/seats", LibCalSeatsGETSerializer, 'seats', special=False)
+async_get_zone = _async_libcal_view("/api/1.1/space/zone", LibCalIdSerializer, 'zone')
+async_get_zones = _async_libcal_view("/api/1.1/space/zones", LibCalIdSerializer, 'zones')
+
+
+@simple_api_view(["GET"])
+@uclapi_protected_endpoint(personal_data=False, last_modified_redis_key=None)
+async def async_get_bookings(request, *args, **kwargs):
+    """As get_bookings, for the ASGI deployment."""
+    serializer = LibCalBookingsGETSerializer(data=cameliser(request.GET))
+    booking_response = await _async_libcal_request_forwarder(
+        "/1.1/space/bookings", request, serializer, 'data', **kwargs)
+    return _public_bookings(booking_response, **kwargs)
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.13 on 2026-10-17 07:44
+
+from django.db import migrations, models
+import oauth.app_helpers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth', '0003_oauthtoken_creation_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauthtoken',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='oauthtoken',
+            name='token',
+            field=models.CharField(default=oauth.app_helpers.generate_user_token, max_length=200, unique=True),
+        ),
+    ]
@@ -1,4 +1,15 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common.signed_tokens import (
+    is_signed_token,
+    make_oauth_token,
+    oauth_revocation,
+    revoke_tokens
+)
+from common.token_cache import invalidate_tokens
+from uclapi.settings import ISSUE_SIGNED_TOKENS
 
 from .app_helpers import generate_user_token
 
@@ -30,11 +41,15 @@ class OAuthToken(models.Model):
 
     # The actual token that can be used by an app to act on behalf of the user
     token = models.CharField(
-        max_length=75,
+        max_length=200,
         unique=True,
         default=generate_user_token
     )
 
+    # Signed tokens carry their scope and cannot be changed, so they are
+    # reissued with a new version whenever the scope or active state changes
+    version = models.IntegerField(default=0)
+
     # The scope that the key works within. Every key has a unique scope
     # (in case the developer requests more permissions later)
     scope = models.OneToOneField(
@@ -46,3 +61,48 @@ class OAuthToken(models.Model):
     active = models.BooleanField(default=True)
 
     creation_date = models.DateTimeField(auto_now_add=True)
+
+    def reissue(self):
+        """
+        Replaces a signed token after its scope or active state has changed,
+        revoking the old one. Opaque tokens are left as they are unless
+        signed tokens are being issued.
+        """
+        if is_signed_token(self.token):
+            revoke_tokens(oauth_revocation(self.id, self.version))
+            self.version += 1
+        elif not ISSUE_SIGNED_TOKENS:
+            return
+
+        if ISSUE_SIGNED_TOKENS:
+            self.token = make_oauth_token(self)
+        else:
+            self.token = generate_user_token()
+        self.save()
+
+
+# Evict cached tokens when a user revokes access, an app is deauthorised or a
+# token's scope changes.
+@receiver([post_save, post_delete], sender=OAuthToken)
+def invalidate_cached_oauth_token(sender, instance, **kwargs):
+    invalidate_tokens(
+        "token:" + instance.token,
+        "oauth:{}".format(instance.id)
+    )
+
+
+@receiver(post_save, sender=OAuthToken)
+def revoke_inactive_oauth_token(sender, instance, **kwargs):
+    if not instance.active and is_signed_token(instance.token):
+        revoke_tokens(oauth_revocation(instance.id, instance.version))
+
+
+@receiver(post_delete, sender=OAuthToken)
+def revoke_removed_oauth_token(sender, instance, **kwargs):
+    if is_signed_token(instance.token):
+        revoke_tokens(oauth_revocation(instance.id, instance.version))
+
+
+@receiver([post_save, post_delete], sender=OAuthScope)
+def invalidate_cached_scope_tokens(sender, instance, **kwargs):
+    invalidate_tokens("scope:{}".format(instance.id))
@@ -1,7 +1,6 @@
 import json
 import os
 
-import redis
 from django.core import signing
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.signing import TimestampSigner
@@ -23,9 +22,9 @@ from .app_helpers import (
 from .models import OAuthToken
 from .scoping import Scopes
 
-from uclapi.settings import REDIS_UCLAPI_HOST
 from common.decorators import uclapi_protected_endpoint, get_var
 from common.helpers import PrettyJsonResponse
+from common.redis_client import get_redis
 
 
 # The endpoint that creates a Shibboleth login and redirects the user to it
@@ -187,7 +186,7 @@ def shibcallback(request):
     if token.scope.scopeIsEqual(app.scope) and token.active:
         code = generate_random_verification_code()
 
-        r = redis.Redis(host=REDIS_UCLAPI_HOST)
+        r = get_redis()
 
         verification_data = {
             "client_id": app.client_id,
@@ -323,7 +322,7 @@ def userallow(request):
 
     code = generate_random_verification_code()
 
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
+    r = get_redis()
 
     verification_data = {
         "client_id": app.client_id,
@@ -364,7 +363,7 @@ def token(request):
         response.status_code = 400
         return response
 
-    r = redis.Redis(host=REDIS_UCLAPI_HOST)
+    r = get_redis()
     try:
         data_json = r.get(code).decode('ascii')
 
@@ -440,12 +439,18 @@ def token(request):
             # Save the token with the new scope
             token.save()
 
+            # A signed token carries its scope, so it has to be replaced
+            token.reissue()
+
         # If the user has denied this app access before and invalidated a token
         # then let's re-enabled that token because access is permitted again.
         if token.active is False:
             token.active = True
             token.save()
 
+            # A signed token was revoked when it was deactivated
+            token.reissue()
+
     except OAuthToken.DoesNotExist:
         # The user has never logged in before so let's clone the scope and
         # create a brand new OAuth token
@@ -463,6 +468,9 @@ def token(request):
         )
         token.save()
 
+        # Signed tokens include the token's ID, so can only be issued now
+        token.reissue()
+
     # Now that we have a token we can pass one back to the app
     # We sincerely hope they'll save this token!
     # The app can use the token to pull in any personal data (name, UPI, etc.)
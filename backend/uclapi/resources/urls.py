@@ -1,7 +1,13 @@
 from django.conf.urls import url
 
+from uclapi.settings import ASYNC_PROXY_VIEWS
+
 from . import views
 
 urlpatterns = [
-    url(r'^desktops$', views.get_pc_availability),
+    url(
+        r'^desktops$',
+        views.async_get_pc_availability if ASYNC_PROXY_VIEWS
+        else views.get_pc_availability
+    ),
 ]
@@ -3,38 +3,40 @@ import requests
 
 from lxml import etree
 
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
 from common.helpers import PrettyJsonResponse as JsonResponse
+from common.http_client import async_http_client, http_client
 
-from rest_framework.decorators import api_view
 
+def _availability_error(error, status_code, **kwargs):
+    resp = JsonResponse({
+        "ok": False,
+        "error": error
+    }, custom_header_data=kwargs)
+    resp.status_code = status_code
+    return resp
 
-@api_view(['GET'])
-@uclapi_protected_endpoint(
-    last_modified_redis_key=None
-)
-def get_pc_availability(request, *args, **kwargs):
-    try:
-        r = requests.get(os.environ["PCA_LINK"])
-    except requests.exceptions.MissingSchema:
-        resp = JsonResponse({
-            "ok": False,
-            "error": ("Could not retrieve availability data."
-                      " Please try again later or contact us for support.")
-        }, custom_header_data=kwargs)
-        resp.status_code = 400
-        return resp
 
+def _unavailable(exception, **kwargs):
+    return _availability_error(
+        "Could not retrieve availability data."
+        " Please try again later or contact us for support.",
+        400 if isinstance(exception, requests.exceptions.MissingSchema)
+        else 503,
+        **kwargs
+    )
+
+
+def _pc_availability_response(content, **kwargs):
     try:
-        e = etree.fromstring(r.content)
+        e = etree.fromstring(content)
     except (ValueError, etree.XMLSyntaxError):
-        resp = JsonResponse({
-            "ok": False,
-            "error": ("Could not parse the desktop availability data."
-                      " Please try again later or contact us for support.")
-        }, custom_header_data=kwargs)
-        resp.status_code = 400
-        return resp
+        return _availability_error(
+            "Could not parse the desktop availability data."
+            " Please try again later or contact us for support.",
+            400,
+            **kwargs
+        )
 
     data = []
     for pc in e.findall("room"):
@@ -58,3 +60,32 @@ def get_pc_availability(request, *args, **kwargs):
         "ok": True,
         "data": data
     }, custom_header_data=kwargs)
+
+
+@simple_api_view(['GET'])
+@uclapi_protected_endpoint(
+    last_modified_redis_key=None
+)
+def get_pc_availability(request, *args, **kwargs):
+    try:
+        r = http_client("pc_availability").get(os.environ["PCA_LINK"])
+    except requests.exceptions.RequestException as e:
+        return _unavailable(e, **kwargs)
+
+    return _pc_availability_response(r.content, **kwargs)
+
+
+@simple_api_view(['GET'])
+@uclapi_protected_endpoint(
+    last_modified_redis_key=None
+)
+async def async_get_pc_availability(request, *args, **kwargs):
+    """As get_pc_availability, for the ASGI deployment."""
+    try:
+        r = await async_http_client("pc_availability").get(
+            os.environ["PCA_LINK"]
+        )
+    except requests.exceptions.RequestException as e:
+        return _unavailable(e, **kwargs)
+
+    return _pc_availability_response(r.content, **kwargs)
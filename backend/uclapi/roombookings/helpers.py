@@ -3,24 +3,43 @@ from __future__ import unicode_literals
 import datetime
 import json
 from datetime import timedelta
+from urllib.parse import urlencode
 
 import ciso8601
 import pytz
-import redis
 
-from django.conf import settings
 from django.core.exceptions import FieldError
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from django.db.models import Q, QuerySet
 
 from .api_helpers import generate_token
 from .models import BookingA, BookingB, Location, SiteLocation
+from common.fields import is_selected, select_fields
 from common.helpers import PrettyJsonResponse
+from common.redis_client import get_redis
+from common.renderers import rows_response
 from timetable.models import Lock
 
 
 TOKEN_EXPIRY_TIME = 30 * 60
 
+# Rows streamed from the database are fetched this many at a time
+ITERATOR_CHUNK_SIZE = 2000
+
+# The fields of a serialised booking, in the order they are sent as CSV
+BOOKING_FIELDS = [
+    "roomname",
+    "siteid",
+    "roomid",
+    "description",
+    "start_time",
+    "end_time",
+    "contact",
+    "slotid",
+    "weeknumber",
+    "phone"
+]
+
 ROOM_TYPE_MAP = {
     "AN": "Anechoic Chamber",
     "CI": "Clinic Room",
@@ -45,8 +64,18 @@ ROOM_TYPE_MAP = {
 }
 
 
+def _iterate(rows):
+    """
+    Iterates over a queryset in chunks rather than loading every row into
+    memory at once.
+    """
+    if isinstance(rows, QuerySet):
+        return rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    return iter(rows)
+
+
 def _create_page_token(query, pagination):
-    r = redis.Redis(host=settings.REDIS_UCLAPI_HOST)
+    r = get_redis()
     page_data = {
         "current_page": 0,
         "pagination": pagination,
@@ -57,8 +86,8 @@ def _create_page_token(query, pagination):
     return page_token
 
 
-def _get_paginated_bookings(page_token):
-    r = redis.Redis(host=settings.REDIS_UCLAPI_HOST)
+def _get_paginated_bookings(page_token, fields=None):
+    r = get_redis()
     try:
         page_data = json.loads(r.get(page_token).decode('ascii'))
     except (AttributeError, json.decoder.JSONDecodeError):
@@ -74,7 +103,8 @@ def _get_paginated_bookings(page_token):
     bookings, is_last_page = _paginated_result(
         query,
         page_data["current_page"],
-        pagination
+        pagination,
+        fields
     )
 
     # if there is a next page
@@ -87,7 +117,7 @@ def _get_paginated_bookings(page_token):
     return bookings
 
 
-def _paginated_result(query, page_number, pagination):
+def _paginated_result(query, page_number, pagination, fields=None):
     try:
         lock = Lock.objects.all()[0]
         curr = BookingA if lock.a else BookingB
@@ -103,16 +133,17 @@ def _paginated_result(query, page_number, pagination):
     paginator = Paginator(all_bookings, pagination)
 
     try:
-        bookings = paginator.page(page_number)
+        bookings = paginator.page(page_number).object_list
     except PageNotAnInteger:
         # give first page
-        bookings = paginator.page(1)
+        bookings = paginator.page(1).object_list
     except EmptyPage:
         # return empty page
         # bookings = paginator.page(paginator.num_pages)
         bookings = []
 
-    serialized_bookings = _serialize_bookings(bookings)
+    # The bookings are only serialised as the response is sent
+    serialized_bookings = _iter_serialized_bookings(_iterate(bookings), fields)
 
     return (
         {"bookings": serialized_bookings},
@@ -174,65 +205,73 @@ def _parse_datetime(start_time, end_time, search_date):
     return parsed_start_time, parsed_end_time, True
 
 
-def _serialize_rooms(room_set):
-    rooms = []
-    for room in room_set:
-        # Maps room classification to a textual version
-        # e.g. LT => Lecture Theatre
-        classification_name = ROOM_TYPE_MAP.get(
-            room.roomclass,
-            "Unknown Room Type"
-        )
-        room_to_add = {
-            "roomname": room.roomname,
-            "roomid": room.roomid,
-            "siteid": room.siteid,
-            "sitename": room.sitename,
-            "capacity": room.capacity,
-            "classification": room.roomclass,
-            "classification_name": classification_name,
-            "automated": room.automated,
-            "location": {
-                "address": [
-                    room.address1,
-                    room.address2,
-                    room.address3,
-                    room.address4
-                ]
-            }
+def _serialize_rooms(room_set, fields=None):
+    return [_serialize_room(room, fields) for room in room_set]
+
+
+def _serialize_room(room, fields=None):
+    # Maps room classification to a textual version
+    # e.g. LT => Lecture Theatre
+    classification_name = ROOM_TYPE_MAP.get(
+        room.roomclass,
+        "Unknown Room Type"
+    )
+    room_to_add = {
+        "roomname": room.roomname,
+        "roomid": room.roomid,
+        "siteid": room.siteid,
+        "sitename": room.sitename,
+        "capacity": room.capacity,
+        "classification": room.roomclass,
+        "classification_name": classification_name,
+        "automated": room.automated,
+        "location": {
+            "address": [
+                room.address1,
+                room.address2,
+                room.address3,
+                room.address4
+            ]
         }
+    }
+
+    if not is_selected(fields, "location.coordinates"):
+        # Save looking up the coordinates if they will not be sent
+        return select_fields(room_to_add, fields)
 
+    try:
+        location = Location.objects.get(
+            siteid=room.siteid,
+            roomid=room.roomid
+        )
+        room_to_add['location']['coordinates'] = {
+            "lat": location.lat,
+            "lng": location.lng
+        }
+    except Location.DoesNotExist:
+        # no location for this room, try building
         try:
-            location = Location.objects.get(
-                siteid=room.siteid,
-                roomid=room.roomid
+            location = SiteLocation.objects.get(
+                siteid=room.siteid
             )
             room_to_add['location']['coordinates'] = {
                 "lat": location.lat,
                 "lng": location.lng
             }
-        except Location.DoesNotExist:
-            # no location for this room, try building
-            try:
-                location = SiteLocation.objects.get(
-                    siteid=room.siteid
-                )
-                room_to_add['location']['coordinates'] = {
-                    "lat": location.lat,
-                    "lng": location.lng
-                }
-            except SiteLocation.DoesNotExist:
-                # no location for this room
-                pass
+        except SiteLocation.DoesNotExist:
+            # no location for this room
+            pass
+
+    return select_fields(room_to_add, fields)
+
 
-        rooms.append(room_to_add)
-    return rooms
+def _serialize_bookings(bookings, fields=None):
+    return list(_iter_serialized_bookings(bookings, fields))
 
 
-def _serialize_bookings(bookings):
-    ret_bookings = []
+def _iter_serialized_bookings(bookings, fields=None):
     for bk in bookings:
-        ret_bookings.append({
+        yield select_fields({
             "roomname": bk.roomname,
             "siteid": bk.siteid,
             "roomid": bk.roomid,
@@ -245,9 +284,7 @@ def _serialize_bookings(bookings):
             "slotid": bk.slotid,
             "weeknumber": bk.weeknumber,
             "phone": bk.phone
-        })
-
-    return ret_bookings
+        }, fields)
 
 
 def _serialize_equipment(equipment):
@@ -271,7 +308,11 @@ def _kloppify(date_string, date):
     return date_string + "+00:00"
 
 
-def _return_json_bookings(bookings, custom_header_data=None):
+def _return_bookings(request, bookings, fields=None, custom_header_data=None):
+    """
+    Returns a page of bookings with the selected fields in the format the
+    client accepted, or the error hit while fetching them as JSON.
+    """
     if "error" in bookings:
         return PrettyJsonResponse({
             "ok": False,
@@ -280,7 +321,26 @@ def _return_json_bookings(bookings, custom_header_data=None):
 
     bookings["ok"] = True
 
-    return PrettyJsonResponse(bookings, custom_header_data)
+    next_link = None
+    if bookings.get("page_token"):
+        next_query = {"page_token": bookings["page_token"]}
+        if request.GET.get("fields"):
+            next_query["fields"] = request.GET["fields"]
+        next_link = "{}?{}".format(
+            request.build_absolute_uri(request.path),
+            urlencode(next_query)
+        )
+
+    return rows_response(
+        getattr(request, "accepted_renderer", None),
+        bookings,
+        "bookings",
+        fields=[
+            field for field in BOOKING_FIELDS if is_selected(fields, field)
+        ],
+        next_link=next_link,
+        custom_header_data=custom_header_data
+    )
 
 
 def how_many_seconds_until_midnight():
@@ -293,59 +353,17 @@ def how_many_seconds_until_midnight():
     return (midnight - datetime.datetime.now()).seconds
 
 
-def _create_map_of_overlapping_bookings(bookings, start, end):
-    """
-    Creates map of room to bookings where each booking overlaps
-    with the given time range
-    """
-    bookings_map = {}
-
-    for booking in bookings:
-        booking_start = _localize_time(booking["start_time"])
-        booking_end = _localize_time(booking["end_time"])
-
-        if _overlaps(
-            start1=booking_start,
-            end1=booking_end,
-            start2=start,
-            end2=end
-        ):
-            roomid, siteid = booking["roomid"], booking["siteid"]
-            bookings_map[(roomid, siteid)] = bookings_map.get(
-                (roomid, siteid), []
-            ) + [booking]
-
-    return bookings_map
-
-
-def _overlaps(start1, end1, start2, end2):
-    """
-    takes 4 datetimes
-    checks if they overlap
-    """
-    return max(start1, start2) < min(end1, end2)
-
-
-def _filter_for_free_rooms(all_rooms, bookings, start, end):
+def _get_booked_rooms(query, start, end):
     """
-    Find all rooms which don't have any bookings.
-    Args:
-        all_rooms: All available rooms.
-        bookings: All the bookings made in the days of the given time period
-        start: Start time for free rooms
-        end: End time for free rooms
+    Returns the (roomid, siteid) of every room with a booking matching the
+    query that overlaps the time from start to end.
     """
-    rooms_with_bookings = list(all_rooms)
-    bookings_map = _create_map_of_overlapping_bookings(bookings, start, end)
-
-    free_rooms = []
-    for room in rooms_with_bookings:
-        roomid, siteid = room["roomid"], room["siteid"]
-        if (
-            (roomid, siteid) not in bookings_map or
-            not bookings_map[(roomid, siteid)]
-        ):
-            # if room doesn't have any overlapping bookings
-            free_rooms.append(room)
-
-    return free_rooms
+    lock = Lock.objects.all()[0]
+    curr = BookingA if lock.a else BookingB
+    bookings = curr.objects.filter(
+        Q(bookabletype='CB') | Q(siteid='238') | Q(siteid='240'),
+        startdatetime__lt=end,
+        finishdatetime__gt=start,
+        **query
+    ).values_list("roomid", "siteid").distinct()
+    return set(_iterate(bookings))
@@ -2,8 +2,8 @@ import logging
 
 from django.core.management.base import BaseCommand
 from datetime import datetime
-import requests
 import re
+from common.http_client import http_client
 from roombookings.models import Location, SiteLocation
 import json
 
@@ -100,7 +100,7 @@ class Command(BaseCommand):
             params = {
                 "id": site_id
             }
-            r = requests.get(estates_url, params=params)
+            r = http_client("estates").get(estates_url, params=params)
 
             searchObj = re.search(
                 r'.*"http:\/\/streetmap\.co\.uk\/loc\/(.*),(.*)".*',
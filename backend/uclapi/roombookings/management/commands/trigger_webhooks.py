@@ -7,6 +7,7 @@ from django.db.models import Q
 from django.utils import timezone
 from requests_futures.sessions import FuturesSession
 
+from common.http_client import http_client
 from dashboard.models import Webhook, WebhookTriggerHistory
 from roombookings.helpers import _serialize_bookings
 from roombookings.models import BookingA, BookingB
@@ -26,7 +27,10 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         logging.info("Triggering webhooks")
-        session = FuturesSession()
+        # The webhooks are sent concurrently, over the connections pooled by
+        # the shared client
+        client = http_client("webhooks")
+        session = FuturesSession(session=client.session)
 
         # currently not locked table is the old one, more recent one is locked
         lock = Lock.objects.all()[0]  # there is only ever one lock
@@ -101,7 +105,9 @@ class Command(BaseCommand):
 
             if payload["content"] != {} and webhook["url"] != "":
                 # not exactly sure what unsent_requests is meant to do except for debug logging
-                post_result = session.post(webhook["url"], json=payload, headers={"User-Agent": "uclapi-bot/1"})
+                post_result = session.post(
+                    webhook["url"], json=payload, headers={"User-Agent": "uclapi-bot/1"}, timeout=client.timeout
+                )
                 unsent_requests.append(post_result)
 
                 # instead, we'll put the whole response back into the webhook object
@@ -13,16 +13,19 @@ from rest_framework.test import APIRequestFactory
 from django.conf import settings
 from django_mock_queries.query import MockSet, MockModel
 
+from common.fields import parse_fields
+from common.rendering import pretty_json
 from dashboard.app_helpers import get_temp_token
 from dashboard.models import App, User, Webhook, WebhookTriggerHistory
 
 from .helpers import (
     _create_page_token,
-    _filter_for_free_rooms,
+    BOOKING_FIELDS,
     _localize_time,
     _parse_datetime,
     _round_date,
     _serialize_equipment,
+    _serialize_room,
     PrettyJsonResponse,
     TOKEN_EXPIRY_TIME
 )
@@ -150,8 +153,16 @@ class ParseDateTimeTestCase(SimpleTestCase):
 
 
 class PrettyPrintJsonTestCase(SimpleTestCase):
-    def test_pretty_print(self):
+    def test_compact_by_default(self):
         response = PrettyJsonResponse({"foo": "bar"})
+        self.assertEqual(response.content.decode(), '{"foo":"bar"}')
+
+    def test_pretty_print(self):
+        token = pretty_json.set(True)
+        try:
+            response = PrettyJsonResponse({"foo": "bar"})
+        finally:
+            pretty_json.reset(token)
         self.assertEqual(response.content.decode(), '{\n    "foo": "bar"\n}')
 
 
@@ -457,6 +468,120 @@ class DoesTokenExistTestCase(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    @booking_objects
+    @bookinga_objects
+    @bookingb_objects
+    @lock_objects
+    def test_bookings_streamed(self):
+        request = self.factory.get(
+            '/roombookings/bookings', {'token': self.app.api_token}
+        )
+        response = get_bookings(request)
+
+        self.assertTrue(response.streaming)
+        content = json.loads(b"".join(response.streaming_content).decode())
+        self.assertTrue(content["ok"])
+        self.assertEqual(len(content["bookings"]), content["count"])
+        self.assertIn(1662773, [b["slotid"] for b in content["bookings"]])
+
+    @bookinga_objects
+    @bookingb_objects
+    @lock_objects
+    def test_bookings_as_csv(self):
+        request = self.factory.get(
+            '/roombookings/bookings',
+            {'token': self.app.api_token, 'format': 'csv'}
+        )
+        response = get_bookings(request)
+
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(","), BOOKING_FIELDS)
+        self.assertTrue(any("1662773" in line for line in lines[1:]))
+
+    @bookinga_objects
+    @bookingb_objects
+    @lock_objects
+    def test_bookings_as_ndjson(self):
+        request = self.factory.get(
+            '/roombookings/bookings',
+            {'token': self.app.api_token},
+            HTTP_ACCEPT='application/x-ndjson'
+        )
+        response = get_bookings(request)
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [
+            json.loads(line) for line in
+            b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertIn(1662773, [row["slotid"] for row in rows])
+        self.assertEqual(list(rows[0]), BOOKING_FIELDS)
+
+    @bookinga_objects
+    @bookingb_objects
+    @lock_objects
+    def test_bookings_fields(self):
+        request = self.factory.get(
+            '/roombookings/bookings',
+            {
+                'token': self.app.api_token,
+                'format': 'csv',
+                'fields': 'slotid,start_time'
+            }
+        )
+        response = get_bookings(request)
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "start_time,slotid")
+        self.assertTrue(all(len(line.split(",")) == 2 for line in lines))
+
+
+class SerializeRoomTestCase(SimpleTestCase):
+    room = FakeModelClass(
+        roomname="Room 1",
+        roomid="101",
+        siteid="001",
+        sitename="Site",
+        capacity=20,
+        roomclass="LT",
+        automated="N",
+        address1="Gower Street",
+        address2="London",
+        address3="",
+        address4=""
+    )
+
+    @unittest.mock.patch('roombookings.helpers.Location.objects.get')
+    def test_all_fields(self, patched_get):
+        patched_get.return_value = FakeModelClass(lat="51.5", lng="-0.13")
+
+        room = _serialize_room(self.room)
+
+        self.assertEqual(room["classification_name"], "Lecture Theatre")
+        self.assertEqual(
+            room["location"]["coordinates"],
+            {"lat": "51.5", "lng": "-0.13"}
+        )
+
+    @unittest.mock.patch('roombookings.helpers.Location.objects.get')
+    def test_selected_fields(self, patched_get):
+        room = _serialize_room(
+            self.room,
+            parse_fields("roomid,siteid,location.address")
+        )
+
+        self.assertEqual(room, {
+            "roomid": "101",
+            "siteid": "001",
+            "location": {
+                "address": ["Gower Street", "London", "", ""]
+            }
+        })
+        # The coordinates were not selected, so are never looked up
+        patched_get.assert_not_called()
+
 
 class RoundDateTestCase(SimpleTestCase):
     def test_round_down(self):
@@ -472,23 +597,6 @@ class RoundDateTestCase(SimpleTestCase):
         self.assertEqual(round_down, date)
 
 
-class FilterFreeRoomsTestCase(SimpleTestCase):
-    def test_empty_rooms_and_bookings(self):
-        start = datetime.date(2017, 10, 25)
-        end = datetime.date(2017, 10, 26)
-        result = _filter_for_free_rooms([], [], start, end)
-        self.assertEqual(result, [])
-
-    def test_empty_bookings(self):
-        start = datetime.date(2017, 10, 25)
-        end = datetime.date(2017, 10, 26)
-        rooms = [
-            {"roomid": 1, "siteid": 1},
-        ]
-        result = _filter_for_free_rooms(rooms, [], start, end)
-        self.assertEqual(result, rooms)
-
-
 class CreateRedisPageTokenTest(TestCase):
     def test_create_page_token(self):
         query = {"test": "test_data"}
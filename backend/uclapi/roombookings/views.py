@@ -1,22 +1,31 @@
 from functools import reduce
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from django.conf import settings
 from django.db.models import Q
 
-from .helpers import (PrettyJsonResponse, _create_page_token,
-                      _get_paginated_bookings, _parse_datetime,
-                      _return_json_bookings, _serialize_equipment,
-                      _serialize_rooms, _filter_for_free_rooms, _round_date)
+from .helpers import (PrettyJsonResponse,
+                      _create_page_token, _get_booked_rooms,
+                      _get_paginated_bookings, _iterate, _parse_datetime,
+                      _return_bookings, _serialize_equipment,
+                      _serialize_room, _serialize_rooms, _round_date)
 from .models import BookingA, BookingB, Equipment, RoomA, RoomB
 from timetable.models import Lock
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
+from common.fields import parse_fields
+from common.response_cache import cached_response
+from common.helpers import StreamingJsonResponse
+from common.renderers import BULK_RENDERER_CLASSES
+from uclapi.dbrouters import read_from_replicas
 
 
-@api_view(['GET'])
+@simple_api_view(['GET'])
 @uclapi_protected_endpoint(
-    last_modified_redis_key="gencache"  # Served from our cached Oracle view
+    last_modified_redis_key="gencache",  # Served from our cached Oracle view
+    precompress=True
 )
+@cached_response
+@read_from_replicas
 def get_rooms(request, *args, **kwargs):
     # add them to iterables so can be filtered without if-else
     request_params = {}
@@ -61,20 +70,29 @@ def get_rooms(request, *args, **kwargs):
     return PrettyJsonResponse(
         {
             "ok": True,
-            "rooms": _serialize_rooms(filtered_rooms)
+            "rooms": _serialize_rooms(
+                filtered_rooms,
+                parse_fields(request.GET.get('fields'))
+            )
         }, custom_header_data=kwargs)
 
 
 @api_view(['GET'])
+@renderer_classes(BULK_RENDERER_CLASSES)
 @uclapi_protected_endpoint(
     last_modified_redis_key='gencache'  # Served from our cached Oracle view
 )
+@read_from_replicas
 def get_bookings(request, *args, **kwargs):
+    fields = parse_fields(request.GET.get('fields'))
+
     # if page_token exists, dont look for query
     page_token = request.GET.get('page_token')
     if page_token:
-        bookings = _get_paginated_bookings(page_token)
-        return _return_json_bookings(bookings, custom_header_data=kwargs)
+        bookings = _get_paginated_bookings(page_token, fields)
+        return _return_bookings(
+            request, bookings, fields, custom_header_data=kwargs
+        )
 
     # query params
     request_params = {}
@@ -138,7 +156,7 @@ def get_bookings(request, *args, **kwargs):
     page_token = _create_page_token(request_params, results_per_page)
 
     # first page
-    bookings = _get_paginated_bookings(page_token)
+    bookings = _get_paginated_bookings(page_token, fields)
 
     lock = Lock.objects.all()[0]
     curr = BookingA if lock.a else BookingB
@@ -148,10 +166,12 @@ def get_bookings(request, *args, **kwargs):
         **request_params
     ).count()
 
-    return _return_json_bookings(bookings, custom_header_data=kwargs)
+    return _return_bookings(
+        request, bookings, fields, custom_header_data=kwargs
+    )
 
 
-@api_view(['GET'])
+@simple_api_view(['GET'])
 @uclapi_protected_endpoint(
     last_modified_redis_key=None  # Served from Oracle directly
 )
@@ -186,10 +206,11 @@ def get_equipment(request, *args, **kwargs):
     }, custom_header_data=kwargs)
 
 
-@api_view(['GET'])
+@simple_api_view(['GET'])
 @uclapi_protected_endpoint(
     last_modified_redis_key='gencache'  # Real time calculation, cached data
 )
+@read_from_replicas
 def get_free_rooms(request, *args, **kwargs):
     request_params = {}
     request_params['startdatetime__gte'] = request.GET.get('start_datetime')
@@ -224,14 +245,9 @@ def get_free_rooms(request, *args, **kwargs):
     # Rounding up end date to start of next day
     request_params["finishdatetime__lte"] = _round_date(end, up=True)
 
-    # Pagination Logic
-    # maxing out results_per_page to get all the bookings in one page
-    results_per_page = 100000
+    # Every room with a booking overlapping the given time period
     request_params = {k: v for k, v in request_params.items() if v}
-    page_token = _create_page_token(request_params, results_per_page)
-
-    # All bookings in the given time period
-    bookings = _get_paginated_bookings(page_token)["bookings"]
+    booked_rooms = _get_booked_rooms(request_params, start, end)
 
     lock = Lock.objects.all()[0]
     curr = RoomA if lock.a else RoomB
@@ -243,12 +259,15 @@ def get_free_rooms(request, *args, **kwargs):
     all_rooms = curr.objects.filter(
         Q(bookabletype='CB') | Q(siteid='238') | Q(siteid='240')
     )
-    all_rooms = _serialize_rooms(all_rooms)
-
-    free_rooms = _filter_for_free_rooms(all_rooms, bookings, start, end)
-
-    return PrettyJsonResponse({
+    free_rooms = [
+        room for room in _iterate(all_rooms)
+        if (room.roomid, room.siteid) not in booked_rooms
+    ]
+
+    # The free rooms are only serialised as the response is sent
+    fields = parse_fields(request.GET.get('fields'))
+    return StreamingJsonResponse({
         "ok": True,
         "count": len(free_rooms),
-        "free_rooms": free_rooms
+        "free_rooms": (_serialize_room(room, fields) for room in free_rooms)
     }, custom_header_data=kwargs)
@@ -1,7 +1,12 @@
 from django.conf.urls import url
 
 import search.views
+from uclapi.settings import ASYNC_PROXY_VIEWS
 
 urlpatterns = [
-    url(r'^people$', search.views.people),
+    url(
+        r'^people$',
+        search.views.async_people if ASYNC_PROXY_VIEWS
+        else search.views.people
+    ),
 ]
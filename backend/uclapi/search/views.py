@@ -1,33 +1,22 @@
-from rest_framework.decorators import api_view
-
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
 from common.helpers import PrettyJsonResponse as JsonResponse
+from common.http_client import async_http_client, http_client
 
 import os
 import requests
 
 
-@api_view(['GET'])
-@uclapi_protected_endpoint(
-    last_modified_redis_key=None  # Served directly from the backend Search API
-)
-def people(request, *args, **kwargs):
-    """
-    Backend for the /search endpoint. Provided a query will search for people
-    in the UCL database with an attribute such as name or e-mail that matches
-    the search parameter.
-    """
-    if "query" not in request.GET:
-        response = JsonResponse({
-            "ok": False,
-            "error": "No query provided."
-        }, custom_header_data=kwargs)
-        response.status_code = 400
-        return response
+def _no_query(**kwargs):
+    response = JsonResponse({
+        "ok": False,
+        "error": "No query provided."
+    }, custom_header_data=kwargs)
+    response.status_code = 400
+    return response
 
-    query = request.GET["query"]
 
-    url = (
+def _search_url(query):
+    return (
         "{}?{}={}"
         .format(
             os.environ["SEARCH_API_URL"],
@@ -36,9 +25,19 @@ def people(request, *args, **kwargs):
         )
     )
 
-    r = requests.get(url)
 
-    results = r.json()["response"]["resultPacket"]["results"][:20]
+def _search_unavailable(**kwargs):
+    response = JsonResponse({
+        "ok": False,
+        "error": ("Could not search for people."
+                  " Please try again later or contact us for support.")
+    }, custom_header_data=kwargs)
+    response.status_code = 503
+    return response
+
+
+def _people_response(search_results, **kwargs):
+    results = search_results["response"]["resultPacket"]["results"][:20]
 
     def serialize_person(person):
         return {
@@ -54,3 +53,43 @@ def people(request, *args, **kwargs):
         "ok": True,
         "people": people
     }, custom_header_data=kwargs)
+
+
+@simple_api_view(['GET'])
+@uclapi_protected_endpoint(
+    last_modified_redis_key=None  # Served directly from the backend Search API
+)
+def people(request, *args, **kwargs):
+    """
+    Backend for the /search endpoint. Provided a query will search for people
+    in the UCL database with an attribute such as name or e-mail that matches
+    the search parameter.
+    """
+    if "query" not in request.GET:
+        return _no_query(**kwargs)
+
+    try:
+        r = http_client("search").get(_search_url(request.GET["query"]))
+    except requests.exceptions.RequestException:
+        return _search_unavailable(**kwargs)
+
+    return _people_response(r.json(), **kwargs)
+
+
+@simple_api_view(['GET'])
+@uclapi_protected_endpoint(
+    last_modified_redis_key=None  # Served directly from the backend Search API
+)
+async def async_people(request, *args, **kwargs):
+    """As people, for the ASGI deployment."""
+    if "query" not in request.GET:
+        return _no_query(**kwargs)
+
+    try:
+        r = await async_http_client("search").get(
+            _search_url(request.GET["query"])
+        )
+    except requests.exceptions.RequestException:
+        return _search_unavailable(**kwargs)
+
+    return _people_response(r.json(), **kwargs)
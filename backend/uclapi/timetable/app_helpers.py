@@ -3,10 +3,14 @@ import json
 from distutils.util import strtobool
 from typing import List
 
-import redis
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q
 
+from common.fields import is_selected, select_fields
+from common.local_cache import local_cache
+from common.redis_client import get_redis
+from common.redis_codec import decode_value
 from roombookings.models import (
     BookingA,
     BookingB,
@@ -35,6 +39,7 @@ import timetable.personal_timetable
 from .tasks import cache_student_timetable
 from .utils import (
     get_location_coordinates,
+    get_locations_coordinates,
     SESSION_TYPE_MAP
 )
 
@@ -54,8 +59,42 @@ _lecturers_cache[None] = {
 }
 
 
+def _clear_caches():
+    """Forgets everything cached from a previous run of the gencache"""
+    for cache in (
+        _week_map,
+        _week_num_date_map,
+        _rooms_cache,
+        _instance_cache,
+        _department_name_cache
+    ):
+        cache.clear()
+    unknown_lecturer = _lecturers_cache[None]
+    _lecturers_cache.clear()
+    _lecturers_cache[None] = unknown_lecturer
+
+
+# completion_callback invalidates this namespace once the gencache has run
+local_cache.register(
+    "gencache",
+    settings.LOCAL_CACHE_TTL,
+    on_invalidate=_clear_caches
+)
+
+
 def get_cache(model_name):
     """Returns the cache bucket for the requested model name"""
+    return get_caches(model_name)[0]
+
+
+def get_caches(*model_names):
+    """
+    Returns the cache buckets for each of the requested model names, looking
+    up which bucket is in use only once
+    """
+    # Keeps the module level caches invalidated when the buckets are swapped
+    local_cache.listen()
+
     timetable_models = {
         "module": [ModuleA, ModuleB],
         "students": [StudentsA, StudentsB],
@@ -75,22 +114,18 @@ def get_cache(model_name):
     roombookings_models = {
         "booking": [BookingA, BookingB]
     }
-    if model_name in timetable_models:
-        timetable_lock = Lock.objects.all()[0]
-        if timetable_lock.a:
-            model = timetable_models[model_name][0]
-        else:
-            model = timetable_models[model_name][1]
-    elif model_name in roombookings_models:
-        roombooking_lock = Lock.objects.all()[0]
-        if roombooking_lock.a:
-            model = roombookings_models[model_name][0]
+    bucket_models = []
+    for model_name in model_names:
+        if model_name in timetable_models:
+            bucket_models.append(timetable_models[model_name])
+        elif model_name in roombookings_models:
+            bucket_models.append(roombookings_models[model_name])
         else:
-            model = roombookings_models[model_name][1]
-    else:
-        raise Exception("Unknown model requested from cache")
+            raise Exception("Unknown model requested from cache")
 
-    return model
+    # The timetable and roombookings models share the same lock
+    lock = Lock.objects.all()[0]
+    return [models[0] if lock.a else models[1] for models in bucket_models]
 
 
 def _get_full_department_name(department_code):
@@ -108,21 +143,15 @@ def _get_full_department_name(department_code):
             return "Unknown"
 
 
-def _get_lecturer_details(lecturer_upi):
-    """Returns a lecturer's name and email address from their UPI"""
-    if lecturer_upi in _lecturers_cache:
-        return _lecturers_cache[lecturer_upi]
-    lecturers = get_cache("lecturer")
+def _lecturer_details(lecturer):
+    """Returns the details of a lecturer, who may not have been found"""
     details = {
         "name": "Unknown",
         "email": "Unknown",
         "department_id": "Unknown",
         "department_name": "Unknown"
     }
-    try:
-        lecturer = lecturers.objects.get(lecturerid=lecturer_upi)
-    except ObjectDoesNotExist:
-        _lecturers_cache[lecturer_upi] = details
+    if lecturer is None:
         return details
 
     details["name"] = lecturer.name
@@ -132,21 +161,61 @@ def _get_lecturer_details(lecturer_upi):
     if lecturer.owner:
         details["department_id"] = lecturer.owner
         details["department_name"] = _get_full_department_name(lecturer.owner)
+    return details
+
+
+def _get_lecturer_details(lecturer_upi):
+    """Returns a lecturer's name and email address from their UPI"""
+    if lecturer_upi in _lecturers_cache:
+        return _lecturers_cache[lecturer_upi]
+    lecturers = get_cache("lecturer")
+    try:
+        lecturer = lecturers.objects.get(lecturerid=lecturer_upi)
+    except ObjectDoesNotExist:
+        lecturer = None
+    details = _lecturer_details(lecturer)
     _lecturers_cache[lecturer_upi] = details
     return details
 
 
-def _get_instance_details(instid):
-    if instid in _instance_cache:
-        return _instance_cache[instid]
-    cminstances = get_cache("cminstances")
-    instance_data = cminstances.objects.get(instid=instid)
+def _get_event_lecturer_id(event, module):
+    """Returns the UPI of the lecturer of a timetabled event, if known"""
+    # Check if the module timetable event's Lecturer ID
+    # exists. If not, we use the Lecturer ID associated
+    # with the module as a whole. If neither exist then
+    # we say that we don't know. It's an ugly hack, but
+    # it works around not all timetabled lectures having
+    # the Lecturer ID field filled as they should.
+    if event.lecturerid:
+        return event.lecturerid.strip()
+    elif module.lecturerid:
+        return module.lecturerid.strip()
+    return None
+
+
+def _get_event_lecturer_details(event, module):
+    """Returns the details of the lecturer of a timetabled event"""
+    lecturer_upi = _get_event_lecturer_id(event, module)
+    if lecturer_upi is None:
+        # This will give us 'Unknown' in all fields
+        return _lecturers_cache[None]
+    return _get_lecturer_details(lecturer_upi)
+
+
+def _instance_details(instance_data):
     instance = ModuleInstance(instance_data.instcode)
-    data = {
+    return {
         "delivery": instance.delivery.get_delivery(),
         "periods": instance.periods.get_periods(),
         "instance_code": instance_data.instcode
     }
+
+
+def _get_instance_details(instid):
+    if instid in _instance_cache:
+        return _instance_cache[instid]
+    cminstances = get_cache("cminstances")
+    data = _instance_details(cminstances.objects.get(instid=instid))
     _instance_cache[instid] = data
     return data
 
@@ -232,20 +301,116 @@ def validate_amp_query_params(query_params):
     return True
 
 
-def _get_timetable_events(full_modules):
+def _prefetch_event_details(modules, module_events, event_bookings, fields):
     """
-    Gets a dictionary of timetabled events for a list of Module objects
+    Loads everything the events of the modules will be shown with into the
+    module level caches, a query for each kind of detail however many
+    modules there are, so that building the events does not query at all
     """
+    departments, lecturers, cminstances, rooms, sites = get_caches(
+        "departments", "lecturer", "cminstances", "rooms", "sites"
+    )
+    department_codes = set()
+    lecturer_upis = set()
+    instids = set()
+    locations = set()
+    for module in modules:
+        if is_selected(fields, "instance"):
+            instids.add(module.instid)
+        for event in module_events.get((module.moduleid, module.instid), []):
+            department_codes.add(event.owner)
+            if is_selected(fields, "module.lecturer"):
+                lecturer_upis.add(_get_event_lecturer_id(event, module))
+            if not is_selected(fields, "location"):
+                continue
+            if event.slotid in event_bookings:
+                locations.update(
+                    (booking.siteid, booking.roomid)
+                    for booking in event_bookings[event.slotid]
+                )
+            else:
+                locations.add((event.siteid, event.roomid))
+
+    instids -= _instance_cache.keys()
+    if instids:
+        for instance_data in cminstances.objects.filter(instid__in=instids):
+            if instance_data.instid not in _instance_cache:
+                _instance_cache[instance_data.instid] = _instance_details(
+                    instance_data
+                )
+
+    # Lecturers' departments are needed along with the events'
+    lecturer_upis -= _lecturers_cache.keys()
+    found_lecturers = {}
+    if lecturer_upis:
+        for lecturer in lecturers.objects.filter(lecturerid__in=lecturer_upis):
+            found_lecturers.setdefault(lecturer.lecturerid, lecturer)
+            if lecturer.owner:
+                department_codes.add(lecturer.owner)
+
+    department_codes -= _department_name_cache.keys()
+    if department_codes:
+        for department in departments.objects.filter(
+            deptid__in=department_codes
+        ):
+            _department_name_cache.setdefault(
+                department.deptid,
+                department.name
+            )
+        for department_code in department_codes:
+            _department_name_cache.setdefault(department_code, "Unknown")
+
+    for lecturer_upi in lecturer_upis:
+        _lecturers_cache[lecturer_upi] = _lecturer_details(
+            found_lecturers.get(lecturer_upi)
+        )
+
+    locations = {
+        (siteid, roomid) for siteid, roomid in locations
+        if siteid and roomid and siteid + "___" + roomid not in _rooms_cache
+    }
+    if locations:
+        found_rooms = {}
+        for room in rooms.objects.filter(
+            siteid__in={siteid for siteid, _ in locations},
+            roomid__in={roomid for _, roomid in locations}
+        ):
+            found_rooms.setdefault((room.siteid, room.roomid), room)
+        found_sites = {}
+        for site in sites.objects.filter(
+            siteid__in={siteid for siteid, _ in locations}
+        ):
+            found_sites.setdefault(site.siteid, site)
+
+        coordinates = get_locations_coordinates(
+            (siteid, roomid) for siteid, roomid in locations
+            if (siteid, roomid) in found_rooms and siteid in found_sites
+        )
+        for siteid, roomid in locations:
+            if (siteid, roomid) in coordinates:
+                details = _location_details(
+                    found_rooms[(siteid, roomid)],
+                    found_sites[siteid],
+                    coordinates[(siteid, roomid)]
+                )
+            else:
+                # Unknown rooms are remembered until the next gencache run
+                details = {}
+            _rooms_cache[siteid + "___" + roomid] = details
+
 
-    timetable = get_cache("timetable")
+def _get_timetable_events(full_modules, fields=None):
+    """
+    Gets a dictionary of timetabled events for a list of Module objects,
+    each with only the fields selected (see common.fields.parse_fields)
+    """
 
-    bookings = get_cache("booking")
+    timetable, bookings = get_caches("timetable", "booking")
     distinct_fields = (
         'setid', 'siteid', 'roomid', 'sitename', 'roomname', 'bookabletype',
         'slotid', 'bookingid', 'starttime', 'finishtime', 'startdatetime',
         'finishdatetime', 'weeknumber', 'condisplayname', 'phone', 'descrip',
     )
-    event_bookings_list = {}
     full_timetable = {}
     modules_chosen = {}
     for module in full_modules:
@@ -258,22 +423,50 @@ def _get_timetable_events(full_modules):
             del modules_chosen[key]
         modules_chosen[lab_key] = module
 
+    if not modules_chosen:
+        return full_timetable
+
+    # The events of all of the modules, and the rooms booked for them, are
+    # each fetched at once
+    module_events = {}
+    events_query = Q()
+    for moduleid, instid in {
+        (module.moduleid, module.instid)
+        for module in modules_chosen.values()
+    }:
+        events_query |= Q(moduleid=moduleid, instid=instid)
+    for event in timetable.objects.filter(events_query):
+        module_events.setdefault(
+            (event.moduleid, event.instid),
+            []
+        ).append(event)
+
+    event_bookings_list = {}
+    slotids = {
+        event.slotid
+        for events in module_events.values()
+        for event in events
+    }
+    for booking in bookings.objects.filter(
+        slotid__in=slotids
+    ).distinct(*distinct_fields):
+        event_bookings_list.setdefault(booking.slotid, []).append(booking)
+
+    _prefetch_event_details(
+        modules_chosen.values(),
+        module_events,
+        event_bookings_list,
+        fields
+    )
+
     for _, module in modules_chosen.items():
-        events_data = timetable.objects.filter(
-            moduleid=module.moduleid,
-            instid=module.instid
-        )
-        instance_data = _get_instance_details(module.instid)
+        events_data = module_events.get((module.moduleid, module.instid), [])
+        instance_data = None
+        if is_selected(fields, "instance"):
+            instance_data = _get_instance_details(module.instid)
         for event in events_data:
-            if event.slotid not in event_bookings_list:
-                event_bookings_list[event.slotid] =  \
-                        bookings.objects \
-                                .filter(
-                                    slotid=event.slotid,
-                                ).distinct(*distinct_fields)
-            event_bookings = event_bookings_list[event.slotid]
-            # .exists() instead of len so we don't evaluate all of the filter
-            if not event_bookings.exists():
+            event_bookings = event_bookings_list.get(event.slotid)
+            if not event_bookings:
                 # We have to trust the data in the event because
                 # no rooms are booked for some weird reason.
                 for date in _get_real_dates(event.weekid, event.weekday):
@@ -292,7 +485,7 @@ def _get_timetable_events(full_modules):
                         "location": _get_location_details(
                             event.siteid,
                             event.roomid
-                        ),
+                        ) if is_selected(fields, "location") else None,
                         "session_title": module.name,
                         "session_type": event.moduletype,
                         "session_type_str": _get_session_type_str(
@@ -302,26 +495,15 @@ def _get_timetable_events(full_modules):
                         "instance": instance_data
                     }
 
-                    # Check if the module timetable event's Lecturer ID
-                    # exists. If not, we use the Lecturer ID associated
-                    # with the module as a whole. If neither exist then
-                    # we say that we don't know. It's an ugly hack, but
-                    # it works around not all timetabled lectures having
-                    # the Lecturer ID field filled as they should.
-                    if event.lecturerid:
+                    if is_selected(fields, "module.lecturer"):
                         event_data["module"]["lecturer"] = \
-                            _get_lecturer_details(event.lecturerid.strip())
-                    elif module.lecturerid:
-                        event_data["module"]["lecturer"] = \
-                            _get_lecturer_details(module.lecturerid.strip())
-                    else:
-                        # This will give us 'Unknown' in all fields
-                        event_data["module"]["lecturer"] = \
-                            _lecturers_cache[None]
+                            _get_event_lecturer_details(event, module)
 
                     if date not in full_timetable:
                         full_timetable[date] = []
-                    full_timetable[date].append(event_data)
+                    full_timetable[date].append(
+                        select_fields(event_data, fields)
+                    )
             else:
                 for booking in event_bookings:
                     event_data = {
@@ -339,7 +521,7 @@ def _get_timetable_events(full_modules):
                         "location": _get_location_details(
                             booking.siteid,
                             booking.roomid
-                        ),
+                        ) if is_selected(fields, "location") else None,
                         "session_title": booking.title,
                         "session_type": event.moduletype,
                         "session_type_str": _get_session_type_str(
@@ -349,63 +531,67 @@ def _get_timetable_events(full_modules):
                         "instance": instance_data
                     }
 
-                    # Check if the module timetable event's Lecturer ID
-                    # exists. If not, we use the Lecturer ID associated
-                    # with the module as a whole. If neither exist then
-                    # we say that we don't know. It's an ugly hack, but
-                    # it works around not all timetabled lectures having
-                    # the Lecturer ID field filled as they should.
-                    if event.lecturerid:
+                    if is_selected(fields, "module.lecturer"):
                         event_data["module"]["lecturer"] = \
-                            _get_lecturer_details(event.lecturerid.strip())
-                    elif module.lecturerid:
-                        event_data["module"]["lecturer"] = \
-                            _get_lecturer_details(module.lecturerid.strip())
-                    else:
-                        # This will give us 'Unknown' in all fields
-                        event_data["module"]["lecturer"] = \
-                            _lecturers_cache[None]
-
+                            _get_event_lecturer_details(event, module)
 
                     date_str = booking.startdatetime.strftime("%Y-%m-%d")
                     if date_str not in full_timetable:
                         full_timetable[date_str] = []
-                    full_timetable[date_str].append(event_data)
+                    full_timetable[date_str].append(
+                        select_fields(event_data, fields)
+                    )
     return full_timetable
 
 
-def _get_timetable_events_module_list(module_list):
-    modules = get_cache("module")
-    cminstances = get_cache("cminstances")
-
-    full_modules = []
+def _get_timetable_events_module_list(module_list, fields=None):
+    modules, cminstances = get_caches("module", "cminstances")
 
+    # Each module is either a module ID, or a module ID and instance code
+    # separated by a hyphen
+    requested = []
     for module in module_list:
-        try:
-            if "-" in module and len(module) > 9:
-                # An instance was requested, so filter by it
-                hyphen_pos = module.index('-')
-                instcode = module[hyphen_pos + 1:]
-                instid = cminstances.objects.filter(
-                    instcode=instcode
-                )[0].instid
-                full_modules.append(modules.objects.get(
-                    moduleid=module[:hyphen_pos],
-                    instid=instid
-                ))
-            else:
-                for m in modules.objects.filter(moduleid=module):
-                    full_modules.append(m)
-            # full_modules.append(modules.objects.filter(moduleid=module))
-        except (ObjectDoesNotExist, ValueError):
+        if "-" in module and len(module) > 9:
+            hyphen_pos = module.index('-')
+            requested.append((module[:hyphen_pos], module[hyphen_pos + 1:]))
+        else:
+            requested.append((module, None))
+
+    instids = {}
+    instcodes = {instcode for _, instcode in requested if instcode}
+    if instcodes:
+        for instance in cminstances.objects.filter(instcode__in=instcodes):
+            instids.setdefault(instance.instcode, instance.instid)
+
+    found_modules = {}
+    for module in modules.objects.filter(
+        moduleid__in={moduleid for moduleid, _ in requested}
+    ):
+        found_modules.setdefault(module.moduleid, []).append(module)
+
+    full_modules = []
+    for moduleid, instcode in requested:
+        if instcode is None:
+            full_modules.extend(found_modules.get(moduleid, []))
+            continue
+
+        # An instance was requested, so filter by it
+        instance_modules = [
+            module for module in found_modules.get(moduleid, [])
+            if instcode in instids and module.instid == instids[instcode]
+        ]
+        if not instance_modules:
             return False
+        full_modules.extend(instance_modules)
 
-    return _get_timetable_events(full_modules)
+    return _get_timetable_events(full_modules, fields)
 
 
 def _map_weeks():
-    weekmapnumeric = get_cache("weekmapnumeric")
-    weekstructure = get_cache("weekstructure")
+    weekmapnumeric, weekstructure = get_caches(
+        "weekmapnumeric",
+        "weekstructure"
+    )
     week_nums = weekmapnumeric.objects.all()
     week_strs = weekstructure.objects.all()
 
@@ -454,49 +640,60 @@ def _get_location_details(siteid, roomid):
 
     cache_id = siteid + "___" + roomid
     if cache_id not in _rooms_cache:
-        rooms = get_cache("rooms")
-        sites = get_cache("sites")
+        rooms, sites = get_caches("rooms", "sites")
         try:
             room = rooms.objects.filter(roomid=roomid, siteid=siteid)[0]
             site = sites.objects.filter(siteid=siteid)[0]
         except IndexError:
             return {}
-        lat, lng = get_location_coordinates(siteid, roomid)
-        _rooms_cache[cache_id] = {
-            "name": room.roomname,
-            "capacity": room.capacity,
-            "type": room.bookabletype,
-            "address": [
-                site.address1,
-                site.address2,
-                site.address3,
-                site.address4
-            ],
-            "site_name": site.sitename,
-            "coordinates": {
-                "lat": lat,
-                "lng": lng
-            }
-        }
+        _rooms_cache[cache_id] = _location_details(
+            room,
+            site,
+            get_location_coordinates(siteid, roomid)
+        )
 
     return _rooms_cache[cache_id]
 
 
-def get_student_timetable(upi, date_filter=None):
-    r = redis.Redis(
-        host=settings.REDIS_UCLAPI_HOST,
-        charset="utf-8",
-        decode_responses=True
-    )
+def _location_details(room, site, coordinates):
+    lat, lng = coordinates
+    return {
+        "name": room.roomname,
+        "capacity": room.capacity,
+        "type": room.bookabletype,
+        "address": [
+            site.address1,
+            site.address2,
+            site.address3,
+            site.address4
+        ],
+        "site_name": site.sitename,
+        "coordinates": {
+            "lat": lat,
+            "lng": lng
+        }
+    }
+
+
+def get_student_timetable(upi, date_filter=None, fields=None):
+    r = get_redis()
     timetable_key = "timetable:personal:{}".format(upi)
-    if r.exists(timetable_key):
-        data = r.get(timetable_key)
-        student_events = json.loads(data)
+    data = r.get(timetable_key)
+    if data is not None:
+        student_events = json.loads(decode_value(data))
     else:
         student_events = timetable.personal_timetable.get_personal_timetable(upi)
         # Celery task to cache for the next request
         cache_student_timetable.delay(upi, student_events)
 
+    # The whole timetable is cached for every request, so the fields are
+    # only selected once it has been fetched
+    if fields:
+        student_events = {
+            date: select_fields(events, fields)
+            for date, events in student_events.items()
+        }
+
     if date_filter:
         if date_filter in student_events:
             filtered_student_events = {
@@ -510,8 +707,8 @@ def get_student_timetable(upi, date_filter=None):
     return student_events
 
 
-def get_custom_timetable(modules, date_filter=None):
-    events = _get_timetable_events_module_list(modules)
+def get_custom_timetable(modules, date_filter=None, fields=None):
+    events = _get_timetable_events_module_list(modules, fields)
     if events:
         if date_filter:
             if date_filter in events:
@@ -4,7 +4,6 @@ import json
 import time
 from datetime import datetime
 
-import redis
 from celery import shared_task, chord
 from django.conf import settings
 from django.db import connections
@@ -14,6 +13,10 @@ import requests
 import os
 
 from common.helpers import LOCAL_TIMEZONE
+from common.http_client import http_client
+from common.local_cache import invalidate_local_cache
+from common.redis_client import get_redis, last_modified_key
+from common.redis_codec import encode_value
 from timetable.models import (
     Classifications, ClassificationsA, ClassificationsB,
     Cminstances, CminstancesA, CminstancesB,
@@ -39,21 +42,18 @@ from roombookings.models import (
     Room, RoomA, RoomB,
     Booking, BookingA, BookingB
 )
+from uclapi.dbrouters import wait_for_replicas
 
 
 @shared_task
 def cache_student_timetable(upi, timetable_data):
     timetable_key = "timetable:personal:{}".format(upi)
 
-    r = redis.Redis(
-        host=settings.REDIS_UCLAPI_HOST,
-        charset="utf-8",
-        decode_responses=True
-    )
+    r = get_redis(decode_responses=True)
 
     r.set(
         timetable_key,
-        json.dumps(timetable_data),
+        encode_value(json.dumps(timetable_data)),
         ex=43200
     )
 
@@ -235,9 +235,7 @@ def cache_table_task_testing(idx, dest_table_idx, load_batch_size=10000, insert_
 
 @shared_task(queue="gencache")
 def completion_callback(_, running_key, start_time):
-    redis_conn = redis.Redis(host=settings.REDIS_UCLAPI_HOST,
-                             charset="utf-8",
-                             decode_responses=True)
+    redis_conn = get_redis(decode_responses=True)
     elapsed_time = time.time() - start_time
     print(
         "Caching process completed in {}m {}s".format(
@@ -246,38 +244,40 @@ def completion_callback(_, running_key, start_time):
         )
     )
 
+    # Only switch to the new tables once the replicas have all of them
+    print("Waiting for replicas")
+    wait_for_replicas("gencache")
+
     print("Inverting lock")
     lock = Lock.objects.all()[0]
     lock.a, lock.b = not lock.a, not lock.b
     lock.save()
 
     print("Setting Last-Modified key")
-    last_modified_key = "http:headers:Last-Modified:gencache"
 
     current_timestamp = datetime.now(LOCAL_TIMEZONE).isoformat(
         timespec='seconds'
     )
-    redis_conn.set(last_modified_key, current_timestamp)
+    redis_conn.set(last_modified_key("gencache"), current_timestamp)
+    invalidate_local_cache("gencache")
 
     # Cache has been run now, so we can delete the key to allow it
     # to be run again in the future.
     redis_conn.delete(running_key)
     print("All done.")
     try:
-        requests.get(os.environ.get("HEALTHCHECK_GENCACHE"), timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_GENCACHE"))
     except requests.exceptions.RequestException:
         pass
 
 
 def update_gencache(skip_run_check):
     try:
-        requests.get(os.environ.get("HEALTHCHECK_GENCACHE") + "/start", timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_GENCACHE") + "/start")
     except requests.exceptions.RequestException:
         pass
     running_key = "cron:gencache:in_progress"
-    redis_conn = redis.Redis(host=settings.REDIS_UCLAPI_HOST,
-                             charset="utf-8",
-                             decode_responses=True)
+    redis_conn = get_redis(decode_responses=True)
     start_time = time.time()
     running = redis_conn.get(running_key)
     if running:
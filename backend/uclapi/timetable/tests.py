@@ -1,16 +1,38 @@
+from django.db import connections
 from django.http import QueryDict
 from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 
 from django.test import TestCase
 from rest_framework.test import APIRequestFactory
+import datetime
 import json
 from .app_helpers import (
+    get_student_timetable,
     validate_amp_query_params,
+    _clear_caches,
+    _get_timetable_events_module_list,
     _is_instance_in_criteria,
-    _get_session_type_str
+    _get_session_type_str,
+    _SETID
 )
 
-from .utils import SESSION_TYPE_MAP
+from .models import (
+    CminstancesA,
+    DeptsA,
+    LecturerA,
+    Lock,
+    ModuleA,
+    SitesA,
+    TimetableA,
+    WeekmapnumericA,
+    WeekstructureA
+)
+from .utils import (
+    SESSION_TYPE_MAP,
+    _room_coord_cache,
+    _site_coord_cache
+)
 
 from .amp import (
     InvalidAMPCodeException,
@@ -21,7 +43,10 @@ from .amp import (
 from .views import (
     get_modules_timetable_endpoint,
 )
+from common.fields import parse_fields
+from common.redis_client import get_redis
 from dashboard.models import App, User
+from roombookings.models import BookingA, Location, RoomA
 
 
 class ViewTesting(TestCase):
@@ -993,3 +1018,189 @@ class Helper_functions(SimpleTestCase):
             self.assertEqual(
                 _get_session_type_str(session), session_list[session]
             )
+
+
+class StudentTimetableFieldsTestCase(TestCase):
+    event = {
+        "start_time": "09:00",
+        "end_time": "10:00",
+        "module": {
+            "module_id": "COMP0001",
+            "name": "Computer Architecture",
+            "lecturer": {"name": "A Lecturer", "email": "a@ucl.ac.uk"}
+        },
+        "location": {"name": "Room 1", "address": ["Gower Street"]}
+    }
+
+    def setUp(self):
+        self.r = get_redis()
+        self.r.set(
+            "timetable:personal:fields-test",
+            json.dumps({"2019-01-07": [self.event]})
+        )
+
+    def tearDown(self):
+        self.r.delete("timetable:personal:fields-test")
+
+    def test_all_fields(self):
+        timetable = get_student_timetable("fields-test")
+        self.assertEqual(timetable, {"2019-01-07": [self.event]})
+
+    def test_selected_fields(self):
+        timetable = get_student_timetable(
+            "fields-test",
+            "2019-01-07",
+            parse_fields("start_time,end_time,module.module_id,location.name")
+        )
+        self.assertEqual(timetable, {"2019-01-07": [{
+            "start_time": "09:00",
+            "end_time": "10:00",
+            "module": {"module_id": "COMP0001"},
+            "location": {"name": "Room 1"}
+        }]})
+
+
+class ModuleTimetableQueriesTestCase(TestCase):
+    databases = {"default", "gencache"}
+
+    def setUp(self):
+        Lock.objects.create(a=True, b=False)
+        WeekstructureA.objects.create(
+            setid=_SETID,
+            weeknumber=1,
+            startdate=datetime.date(2019, 1, 7)
+        )
+        WeekmapnumericA.objects.create(setid=_SETID, weekid=1, weeknumber=1)
+        DeptsA.objects.create(deptid="COMPS_ENG", name="Computer Science")
+        SitesA.objects.create(
+            setid=_SETID,
+            siteid="001",
+            sitename="Main Building",
+            address1="Gower Street"
+        )
+        RoomA.objects.create(
+            setid=_SETID,
+            siteid="001",
+            roomid="101",
+            roomname="Room 101",
+            capacity=50,
+            bookabletype="CB"
+        )
+        Location.objects.create(
+            siteid="001",
+            roomid="101",
+            lat="51.52",
+            lng="-0.13"
+        )
+        for i in range(6):
+            self._create_module(i)
+
+        self._clear_caches()
+        self.addCleanup(self._clear_caches)
+
+    def _clear_caches(self):
+        _clear_caches()
+        _room_coord_cache.clear()
+        _site_coord_cache.clear()
+
+    def _create_module(self, i):
+        moduleid = "COMP000{}".format(i)
+        CminstancesA.objects.create(setid=_SETID, instid=i, instcode="A6U-T1")
+        LecturerA.objects.create(
+            setid=_SETID,
+            lecturerid="LECT{}".format(i),
+            name="Lecturer {}".format(i),
+            linkcode="lecturer{}".format(i),
+            owner="COMPS_ENG"
+        )
+        ModuleA.objects.create(
+            setid=_SETID,
+            moduleid=moduleid,
+            owner="COMPS_ENG",
+            name="Module {}".format(i),
+            instid=i,
+            lecturerid="LECT{}".format(i)
+        )
+        # One event with its room booked, and one without
+        for slotid, weekday in ((i * 2, 1), (i * 2 + 1, 2)):
+            TimetableA.objects.create(
+                setid=_SETID,
+                moduleid=moduleid,
+                instid=i,
+                slotid=slotid,
+                weekid=1,
+                weekday=weekday,
+                starttime="09:00",
+                finishtime="10:00",
+                duration=60,
+                owner="COMPS_ENG",
+                moduletype="L",
+                siteid="001",
+                roomid="101"
+            )
+        BookingA.objects.create(
+            setid=_SETID,
+            slotid=i * 2,
+            siteid="001",
+            roomid="101",
+            starttime="09:00",
+            finishtime="10:00",
+            startdatetime=datetime.datetime(2019, 1, 7, 9),
+            title="Lecture {}".format(i),
+            condisplayname="Organiser"
+        )
+
+    def _get_events(self, modules):
+        """Returns the events of modules and the queries made for them"""
+        with CaptureQueriesContext(connections["default"]) as default, \
+                CaptureQueriesContext(connections["gencache"]) as gencache:
+            events = _get_timetable_events_module_list(modules)
+        return events, len(default) + len(gencache)
+
+    def test_events(self):
+        events, _ = self._get_events(["COMP0000-A6U-T1"])
+        self.assertEqual(sorted(events), ["2019-01-07", "2019-01-08"])
+
+        booked = events["2019-01-07"][0]
+        self.assertEqual(booked["session_title"], "Lecture 0")
+        self.assertEqual(booked["contact"], "Organiser")
+        self.assertEqual(booked["module"]["department_name"], "Computer Science")
+        self.assertEqual(booked["module"]["lecturer"], {
+            "name": "Lecturer 0",
+            "email": "lecturer0@ucl.ac.uk",
+            "department_id": "COMPS_ENG",
+            "department_name": "Computer Science"
+        })
+        self.assertEqual(booked["location"]["name"], "Room 101")
+        self.assertEqual(booked["location"]["address"][0], "Gower Street")
+        self.assertEqual(
+            booked["location"]["coordinates"],
+            {"lat": "51.52", "lng": "-0.13"}
+        )
+        self.assertEqual(booked["instance"]["instance_code"], "A6U-T1")
+
+        unbooked = events["2019-01-08"][0]
+        self.assertEqual(unbooked["session_title"], "Module 0")
+        self.assertEqual(unbooked["contact"], "Unknown")
+        self.assertEqual(unbooked["location"], booked["location"])
+
+    def test_unknown_instance(self):
+        events, _ = self._get_events(["COMP0000-A6U-T2"])
+        self.assertFalse(events)
+
+    def test_queries_do_not_grow_with_modules(self):
+        _, one_module_queries = self._get_events(["COMP0000"])
+        self._clear_caches()
+        events, six_module_queries = self._get_events(
+            ["COMP000{}".format(i) for i in range(6)]
+        )
+
+        self.assertEqual(sum(len(day) for day in events.values()), 12)
+        self.assertEqual(one_module_queries, six_module_queries)
+        self.assertLessEqual(six_module_queries, 15)
+
+        # Details already loaded are not loaded again
+        _, cached_queries = self._get_events(
+            ["COMP000{}".format(i) for i in range(6)]
+        )
+        self.assertLess(cached_queries, six_module_queries)
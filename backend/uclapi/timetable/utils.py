@@ -54,3 +54,55 @@ def get_location_coordinates(siteid, roomid):
 
     # Now just bail
     return None, None
+
+
+def get_locations_coordinates(locations):
+    """
+    Given many sites and rooms, returns the co-ordinates of each, as
+    get_location_coordinates would, in at most two queries.
+
+    :param locations: (siteid, roomid) pairs
+    :type locations: iterable of tuple (str,str)
+
+    :returns: the latitude and longitude of each location
+    :rtype: dict of tuple (str,str) to tuple (str,str)
+    """
+    locations = set(locations)
+
+    # Rooms are cached by their ID alone
+    rooms = {
+        roomid for _, roomid in locations
+        if roomid not in _room_coord_cache
+    }
+    if rooms:
+        for location in Location.objects.filter(
+            siteid__in={siteid for siteid, _ in locations},
+            roomid__in=rooms
+        ):
+            if (location.siteid, location.roomid) in locations:
+                _room_coord_cache.setdefault(
+                    location.roomid,
+                    (location.lat, location.lng)
+                )
+
+    sites = {
+        siteid for siteid, roomid in locations
+        if roomid not in _room_coord_cache and
+        siteid not in _site_coord_cache
+    }
+    if sites:
+        for location in SiteLocation.objects.filter(siteid__in=sites):
+            _site_coord_cache.setdefault(
+                location.siteid,
+                (location.lat, location.lng)
+            )
+
+    coordinates = {}
+    for siteid, roomid in locations:
+        if roomid in _room_coord_cache:
+            coordinates[(siteid, roomid)] = _room_coord_cache[roomid]
+        elif siteid in _site_coord_cache:
+            coordinates[(siteid, roomid)] = _site_coord_cache[siteid]
+        else:
+            coordinates[(siteid, roomid)] = (None, None)
+    return coordinates
@@ -17,17 +17,21 @@ from .app_helpers import (
     validate_amp_query_params
 )
 
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
+from common.fields import parse_fields
+from common.response_cache import cached_response
+from uclapi.dbrouters import read_from_replicas
 
 _SETID = settings.ROOMBOOKINGS_SETID
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(
     personal_data=True,
     required_scopes=['timetable'],
     last_modified_redis_key='gencache'
 )
+@read_from_replicas
 def get_personal_timetable_endpoint(request, *args, **kwargs):
     """
     Returns a personal timetable of a user. Requires OAuth permissions.
@@ -35,7 +39,8 @@ def get_personal_timetable_endpoint(request, *args, **kwargs):
     token = kwargs['token']
     user = token.user
     date_filter = request.GET.get("date")
-    timetable = get_student_timetable(user.employee_id, date_filter)
+    fields = parse_fields(request.GET.get("fields"))
+    timetable = get_student_timetable(user.employee_id, date_filter, fields)
 
     response = {
         "ok": True,
@@ -44,10 +49,11 @@ def get_personal_timetable_endpoint(request, *args, **kwargs):
     return JsonResponse(response, custom_header_data=kwargs)
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(
     last_modified_redis_key='gencache'
 )
+@read_from_replicas
 def get_modules_timetable_endpoint(request, *args, **kwargs):
     """
     Returns a timetabe for a module or set of modules.
@@ -64,7 +70,8 @@ def get_modules_timetable_endpoint(request, *args, **kwargs):
     modules = module_ids.split(',')
 
     date_filter = request.GET.get("date")
-    custom_timetable = get_custom_timetable(modules, date_filter)
+    fields = parse_fields(request.GET.get("fields"))
+    custom_timetable = get_custom_timetable(modules, date_filter, fields)
 
     if custom_timetable:
         response_json = {
@@ -82,10 +89,13 @@ def get_modules_timetable_endpoint(request, *args, **kwargs):
         return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(
-    last_modified_redis_key='gencache'
+    last_modified_redis_key='gencache',
+    precompress=True
 )
+@cached_response
+@read_from_replicas
 def get_departments_endpoint(request, *args, **kwargs):
     """
     Returns all departments at UCL
@@ -97,10 +107,12 @@ def get_departments_endpoint(request, *args, **kwargs):
     return JsonResponse(departments, custom_header_data=kwargs)
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(
     last_modified_redis_key='gencache'
 )
+@cached_response
+@read_from_replicas
 def get_department_courses_endpoint(request, *args, **kwargs):
     """
     Returns all the courses in UCL with relevant ID
@@ -127,10 +139,12 @@ def get_department_courses_endpoint(request, *args, **kwargs):
     return JsonResponse(courses, custom_header_data=kwargs)
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(
     last_modified_redis_key='gencache'
 )
+@cached_response
+@read_from_replicas
 def get_department_modules_endpoint(request, *args, **kwargs):
     """
     Returns all modules taught by a particular department.
@@ -155,8 +169,10 @@ def get_department_modules_endpoint(request, *args, **kwargs):
 
 @api_view(["GET"])
 @uclapi_protected_endpoint(
-    last_modified_redis_key='timetable_gencache'
+    last_modified_redis_key='gencache'
 )
+@cached_response
+@read_from_replicas
 def get_course_modules_endpoint(request, *args, **kwargs):
     """
     Returns all modules taught on a particular course.
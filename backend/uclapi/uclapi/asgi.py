@@ -0,0 +1,27 @@
+"""
+ASGI config for uclapi project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Under ASGI the LibCal, search and PC availability endpoints are served by
+their async views, so that one worker can wait on many upstream requests.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+from common.helpers import read_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+read_dotenv(os.path.join(BASE_DIR, '.env'))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "uclapi.settings")
+os.environ.setdefault("ASYNC_PROXY_VIEWS", "True")
+
+# Unlike uclapi/wsgi.py, eventlet is not used here: the event loop does the
+# waiting, and synchronous views are run in threads by Django.
+application = get_asgi_application()
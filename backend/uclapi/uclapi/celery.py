@@ -30,7 +30,10 @@ app.autodiscover_tasks()
 
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
-    from django_celery_beat.models import CrontabSchedule, PeriodicTask
+    from django_celery_beat.models import (
+        CrontabSchedule, IntervalSchedule, PeriodicTask
+    )
+    from uclapi.settings import API_CALL_LOG_FLUSH_INTERVAL
 
     # Gencache at every 5th and 35th minute
     gencache_schedule, _ = CrontabSchedule.objects.get_or_create(minute='5,35', hour='*',
@@ -77,6 +80,16 @@ def setup_periodic_tasks(sender, **kwargs):
     libcal_token_task.name = 'LibCal token refresh'
     libcal_token_task.save()
 
+    # Write queued API calls to the database every few seconds
+    api_call_log_schedule, _ = IntervalSchedule.objects.get_or_create(every=API_CALL_LOG_FLUSH_INTERVAL,
+                                                                      period=IntervalSchedule.SECONDS)
+    api_call_log_task = PeriodicTask.objects.filter(task='dashboard.tasks.flush_api_calls_task').first()
+    if api_call_log_task is None:
+        api_call_log_task = PeriodicTask(task='dashboard.tasks.flush_api_calls_task')
+    api_call_log_task.interval = api_call_log_schedule
+    api_call_log_task.name = 'Flush API call log'
+    api_call_log_task.save()
+
 
 @app.task()
 def ping_sample_task():
@@ -1,6 +1,179 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import DatabaseError, connections
+
+from uclapi.settings import (
+    DATABASE_REPLICA_CHECK_INTERVAL,
+    DATABASE_REPLICA_MAX_LAG,
+    DATABASE_REPLICAS
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Whether reads may currently be served by a replica
+_replica_reads = contextvars.ContextVar("replica_reads", default=False)
+
+# Seconds a replica is behind its primary. A replica with nothing left to
+# replay is not behind at all, however long ago its last transaction was,
+# as the gencache database is only written to every half an hour. That only
+# holds while it is still streaming from the primary: once its WAL receiver
+# has stalled or disconnected, it has nothing to replay because it is no
+# longer being sent anything, so no lag is given and it is not read from.
+# The database user needs the pg_read_all_stats role to see the receiver.
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (
+        SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+    ) THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+@contextmanager
+def replica_reads():
+    """Lets reads within the block be served by replicas."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _iterate_with_replica_reads(content):
+    # Streamed responses are rendered after the view has returned
+    iterator = iter(content)
+    while True:
+        with replica_reads():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def read_from_replicas(view_func):
+    """
+    Serves the reads of a read-only view from replicas, including those made
+    while its response is streamed. It must be applied under
+    uclapi_protected_endpoint, so that tokens are still authorised against
+    the primary and a token that has just been created is never missed.
+    The token the view is given is loaded from the primary too.
+    """
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        with replica_reads():
+            response = view_func(request, *args, **kwargs)
+        if getattr(response, 'streaming', False):
+            response.streaming_content = _iterate_with_replica_reads(
+                response.streaming_content
+            )
+        return response
+    return wrapped
+
+
+class _ReplicaLag:
+    """
+    Remembers which replicas are close enough to their primaries to be read
+    from, checking each at most every DATABASE_REPLICA_CHECK_INTERVAL seconds.
+    """
+    def __init__(self):
+        self._checked = {}
+
+    def _measure(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_QUERY)
+                (lag,) = cursor.fetchone()
+        except DatabaseError:
+            logger.warning(
+                "Could not check how far behind %s is.",
+                alias,
+                exc_info=True
+            )
+            return None
+        return None if lag is None else float(lag)
+
+    def is_fresh(self, alias):
+        now = time.monotonic()
+        checked = self._checked.get(alias)
+        if (
+            checked is None or
+            now - checked[0] >= DATABASE_REPLICA_CHECK_INTERVAL
+        ):
+            lag = self._measure(alias)
+            checked = (
+                now,
+                lag is not None and lag <= DATABASE_REPLICA_MAX_LAG
+            )
+            self._checked[alias] = checked
+        return checked[1]
+
+
+_replica_lag = _ReplicaLag()
+
+
+def _has_replayed(alias, lsn):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                "SELECT NOT pg_is_in_recovery() OR "
+                "pg_last_wal_replay_lsn() >= %s::pg_lsn",
+                [lsn]
+            )
+            return bool(cursor.fetchone()[0])
+    except DatabaseError:
+        return False
+
+
+def wait_for_replicas(database, timeout=DATABASE_REPLICA_MAX_LAG):
+    """
+    Waits up to timeout seconds for every replica of a database to replay
+    everything written to it so far, so that data which has only just been
+    loaded is not read from a replica before it is all there.
+    Returns whether they all did.
+    """
+    replicas = DATABASE_REPLICAS.get(database, [])
+    if not replicas:
+        return True
+
+    with connections[database].cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn()")
+        (lsn,) = cursor.fetchone()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        replicas = [
+            alias for alias in replicas if not _has_replayed(alias, lsn)
+        ]
+        if not replicas:
+            return True
+        if time.monotonic() >= deadline:
+            logger.warning(
+                "%s did not catch up with %s within %s seconds.",
+                ", ".join(replicas),
+                database,
+                timeout
+            )
+            return False
+        time.sleep(0.5)
+
+
 class ModelRouter(object):
     def __init__(self):
-        self.managed_db_list = ['default', 'gencache']
+        self.managed_db_list = ['default', 'gencache'] + [
+            replica
+            for replicas in DATABASE_REPLICAS.values()
+            for replica in replicas
+        ]
         self.gencache_model_names = [
             "bookinga",
             "bookingb",
@@ -51,7 +224,18 @@ class ModelRouter(object):
         ]
 
     def db_for_read(self, model, **hints):
-        return getattr(model._meta, "_DATABASE", "default")
+        database = getattr(model._meta, "_DATABASE", "default")
+        if not _replica_reads.get():
+            return database
+
+        # Fall back to the primary if every replica is too far behind
+        replicas = [
+            alias for alias in DATABASE_REPLICAS.get(database, [])
+            if _replica_lag.is_fresh(alias)
+        ]
+        if not replicas:
+            return database
+        return random.choice(replicas)
 
     def db_for_write(self, model, **hints):
         return getattr(model._meta, "_DATABASE", "default")
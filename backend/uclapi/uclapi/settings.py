@@ -66,13 +66,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'common.middleware.health_check_middleware.HealthCheckMiddleware',
+    'common.middleware.pretty_json_middleware.PrettyJsonMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Sessions, CSRF, authentication and messages are skipped for the
+    # token authenticated API
+    'common.middleware.api_fast_path_middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'common.middleware.api_fast_path_middleware.CsrfViewMiddleware',
+    'common.middleware.api_fast_path_middleware.AuthenticationMiddleware',
+    'common.middleware.api_fast_path_middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -133,6 +136,33 @@ DATABASES = {
     }
 }
 
+# Read-only API endpoints are served from streaming replicas of the default
+# and gencache databases where there are any, given as comma separated lists
+# of hosts. A replica is only read from while it is no more than
+# DATABASE_REPLICA_MAX_LAG seconds behind, which each worker checks at most
+# every DATABASE_REPLICA_CHECK_INTERVAL seconds, and while it is streaming
+# from its primary.
+DATABASE_REPLICAS = {}
+for _alias, _hosts in (
+    ('default', os.environ.get("DB_UCLAPI_REPLICA_HOSTS", "")),
+    ('gencache', os.environ.get("DB_CACHE_REPLICA_HOSTS", ""))
+):
+    for _i, _host in enumerate(filter(None, _hosts.split(",")), start=1):
+        _replica = "{}_replica_{}".format(_alias, _i)
+        DATABASES[_replica] = dict(
+            DATABASES[_alias],
+            HOST=_host.strip(),
+            TEST={'MIRROR': _alias}
+        )
+        DATABASE_REPLICAS.setdefault(_alias, []).append(_replica)
+
+DATABASE_REPLICA_MAX_LAG = float(
+    os.environ.get("DATABASE_REPLICA_MAX_LAG", 30)
+)
+DATABASE_REPLICA_CHECK_INTERVAL = float(
+    os.environ.get("DATABASE_REPLICA_CHECK_INTERVAL", 5)
+)
+
 # Max connections is pool_size + max_overflow
 # Will idle at pool_size connections, overflow are for spikes in traffic
 
@@ -186,6 +216,10 @@ if os.environ.get('SENTRY_DSN'):
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',),
     'DEFAULT_PAGINATION_CLASS': 'common.pagination.CustomPagination',
+    'DEFAULT_RENDERER_CLASSES': (
+        'common.renderers.CompactJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'EXCEPTION_HANDLER': 'common.exception_handler.custom_exception_handler',
     'PAGE_SIZE': 1000
 }
@@ -235,11 +269,144 @@ with open(fair_use_policy_path, 'r', encoding='utf-8') as fp:
 
 REDIS_UCLAPI_HOST = os.environ.get("REDIS_UCLAPI_HOST", "")
 
+# In cluster mode REDIS_UCLAPI_HOST is a comma separated list of host:port
+# nodes to discover the cluster from. Celery cannot use a cluster, so its
+# broker and results are kept on REDIS_BROKER_HOST.
+REDIS_CLUSTER_MODE = strtobool(os.environ.get("REDIS_CLUSTER_MODE", "False"))
+REDIS_BROKER_HOST = os.environ.get("REDIS_BROKER_HOST") or REDIS_UCLAPI_HOST
+
+# Options for the per-process Redis connection pools (see
+# common/redis_client.py). Timeouts are in seconds. Leaving
+# REDIS_MAX_CONNECTIONS unset places no limit on the size of each pool.
+REDIS_MAX_CONNECTIONS = (
+    int(os.environ["REDIS_MAX_CONNECTIONS"])
+    if os.environ.get("REDIS_MAX_CONNECTIONS") else None
+)
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 10))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(
+    os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 2)
+)
+REDIS_HEALTH_CHECK_INTERVAL = int(
+    os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)
+)
+
+# Resolved API tokens are cached in each worker for up to TOKEN_CACHE_TTL
+# seconds so that most requests need no database lookup to authenticate.
+# Setting TOKEN_CACHE_MAX_SIZE to 0 disables the cache.
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_CACHE_MAX_SIZE", 10000))
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 60))
+
+# Data read from Redis on most requests, such as workspaces surveys and map
+# images, is also cached in each worker, in an LRU cache of up to
+# LOCAL_CACHE_MAX_SIZE entries that are kept for up to LOCAL_CACHE_TTL
+# seconds or until the data is refreshed. Setting LOCAL_CACHE_MAX_SIZE to 0
+# disables the cache.
+LOCAL_CACHE_MAX_SIZE = int(os.environ.get("LOCAL_CACHE_MAX_SIZE", 256))
+LOCAL_CACHE_TTL = int(os.environ.get("LOCAL_CACHE_TTL", 300))
+
+# API calls are queued in Redis and written to the database in batches of
+# API_CALL_LOG_FLUSH_SIZE every API_CALL_LOG_FLUSH_INTERVAL seconds. Calls are
+# dropped (and counted) once API_CALL_LOG_MAX_QUEUE calls are waiting.
+API_CALL_LOG_FLUSH_SIZE = int(os.environ.get("API_CALL_LOG_FLUSH_SIZE", 1000))
+API_CALL_LOG_FLUSH_INTERVAL = int(
+    os.environ.get("API_CALL_LOG_FLUSH_INTERVAL", 10)
+)
+API_CALL_LOG_MAX_QUEUE = int(os.environ.get("API_CALL_LOG_MAX_QUEUE", 100000))
+
+# Whether a 304 Not Modified response to a conditional GET uses up a call
+# from the daily quota like any other response.
+NOT_MODIFIED_COUNTS_TOWARDS_QUOTA = strtobool(
+    os.environ.get("NOT_MODIFIED_COUNTS_TOWARDS_QUOTA", "True")
+)
+
+# Each worker adds its request timings to the totals in Redis at most every
+# METRICS_FLUSH_INTERVAL seconds. /metrics must be requested with
+# METRICS_TOKEN as a bearer token, and is not served while it is unset.
+METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL", 10))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Responses to API requests smaller than COMPRESSION_MIN_SIZE bytes are not
+# compressed. Endpoints that are precompressed keep their compressed
+# responses for PRECOMPRESSED_CACHE_TTL seconds, or until their data changes.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+PRECOMPRESSED_CACHE_TTL = int(
+    os.environ.get("PRECOMPRESSED_CACHE_TTL", 86400)
+)
+
+# Values the caches write to Redis that are at least REDIS_COMPRESSION_MIN_SIZE
+# bytes long are stored compressed.
+REDIS_COMPRESSION_MIN_SIZE = int(
+    os.environ.get("REDIS_COMPRESSION_MIN_SIZE", 1024)
+)
+
+# Endpoints whose responses are cached keep them for RESPONSE_CACHE_TTL
+# seconds, or until their data changes.
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 86400))
+
+# Each worker admits at most ADMISSION_LIMITS[service] protected requests to
+# a service at once, or ADMISSION_MAX_IN_FLIGHT if the service has no limit
+# of its own, so that a slow upstream cannot tie up every worker. Requests
+# that have already waited ADMISSION_MAX_QUEUE_TIME seconds for a worker,
+# according to the X-Request-Start header set by nginx, are not started.
+# Shed requests are told to retry after ADMISSION_RETRY_AFTER seconds.
+# Limits of 0 disable admission control.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 0))
+ADMISSION_LIMITS = {
+    _service.strip(): int(_limit)
+    for _service, _limit in (
+        _entry.split("=", 1)
+        for _entry in os.environ.get("ADMISSION_LIMITS", "").split(",")
+        if _entry.strip()
+    )
+}
+ADMISSION_MAX_QUEUE_TIME = float(
+    os.environ.get("ADMISSION_MAX_QUEUE_TIME", 0)
+)
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+
+# Requests to upstream services, such as OccupEye and LibCal, are made over
+# a pool of up to HTTP_POOL_SIZE kept-alive connections per upstream. They
+# time out after HTTP_CONNECT_TIMEOUT seconds connecting or HTTP_READ_TIMEOUT
+# seconds waiting for data, and are retried up to HTTP_MAX_RETRIES times,
+# waiting HTTP_RETRY_BACKOFF seconds and twice as long each time after.
+# Once HTTP_CIRCUIT_BREAKER_THRESHOLD requests in a row to an upstream have
+# failed, requests to it fail straight away for
+# HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT seconds.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_CIRCUIT_BREAKER_THRESHOLD = int(
+    os.environ.get("HTTP_CIRCUIT_BREAKER_THRESHOLD", 5)
+)
+HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT", 30)
+)
+
+# Whether the LibCal, search and PC availability endpoints are served by
+# their async views. uclapi/asgi.py turns this on, as async views would
+# block a WSGI worker. Async views share up to HTTP_ASYNC_MAX_CONNECTIONS
+# connections to each upstream per worker, as one worker can wait on many
+# requests at once.
+ASYNC_PROXY_VIEWS = strtobool(os.environ.get("ASYNC_PROXY_VIEWS", "False"))
+HTTP_ASYNC_MAX_CONNECTIONS = int(
+    os.environ.get("HTTP_ASYNC_MAX_CONNECTIONS", 1000)
+)
+
+# Signed API tokens can be authorised without a database lookup. They are
+# accepted whenever SIGNED_TOKENS_SECRET is set, but only issued to new and
+# regenerated tokens if ISSUE_SIGNED_TOKENS is also enabled.
+SIGNED_TOKENS_SECRET = os.environ.get("SIGNED_TOKENS_SECRET", "")
+ISSUE_SIGNED_TOKENS = strtobool(
+    os.environ.get("ISSUE_SIGNED_TOKENS", "False")
+) and bool(SIGNED_TOKENS_SECRET)
+
 SHIB_TEST_USER = os.environ.get("SHIB_TEST_USER", "")
 
 # Celery Settings
-CELERY_BROKER_URL = 'redis://' + REDIS_UCLAPI_HOST
-CELERY_RESULT_BACKEND = 'redis://' + REDIS_UCLAPI_HOST
+CELERY_BROKER_URL = 'redis://' + REDIS_BROKER_HOST
+CELERY_RESULT_BACKEND = 'redis://' + REDIS_BROKER_HOST
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -25,7 +25,7 @@ from dashboard.views import (
     error_500_view,
     custom_page_not_found
 )
-from common.views import ping_view
+from common.views import metrics_view, ping_view
 from oauth.views import settings, settings_shibboleth_callback, logout
 from marketplace.views import marketplace
 
@@ -53,6 +53,7 @@ urlpatterns = [
     path('workspaces/', include('workspaces.urls')),
     path('libcal/', include('libcal.urls')),
     path('ping/', ping_view),
+    path('metrics', metrics_view),
     path('', home),
     path('404/', custom_page_not_found),
     path('500/', error_500_view)
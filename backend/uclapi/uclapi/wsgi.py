@@ -14,6 +14,7 @@ import eventlet
 from django.core.wsgi import get_wsgi_application
 from django.conf import settings
 
+from common.green import patch_drivers
 from common.helpers import read_dotenv
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -29,5 +30,8 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "uclapi.settings")
 # This is because the patch breaks runserver.
 if os.environ.get("EVENTLET_NOPATCH") != 'True':
     eventlet.monkey_patch()
+    # Let other requests carry on while one waits on Postgres, Oracle or
+    # Redis, which would otherwise block the whole worker
+    patch_drivers()
 
 application = get_wsgi_application()
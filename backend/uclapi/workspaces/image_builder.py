@@ -1,8 +1,9 @@
-import redis
-from django.conf import settings
 from lxml import etree
 
+from common.redis_client import get_redis
+
 from .occupeye.api import OccupEyeApi
+from .occupeye.constants import OccupEyeConstants
 from .occupeye.exceptions import BadOccupEyeRequest, OccupEyeOtherSensorState
 from .occupeye.utils import is_sensor_occupied
 
@@ -24,7 +25,7 @@ class ImageBuilder:
         if not self._api.check_map_exists(survey_id, map_id):
             raise BadOccupEyeRequest
 
-        self._redis = redis.Redis(host=settings.REDIS_UCLAPI_HOST, charset="utf-8", decode_responses=True)
+        self._redis = get_redis(decode_responses=True)
         self._sensors = self._api.get_survey_sensors(
             survey_id
             # return_states=True
@@ -66,7 +67,9 @@ class ImageBuilder:
         base_map.attrib["width"] = viewbox_data[2]
         base_map.attrib["height"] = viewbox_data[3]
 
-        map_data = self._redis.hgetall("occupeye:surveys:{}:maps:{}".format(self._survey_id, self._map_id))
+        map_data = self._redis.hgetall(
+            OccupEyeConstants.SURVEY_MAP_DATA_KEY.format(self._survey_id, self._map_id)
+        )
         (b64_data, content_type) = self._api.get_image(map_data["image_id"])
         base_map.attrib["{http://www.w3.org/1999/xlink}href"] = "data:{};base64,{}".format(content_type, b64_data)
         bubble_overlay = etree.SubElement(viewport, "g")
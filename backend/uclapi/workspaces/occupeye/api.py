@@ -2,13 +2,18 @@ import json
 from collections import OrderedDict
 from distutils.util import strtobool
 
-import redis
-from django.conf import settings
-
+from common.local_cache import local_cache
+from common.redis_client import get_redis
+from common.redis_codec import decode_text, decode_value
+from uclapi.settings import LOCAL_CACHE_TTL
 from .constants import OccupEyeConstants
 from .exceptions import BadOccupEyeRequest, OccupEyeOtherSensorState
 from .utils import is_sensor_occupied, survey_ids_to_surveys
 
+# Surveys, map images and summaries are read on almost every request, but
+# only change when OccupeyeCache.feed_cache runs, which invalidates them
+local_cache.register("occupeye", LOCAL_CACHE_TTL)
+
 
 class OccupEyeApi:
     """
@@ -19,7 +24,9 @@ class OccupEyeApi:
     """
 
     def __init__(self):
-        self._redis = redis.Redis(host=settings.REDIS_UCLAPI_HOST, charset="utf-8", decode_responses=True)
+        self._redis = get_redis(decode_responses=True)
+        # Large values may be stored compressed, so are read as bytes
+        self._raw_redis = get_redis()
         self._const = OccupEyeConstants()
 
     def get_surveys(self, survey_filter):
@@ -29,6 +36,13 @@ class OccupEyeApi:
         requisite data does not exist in Redis, it is cached using
         the helper functions above, then returned from the cache.
         """
+        return local_cache.get(
+            "occupeye",
+            ("surveys", survey_filter),
+            lambda: self._get_surveys(survey_filter)
+        )
+
+    def _get_surveys(self, survey_filter):
         survey_ids = self._redis.lrange(
             self._const.SURVEYS_LIST_KEY,
             0,
@@ -95,16 +109,30 @@ class OccupEyeApi:
         if not image_id.isdigit():
             raise BadOccupEyeRequest
 
-        b64_key = self._const.IMAGE_BASE64_KEY.format(image_id)
-        if not self._redis.exists(b64_key):
+        image = local_cache.get(
+            "occupeye",
+            ("image", image_id),
+            lambda: self._get_image(image_id)
+        )
+        if image is None:
             raise BadOccupEyeRequest
+        return image
 
+    def _get_image(self, image_id):
+        b64_key = self._const.IMAGE_BASE64_KEY.format(image_id)
         content_type_key = self._const.IMAGE_CONTENT_TYPE_KEY.format(image_id)
 
-        image_b64 = self._redis.get(b64_key)
-        content_type = self._redis.get(content_type_key)
+        image_b64, content_type = self._raw_redis.mget(b64_key, content_type_key)
+        if image_b64 is None:
+            return None
+        return (decode_text(image_b64), decode_text(content_type))
 
-        return (image_b64, content_type)
+    def _get_summary(self, cache_key):
+        return local_cache.get(
+            "occupeye",
+            cache_key,
+            lambda: json.loads(decode_value(self._raw_redis.get(cache_key)))
+        )
 
     def get_survey_sensors(self, survey_id):
         """
@@ -264,11 +292,11 @@ class OccupEyeApi:
             # of Survey IDs is the same length as the total surveys
             # available.
             if survey_filter == "all":
-                data = json.loads(self._redis.get(self._const.SUMMARY_CACHE_ALL_SURVEYS))
+                data = self._get_summary(self._const.SUMMARY_CACHE_ALL_SURVEYS)
             elif survey_filter == "student":
-                data = json.loads(self._redis.get(self._const.SUMMARY_CACHE_ALL_STUDENT_SURVEYS))
+                data = self._get_summary(self._const.SUMMARY_CACHE_ALL_STUDENT_SURVEYS)
             elif survey_filter == "staff":
-                data = json.loads(self._redis.get(self._const.SUMMARY_CACHE_ALL_STAFF_SURVEYS))
+                data = self._get_summary(self._const.SUMMARY_CACHE_ALL_STAFF_SURVEYS)
             else:
                 raise BadOccupEyeRequest
             return data
@@ -280,7 +308,7 @@ class OccupEyeApi:
         for survey in filtered_surveys:
             survey_id = int(survey["id"])
             cache_key = self._const.SUMMARY_CACHE_SURVEY.format(survey_id)
-            survey_data = json.loads(self._redis.get(cache_key))
+            survey_data = self._get_summary(cache_key)
             summary_list.extend(survey_data)
 
         return summary_list
@@ -294,7 +322,7 @@ class OccupEyeApi:
 
         for survey in filtered_surveys:
             timeaverage_key = (self._const.TIMEAVERAGE_KEY).format(survey["id"], day_count)
-            averages = json.loads(self._redis.get(timeaverage_key))
+            averages = json.loads(decode_value(self._raw_redis.get(timeaverage_key)))
             survey_data = {
                 "survey_id": survey["id"],
                 "name": survey["name"],
@@ -2,11 +2,10 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import List, Tuple
 
-import redis
 from django.core.exceptions import ObjectDoesNotExist
 
 from common.helpers import LOCAL_TIMEZONE
-from uclapi import settings
+from common.redis_client import get_redis, last_modified_key
 from workspaces.models import Surveys, Historical, Sensors, SensorReplacements, SurveyChanges
 from .constants import OccupEyeConstants
 from .endpoint import OccupeyeEndpoint, Endpoint
@@ -20,7 +19,7 @@ class OccupEyeArchive:
         if endpoint is None:
             endpoint = OccupeyeEndpoint()
         self._const = OccupEyeConstants()
-        self._redis = redis.Redis(host=settings.REDIS_UCLAPI_HOST, charset="utf-8", decode_responses=True)
+        self._redis = get_redis(decode_responses=True)
         self._endpoint = endpoint
 
     @staticmethod
@@ -226,7 +225,5 @@ class OccupEyeArchive:
                 survey.save()
 
         logging.info("[+] Setting Last-Modified key")
-        last_modified_key = "http:headers:Last-Modified:Workspaces-Historical"
-
         current_timestamp = datetime.now(LOCAL_TIMEZONE).isoformat(timespec="seconds")
-        self._redis.set(last_modified_key, current_timestamp)
+        self._redis.set(last_modified_key("Workspaces-Historical"), current_timestamp)
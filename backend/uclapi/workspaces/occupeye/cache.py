@@ -3,10 +3,10 @@ import logging
 from datetime import datetime, timedelta
 from distutils.util import strtobool
 
-import redis
-from django.conf import settings
-
 from common.helpers import LOCAL_TIMEZONE
+from common.local_cache import invalidate_local_cache
+from common.redis_client import get_redis, last_modified_key
+from common.redis_codec import encode_value
 from .api import OccupEyeApi
 from .constants import OccupEyeConstants
 from .endpoint import OccupeyeEndpoint, Endpoint
@@ -18,7 +18,7 @@ class OccupeyeCache:
     def __init__(self, endpoint: Endpoint = None):
         if endpoint is None:
             endpoint = OccupeyeEndpoint()
-        self._redis = redis.Redis(host=settings.REDIS_UCLAPI_HOST, charset="utf-8", decode_responses=True)
+        self._redis = get_redis(decode_responses=True)
         self._const = OccupEyeConstants()
         self._endpoint = endpoint
 
@@ -31,7 +31,7 @@ class OccupeyeCache:
         """
         survey_maps_list_key = (self._const.SURVEY_MAPS_LIST_KEY).format(survey_id)
         survey_maps_data = self._endpoint.request(self._const.URL_MAPS_BY_SURVEY.format(survey_id))
-        pipeline = self._redis.pipeline()
+        pipeline = self._redis.pipeline(transaction=True)
 
         self.delete_maps(pipeline, survey_id, survey_maps_list_key, survey_maps_data)
 
@@ -55,7 +55,7 @@ class OccupeyeCache:
         the OccupEye system. It makes use of the _cache_maps_for_survey
         helper function above to tie all maps to surveys.
         """
-        pipeline = self._redis.pipeline()
+        pipeline = self._redis.pipeline(transaction=True)
         surveys_data = self._endpoint.request(self._const.URL_SURVEYS)
         self.delete_surveys(pipeline, surveys_data)
         for survey in surveys_data:
@@ -104,8 +104,8 @@ class OccupeyeCache:
         base64 representation and associated data type in Redis.
         """
         image, content_type = self._endpoint.image(image_id)
-        pipeline = self._redis.pipeline()
-        pipeline.set(self._const.IMAGE_BASE64_KEY.format(image_id), image)
+        pipeline = self._redis.pipeline(transaction=True)
+        pipeline.set(self._const.IMAGE_BASE64_KEY.format(image_id), encode_value(image))
         pipeline.set(self._const.IMAGE_CONTENT_TYPE_KEY.format(image_id), content_type)
         pipeline.execute()
 
@@ -131,7 +131,7 @@ class OccupeyeCache:
         about each one by ID)
         """
         all_sensors_data = self._endpoint.request(self._const.URL_SURVEY_DEVICES.format(survey_id))
-        pipeline = self._redis.pipeline()
+        pipeline = self._redis.pipeline(transaction=True)
         survey_sensors_list_key = self._const.SURVEY_SENSORS_LIST_KEY.format(survey_id)
         self.delete_sensors(pipeline, survey_id, survey_sensors_list_key, all_sensors_data)
 
@@ -174,7 +174,7 @@ class OccupeyeCache:
         if not isinstance(all_sensors_data, list):
             logging.info("[-] Survey {} has bad sensor data, ignoring...".format(survey_id))
             return
-        pipeline = self._redis.pipeline()
+        pipeline = self._redis.pipeline(transaction=True)
         for sensor_data in all_sensors_data:
             hardware_id = sensor_data["HardwareID"]
             sensor_status_key = self._const.SURVEY_SENSOR_STATUS_KEY.format(survey_id, hardware_id)
@@ -203,7 +203,7 @@ class OccupeyeCache:
         url = self._const.URL_MAPS.format(map_id)
         all_map_sensors_data = self._endpoint.request(url)
 
-        pipeline = self._redis.pipeline()
+        pipeline = self._redis.pipeline(transaction=True)
         map_sensors_list_key = (self._const.SURVEY_MAP_SENSORS_LIST_KEY).format(survey_id, map_id)
 
         pipeline.delete(map_sensors_list_key)
@@ -282,7 +282,7 @@ class OccupeyeCache:
 
         average_key = self._const.TIMEAVERAGE_KEY.format(survey_id, day_count)
 
-        self._redis.set(average_key, json.dumps(data, sort_keys=True))
+        self._redis.set(average_key, encode_value(json.dumps(data, sort_keys=True)))
 
     def cache_common_summaries(self):
         """
@@ -372,18 +372,18 @@ class OccupeyeCache:
                 # Cache inside a list to match the outer format
                 self._redis.set(
                     self._const.SUMMARY_CACHE_SURVEY.format(survey_id),
-                    json.dumps([{**survey_data}]),
+                    encode_value(json.dumps([{**survey_data}])),
                 )
             surveys.append(survey_data)
 
         # Now we have summary information for every survey
-        self._redis.set(self._const.SUMMARY_CACHE_ALL_SURVEYS, json.dumps(surveys))
+        self._redis.set(self._const.SUMMARY_CACHE_ALL_SURVEYS, encode_value(json.dumps(surveys)))
         self._redis.set(
             self._const.SUMMARY_CACHE_ALL_STAFF_SURVEYS,
-            json.dumps([s for s in surveys if s["staff_survey"]]),
+            encode_value(json.dumps([s for s in surveys if s["staff_survey"]])),
         )
         self.set = self._redis.set(self._const.SUMMARY_CACHE_ALL_STUDENT_SURVEYS,
-                                   json.dumps([s for s in surveys if not s["staff_survey"]]), )
+                                   encode_value(json.dumps([s for s in surveys if not s["staff_survey"]])), )
 
     def feed_cache(self, full):
         """
@@ -398,7 +398,11 @@ class OccupeyeCache:
         if full:
             self.cache_survey_data()
 
-        survey_ids = self._redis.lrange("occupeye:surveys", 0, self._redis.llen("occupeye:surveys") - 1)
+        survey_ids = self._redis.lrange(
+            self._const.SURVEYS_LIST_KEY,
+            0,
+            self._redis.llen(self._const.SURVEYS_LIST_KEY) - 1
+        )
         # Cache all the latest surveys
         logging.info("[+] Surveys")
         for survey_id in survey_ids:
@@ -430,10 +434,9 @@ class OccupeyeCache:
         self.cache_common_summaries()
 
         logging.info("[+] Setting Last-Modified key")
-        last_modified_key = "http:headers:Last-Modified:Workspaces"
-
         current_timestamp = datetime.now(LOCAL_TIMEZONE).isoformat(timespec="seconds")
-        self._redis.set(last_modified_key, current_timestamp)
+        self._redis.set(last_modified_key("Workspaces"), current_timestamp)
+        invalidate_local_cache("occupeye")
 
         logging.info("[+] Done")
 
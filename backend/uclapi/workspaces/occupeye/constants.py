@@ -1,5 +1,7 @@
 import os
 
+from common.redis_client import hash_tag
+
 
 class OccupEyeConstants:
     """
@@ -20,32 +22,38 @@ class OccupEyeConstants:
     PASSWORD = os.getenv("OCCUPEYE_PASSWORD", None)
 
     # Redis Keys
-    ACCESS_TOKEN_KEY = "occupeye:access_token"
-    ACCESS_TOKEN_EXPIRY_KEY = "occupeye:access_token_expiry"
+    # They share a hash tag so that the pipelines that write a survey, and
+    # the summaries of every survey, stay within one slot in cluster mode.
+    # The braces of the tag are doubled in keys that are format strings.
+    _TAG = hash_tag("occupeye")
+    _FORMAT_TAG = _TAG.replace("{", "{{").replace("}", "}}")
+
+    ACCESS_TOKEN_KEY = _TAG + "occupeye:access_token"
+    ACCESS_TOKEN_EXPIRY_KEY = _TAG + "occupeye:access_token_expiry"
 
-    SURVEYS_LIST_KEY = "occupeye:surveys"
-    SURVEY_DATA_KEY = "occupeye:surveys:{}"
-    SURVEY_MAPS_LIST_KEY = "occupeye:surveys:{}:maps"
-    SURVEY_MAP_DATA_KEY = "occupeye:surveys:{}:maps:{}"
-    SURVEY_MAX_TIMESTAMP_KEY = "occupeye:surveys:{}:max_timestamp"
-    SURVEY_SENSORS_LIST_KEY = "occupeye:surveys:{}:sensors"
-    SURVEY_SENSOR_DATA_KEY = "occupeye:surveys:{}:sensors:{}:data"
-    SURVEY_SENSOR_STATUS_KEY = "occupeye:surveys:{}:sensors:{}:status"
-    SURVEY_MAP_SENSORS_LIST_KEY = "occupeye:surveys:{}:maps:{}:sensors"
-    SURVEY_MAP_SENSOR_PROPERTIES_KEY = "occupeye:surveys:{}:maps:{}:sensors:{}:properties"
-    SURVEY_MAP_VMAX_X_KEY = "occupeye:surveys:{}:maps:{}:VMaxX"
-    SURVEY_MAP_VMAX_Y_KEY = "occupeye:surveys:{}:maps:{}:VMaxY"
-    SURVEY_MAP_VIEWBOX_KEY = "occupeye:surveys:{}:maps:{}:viewbox"
+    SURVEYS_LIST_KEY = _TAG + "occupeye:surveys"
+    SURVEY_DATA_KEY = _FORMAT_TAG + "occupeye:surveys:{}"
+    SURVEY_MAPS_LIST_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps"
+    SURVEY_MAP_DATA_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}"
+    SURVEY_MAX_TIMESTAMP_KEY = _FORMAT_TAG + "occupeye:surveys:{}:max_timestamp"
+    SURVEY_SENSORS_LIST_KEY = _FORMAT_TAG + "occupeye:surveys:{}:sensors"
+    SURVEY_SENSOR_DATA_KEY = _FORMAT_TAG + "occupeye:surveys:{}:sensors:{}:data"
+    SURVEY_SENSOR_STATUS_KEY = _FORMAT_TAG + "occupeye:surveys:{}:sensors:{}:status"
+    SURVEY_MAP_SENSORS_LIST_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}:sensors"
+    SURVEY_MAP_SENSOR_PROPERTIES_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}:sensors:{}:properties"
+    SURVEY_MAP_VMAX_X_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}:VMaxX"
+    SURVEY_MAP_VMAX_Y_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}:VMaxY"
+    SURVEY_MAP_VIEWBOX_KEY = _FORMAT_TAG + "occupeye:surveys:{}:maps:{}:viewbox"
 
-    SUMMARY_CACHE_SURVEY = "occupeye:summaries:{}"
-    SUMMARY_CACHE_ALL_SURVEYS = "occupeye:summaries:all"
-    SUMMARY_CACHE_ALL_STUDENT_SURVEYS = "occupeye:summaries:all:student"
-    SUMMARY_CACHE_ALL_STAFF_SURVEYS = "occupeye:summaries:all:staff"
+    SUMMARY_CACHE_SURVEY = _FORMAT_TAG + "occupeye:summaries:{}"
+    SUMMARY_CACHE_ALL_SURVEYS = _TAG + "occupeye:summaries:all"
+    SUMMARY_CACHE_ALL_STUDENT_SURVEYS = _TAG + "occupeye:summaries:all:student"
+    SUMMARY_CACHE_ALL_STAFF_SURVEYS = _TAG + "occupeye:summaries:all:staff"
 
-    IMAGE_BASE64_KEY = "occupeye:image:{}:base64"
-    IMAGE_CONTENT_TYPE_KEY = "occupeye:image:{}:content_type"
+    IMAGE_BASE64_KEY = _FORMAT_TAG + "occupeye:image:{}:base64"
+    IMAGE_CONTENT_TYPE_KEY = _FORMAT_TAG + "occupeye:image:{}:content_type"
 
-    TIMEAVERAGE_KEY = "occupeye:query:timeaverage:{}:{}"
+    TIMEAVERAGE_KEY = _FORMAT_TAG + "occupeye:query:timeaverage:{}:{}"
 
     URL_BASE_DEPLOYMENT = "{}/{}".format(BASE_URL, DEPLOYMENT_NAME)
 
@@ -3,10 +3,8 @@ from abc import ABC, abstractmethod
 from base64 import b64encode
 from collections import defaultdict
 
-import redis
-import requests
-
-from uclapi import settings
+from common.http_client import http_client
+from common.redis_client import get_redis
 from workspaces.occupeye.constants import OccupEyeConstants
 from .token import get_bearer_token
 
@@ -28,7 +26,7 @@ class Endpoint(ABC):
 
 class OccupeyeEndpoint(Endpoint):
     def __init__(self):
-        self._redis = redis.Redis(host=settings.REDIS_UCLAPI_HOST, charset="utf-8", decode_responses=True)
+        self._redis = get_redis(decode_responses=True)
         self._const = OccupEyeConstants()
 
         access_token = self._redis.get(self._const.ACCESS_TOKEN_KEY)
@@ -37,20 +35,20 @@ class OccupeyeEndpoint(Endpoint):
 
     def request(self, url: str):
         headers = {"Authorization": self.bearer_token}
-        r = requests.get(url=url, headers=headers)
+        r = http_client("occupeye").get(url, headers=headers)
         if r.ok:
             return r.json()
         return None
 
     def request_fragment(self, url: str):
         headers = {"Authorization": self.bearer_token}
-        r = requests.get(url=url, headers=headers)
+        r = http_client("occupeye").get(url, headers=headers)
         return r.text.replace("\"", "")
 
     def image(self, image_id: int):
         headers = {"Authorization": self.bearer_token}
         url = self._const.URL_IMAGE.format(image_id)
-        response = requests.get(url=url, headers=headers, stream=True)
+        response = http_client("occupeye").get(url, headers=headers)
         content_type = response.headers["Content-Type"]
 
         raw_image = response.content
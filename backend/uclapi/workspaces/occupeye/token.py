@@ -1,7 +1,7 @@
 import json
 from time import time as time_now
 
-import requests
+from common.http_client import http_client
 
 
 def get_token(consts):
@@ -16,7 +16,7 @@ def get_token(consts):
         "Password": consts.PASSWORD,
     }
 
-    response = requests.post(url=url, data=body)
+    response = http_client("occupeye").post(url, data=body)
 
     response_data = json.loads(response.text)
 
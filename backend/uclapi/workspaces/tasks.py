@@ -4,6 +4,7 @@ import logging
 import requests
 from celery import shared_task
 
+from common.http_client import http_client
 from workspaces.occupeye.archive import OccupEyeArchive
 from workspaces.occupeye.cache import OccupeyeCache
 from workspaces.occupeye.endpoint import TestEndpoint
@@ -36,14 +37,14 @@ def feed_occupeye_archive(test=False, delete=False):
 @shared_task
 def day_cache():
     try:
-        requests.get(os.environ.get("HEALTHCHECK_OCCUPEYE_DAY") + "/start", timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_OCCUPEYE_DAY") + "/start")
     except requests.exceptions.RequestException:
         pass
 
     feed_occupeye_cache.s(mini=True)()
 
     try:
-        requests.get(os.environ.get("HEALTHCHECK_OCCUPEYE_DAY"), timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_OCCUPEYE_DAY"))
     except requests.exceptions.RequestException:
         pass
 
@@ -51,7 +52,7 @@ def day_cache():
 @shared_task
 def night_cache():
     try:
-        requests.get(os.environ.get("HEALTHCHECK_OCCUPEYE_NIGHT") + "/start", timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_OCCUPEYE_NIGHT") + "/start")
     except requests.exceptions.RequestException:
         pass
 
@@ -59,6 +60,6 @@ def night_cache():
     feed_occupeye_archive()
 
     try:
-        requests.get(os.environ.get("HEALTHCHECK_OCCUPEYE_NIGHT"), timeout=5)
+        http_client("healthchecks").get(os.environ.get("HEALTHCHECK_OCCUPEYE_NIGHT"))
     except requests.exceptions.RequestException:
         pass
@@ -8,6 +8,9 @@ from django.conf import settings
 from django.test import TestCase
 from freezegun import freeze_time
 
+from common.local_cache import local_cache
+from common.redis_client import get_redis
+from common.redis_codec import decode_text
 from .occupeye.api import OccupEyeApi
 from .occupeye.cache import OccupeyeCache
 from .occupeye.constants import OccupEyeConstants
@@ -71,6 +74,9 @@ class OccupEyeCacheTestCase(TestCase):
     def redisEqual(self, key, value):
         self.assertEqual(value, self.redis.get(key))
 
+    def redisDecodedEqual(self, key, value):
+        self.assertEqual(value, decode_text(get_redis().get(key)))
+
     def redisDictEqual(self, key, value):
         self.assertDictEqual(value, self.redis.hgetall(key))
 
@@ -191,8 +197,8 @@ class OccupEyeCacheTestCase(TestCase):
     def test_cache_historical_time_usage_data(self):
         self.cache.cache_historical_time_usage_data(99991, 1)
 
-        self.redisEqual(self._const.TIMEAVERAGE_KEY.format(99991, 1),
-                        self.results["test_cache_historical_time_usage_data_1"])
+        self.redisDecodedEqual(self._const.TIMEAVERAGE_KEY.format(99991, 1),
+                               self.results["test_cache_historical_time_usage_data_1"])
 
     def test_cache_common_summaries(self):
         self.cache.feed_cache(full=True)
@@ -225,6 +231,8 @@ class OccupEyeApiTestCase(TestCase):
         self._consts = OccupEyeConstants()
         self.api = OccupEyeApi()
         self.cache = OccupeyeCache(endpoint=TestEndpoint({}))
+        # Each test writes its own data straight into Redis
+        local_cache.clear()
 
         # Create some sample data
         self._data_lpush = {
@@ -3,12 +3,14 @@ from base64 import b64decode
 
 from django.utils.decorators import method_decorator
 from rest_framework import generics
-from rest_framework.decorators import api_view
 from rest_framework.exceptions import ParseError
 
-from common.decorators import uclapi_protected_endpoint
+from common.decorators import simple_api_view, uclapi_protected_endpoint
 from common.helpers import PrettyJsonResponse as JsonResponse, pretty_response
 from common.helpers import RateLimitHttpResponse as HttpResponse
+from common.renderers import BULK_RENDERER_CLASSES
+from common.response_cache import cached_response
+from uclapi.dbrouters import read_from_replicas
 from .image_builder import ImageBuilder
 from .models import Sensors, Historical, Surveys
 from .occupeye.api import OccupEyeApi
@@ -18,8 +20,9 @@ from .pagination import HistoricalListCursorPagination
 from .serializers import SensorsSerializer, HistoricalSerializer, SurveysSerializer
 
 
-@api_view(["GET"])
-@uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
+@simple_api_view(["GET"])
+@uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces", precompress=True)
+@cached_response
 def get_surveys(request, *args, **kwargs):
     api = OccupEyeApi()
     consts = OccupEyeConstants()
@@ -41,8 +44,8 @@ def get_surveys(request, *args, **kwargs):
     return JsonResponse(response_data, custom_header_data=kwargs)
 
 
-@api_view(["GET"])
-@uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
+@simple_api_view(["GET"])
+@uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces", precompress=True)
 def get_map_image(request, *args, **kwargs):
     try:
         image_id = request.GET["image_id"]
@@ -92,7 +95,7 @@ def get_map_image(request, *args, **kwargs):
         return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
 def get_survey_sensors(request, *args, **kwargs):
     try:
@@ -114,7 +117,7 @@ def get_survey_sensors(request, *args, **kwargs):
     return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
 def get_survey_max_timestamp(request, *args, **kwargs):
     try:
@@ -140,7 +143,7 @@ def get_survey_max_timestamp(request, *args, **kwargs):
     return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
 def get_survey_sensors_summary(request, *args, **kwargs):
     survey_ids = request.GET.get("survey_ids", None)
@@ -178,7 +181,7 @@ def get_survey_sensors_summary(request, *args, **kwargs):
     return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
 def get_averages_time(request, *args, **kwargs):
     api = OccupEyeApi()
@@ -256,7 +259,7 @@ def get_averages_time(request, *args, **kwargs):
     return response
 
 
-@api_view(["GET"])
+@simple_api_view(["GET"])
 @uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces")
 def get_live_map(request, *args, **kwargs):
     try:
@@ -361,9 +364,11 @@ def get_live_map(request, *args, **kwargs):
 class SurveysList(generics.ListAPIView):
     queryset = Surveys.objects.all()
     serializer_class = SurveysSerializer
+    renderer_classes = BULK_RENDERER_CLASSES
     filterset_fields = {"survey_id": ["exact"], "active": ["exact"]}
 
     @method_decorator(uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces-Historical"))
+    @method_decorator(read_from_replicas)
     def list(self, request, *args, **kwargs):
         return pretty_response(super().list(request, *args, **kwargs), custom_header_data=kwargs)
 
@@ -371,9 +376,11 @@ class SurveysList(generics.ListAPIView):
 class SensorsList(generics.ListAPIView):
     queryset = Sensors.objects.all()
     serializer_class = SensorsSerializer
+    renderer_classes = BULK_RENDERER_CLASSES
     filterset_fields = {"survey_id": ["exact"], "sensor_id": ["exact"]}
 
     @method_decorator(uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces-Historical"))
+    @method_decorator(read_from_replicas)
     def list(self, request, *args, **kwargs):
         return pretty_response(super().list(request, *args, **kwargs), custom_header_data=kwargs)
 
@@ -381,11 +388,13 @@ class SensorsList(generics.ListAPIView):
 class HistoricalList(generics.ListAPIView):
     queryset = Historical.objects.all().order_by("datetime")
     serializer_class = HistoricalSerializer
+    renderer_classes = BULK_RENDERER_CLASSES
     pagination_class = HistoricalListCursorPagination
     filterset_fields = {"survey_id": ["exact"], "sensor_id": ["exact"],
                         "datetime": ["gte", "lte", "exact", "gt", "lt"]}
 
     @method_decorator(uclapi_protected_endpoint(personal_data=False, last_modified_redis_key="Workspaces-Historical"))
+    @method_decorator(read_from_replicas)
     def list(self, request, *args, **kwargs):
         if self.request.query_params.get("survey_id", None) is None:
             raise ParseError("survey_id is a required field")